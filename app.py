@@ -1,15 +1,29 @@
-from flask import Flask, request, render_template, jsonify
+from flask import (
+    Flask,
+    Response,
+    request,
+    render_template,
+    jsonify,
+    url_for,
+    send_from_directory,
+)
 from dotenv import load_dotenv
+import io
+import gc
 import os
-import tempfile
-import shutil
+import re
+import uuid
 from datetime import datetime
 import pytz
-import smtplib
+import pandas as pd
 from email.message import EmailMessage
 import traceback
 
 from predict_pipeline import ForecastPipeline
+from src.data_loader import SUPPORTED_EXTENSIONS
+from utils.job_queue import JobQueue
+from utils.mail_queue import MailQueue
+from utils.metrics import metrics
 
 load_dotenv()
 # --- Configuration ---
@@ -18,6 +32,9 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 SMTP_USERNAME = os.getenv("SMTP_USERNAME")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 SENDER_EMAIL = os.getenv("SENDER_EMAIL")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 1))
+# Finished jobs, their uploads and outputs are deleted after this many hours
+JOB_MAX_AGE_HOURS = float(os.getenv("JOB_MAX_AGE_HOURS", 24))
 
 # --- App Initialization ---
 app = Flask(__name__, template_folder="templates")
@@ -28,16 +45,131 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_DIR = os.getenv("INPUT_DIR", "input")
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", "output")
 SEND_DIR = os.getenv("SEND_DIR", "send")
+JOB_DIR = os.getenv("JOB_DIR", "jobs")
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
 
 for folder in (INPUT_DIR, OUTPUT_DIR, SEND_DIR):
     os.makedirs(os.path.join(BASE_DIR, folder), exist_ok=True)
 
+# One pipeline per process; with gunicorn --preload the model and the
+# static tables are loaded once in the master and shared by the forked
+# workers. Frozen objects are skipped by the garbage collector, which would
+# otherwise write to their pages and make every worker copy them.
+pipeline = ForecastPipeline()
+pipeline.preload()
+gc.freeze()
+
+# Every worker publishes its metrics to METRICS_DIR for /metrics
+metrics.share(os.path.join(BASE_DIR, METRICS_DIR))
+
+# Forecasts run in the background so web workers stay free for requests
+job_queue = JobQueue(
+    os.path.join(BASE_DIR, JOB_DIR),
+    max_workers=JOB_WORKERS,
+    max_age=JOB_MAX_AGE_HOURS * 3600,
+)
+
+# Mails are queued on disk and delivered by a thread in every worker;
+# sent messages end up in SEND_DIR
+mail_queue = MailQueue(
+    spool_dir=os.path.join(BASE_DIR, SEND_DIR, "queue"),
+    sent_dir=os.path.join(BASE_DIR, SEND_DIR),
+    server=SMTP_SERVER,
+    port=SMTP_PORT,
+    username=SMTP_USERNAME,
+    password=SMTP_PASSWORD,
+)
+
+
+@app.before_request
+def start_mail_queue():
+    # Workers forked by gunicorn start their own delivery thread
+    mail_queue.start()
+
 
 @app.route("/", methods=["GET"])
 def index():
     return render_template("dashboard.html")
 
 
+def build_forecast_email(email, attachment, attachment_filename):
+    msg = EmailMessage()
+    msg["Subject"] = "Enerji Tahmin Sonuçlarınız"
+    msg["From"] = SENDER_EMAIL
+    msg["To"] = email
+    msg.set_content(
+        "Merhaba,\n\nEnerji tahmin sonuçlarınız ektedir.\n\nİyi çalışmalar."
+    )
+    msg.add_attachment(
+        attachment,
+        maintype="application",
+        subtype="vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=attachment_filename,
+    )
+    return msg
+
+
+def output_filename_for(run_id):
+    return "{}_output.xlsx".format(run_id)
+
+
+def deliver_output(output, email, run_id):
+    """
+    Save the xlsx output for the result endpoint and queue it for mailing.
+
+    Returns:
+        dict: Job result with the output file name and the mail id
+    """
+    output_filename = output_filename_for(run_id)
+    with open(os.path.join(BASE_DIR, OUTPUT_DIR, output_filename), "wb") as f:
+        f.write(output)
+
+    email_id = mail_queue.enqueue(
+        build_forecast_email(email, output, output_filename),
+        name="{}_send_to_client".format(run_id),
+    )
+    return {"output": output_filename, "email_id": email_id}
+
+
+def run_forecast_job(input_path, email, run_id, progress):
+    with metrics.recorder(run_id, progress) as progress:
+        output_df = pipeline.run(input_path, run_id, progress=progress)
+
+        # The workbook is built in memory
+        output = io.BytesIO()
+        output_df.to_excel(output)  # include index
+
+        progress("email")
+        return deliver_output(output.getvalue(), email, run_id)
+
+
+def run_batch_forecast_job(input_paths, sheet_names, email, run_id, progress):
+    with metrics.recorder(run_id, progress) as progress:
+        output_dfs = pipeline.run_batch(input_paths, run_id, progress=progress)
+
+        # One sheet per uploaded series
+        output = io.BytesIO()
+        with pd.ExcelWriter(output) as writer:
+            for sheet_name, output_df in zip(sheet_names, output_dfs):
+                output_df.to_excel(writer, sheet_name=sheet_name)  # include index
+
+        progress("email")
+        return deliver_output(output.getvalue(), email, run_id)
+
+
+def sheet_names_for(filenames):
+    """
+    Excel sheet names (at most 31 characters, unique) from upload names.
+    """
+    names = []
+    for i, filename in enumerate(filenames):
+        name = re.sub(r"[\\/*?:\[\]]", "_", os.path.splitext(filename)[0])[:31]
+        if not name or name in names:
+            name = "{}_{}".format(name[:26], i + 1)
+        names.append(name)
+    return names
+
+
 @app.route("/analyze", methods=["POST"])
 def analyze():
     try:
@@ -46,9 +178,13 @@ def analyze():
                 {"status": "error", "message": "Dosya bulunamadı veya adı boş"}
             ), 400
         file = request.files["file"]
-        if not file.filename.lower().endswith(".xlsx"):
+        extension = os.path.splitext(file.filename)[1].lower()
+        if extension not in SUPPORTED_EXTENSIONS:
             return jsonify(
-                {"status": "error", "message": "Yalnızca .xlsx dosya yükleyebilirsiniz"}
+                {
+                    "status": "error",
+                    "message": "Yalnızca .xlsx, .csv veya .parquet dosya yükleyebilirsiniz",
+                }
             ), 400
 
         email = request.form.get("email")
@@ -59,59 +195,96 @@ def analyze():
 
         tz = pytz.timezone("Europe/Istanbul")
         timestamp = datetime.now(tz).strftime("%d_%m_%Y_%H_%M")
+        # Several jobs can start within the same minute, keep their files apart
+        run_id = "{}_{}".format(timestamp, uuid.uuid4().hex[:8])
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            temp_input = os.path.join(tmpdir, "input.xlsx")
-            file.save(temp_input)
-            pipeline = ForecastPipeline()
-            output_df = pipeline.run(temp_input, timestamp)
-
-            msg = EmailMessage()
-            msg["Subject"] = "Enerji Tahmin Sonuçlarınız"
-            msg["From"] = SENDER_EMAIL
-            msg["To"] = email
-            msg.set_content(
-                "Merhaba,\n\nEnerji tahmin sonuçlarınız ektedir.\n\nİyi çalışmalar."
-            )
+        input_path = os.path.join(
+            BASE_DIR, INPUT_DIR, "{}_input{}".format(run_id, extension)
+        )
+        file.save(input_path)
+        output_path = os.path.join(BASE_DIR, OUTPUT_DIR, output_filename_for(run_id))
 
-            output_filename = "{}_output.xlsx".format(timestamp)
-            temp_output = os.path.join(tmpdir, output_filename)
-            output_df.to_excel(temp_output)  # include index
-
-            with open(temp_output, "rb") as f:
-                data = f.read()
-            msg.add_attachment(
-                data,
-                maintype="application",
-                subtype="vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                filename=output_filename,
-            )
+        job_id = job_queue.submit(
+            lambda progress: run_forecast_job(input_path, email, run_id, progress),
+            stages=ForecastPipeline.STAGES + ["email"],
+            run_id=run_id,
+            files=[input_path, output_path],
+        )
 
-            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                server.starttls()
-                server.login(SMTP_USERNAME, SMTP_PASSWORD)
-                server.send_message(msg)
+        return jsonify(
+            {
+                "status": "queued",
+                "message": "Analiz kuyruğa alındı, sonuç mailinize iletilecek",
+                "job_id": job_id,
+                "status_url": url_for("job_status", job_id=job_id),
+            }
+        ), 202
 
-            final_input = os.path.join(
-                BASE_DIR, "input", "{}_input.xlsx".format(timestamp)
-            )
-            os.replace(temp_input, final_input)
-            final_output = os.path.join(BASE_DIR, "output", output_filename)
-            os.replace(temp_output, final_output)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify(
+            {
+                "status": "error",
+                "message": "İşlem sırasında hata oluştu: {}".format(str(e)),
+            }
+        ), 500
 
-            send_eml = os.path.join(
-                BASE_DIR, "send", "{}_send_to_client.eml".format(timestamp)
-            )
-            with open(send_eml, "wb") as f:
-                f.write(msg.as_bytes())
-            send_xlsx = os.path.join(
-                BASE_DIR, "send", "{}_send_to_client.xlsx".format(timestamp)
+
+@app.route("/analyze_batch", methods=["POST"])
+def analyze_batch():
+    try:
+        files = [file for file in request.files.getlist("files") if file.filename]
+        if not files:
+            return jsonify(
+                {"status": "error", "message": "Dosya bulunamadı veya adı boş"}
+            ), 400
+        extensions = [os.path.splitext(file.filename)[1].lower() for file in files]
+        if any(extension not in SUPPORTED_EXTENSIONS for extension in extensions):
+            return jsonify(
+                {
+                    "status": "error",
+                    "message": "Yalnızca .xlsx, .csv veya .parquet dosya yükleyebilirsiniz",
+                }
+            ), 400
+
+        email = request.form.get("email")
+        if not email:
+            return jsonify(
+                {"status": "error", "message": "E-posta adresi gerekli"}
+            ), 400
+
+        tz = pytz.timezone("Europe/Istanbul")
+        timestamp = datetime.now(tz).strftime("%d_%m_%Y_%H_%M")
+        run_id = "{}_{}".format(timestamp, uuid.uuid4().hex[:8])
+
+        input_paths = []
+        for i, (file, extension) in enumerate(zip(files, extensions)):
+            input_path = os.path.join(
+                BASE_DIR, INPUT_DIR, "{}_{}_input{}".format(run_id, i, extension)
             )
-            shutil.copyfile(final_output, send_xlsx)
+            file.save(input_path)
+            input_paths.append(input_path)
+        sheet_names = sheet_names_for([file.filename for file in files])
+        output_path = os.path.join(BASE_DIR, OUTPUT_DIR, output_filename_for(run_id))
+
+        job_id = job_queue.submit(
+            lambda progress: run_batch_forecast_job(
+                input_paths, sheet_names, email, run_id, progress
+            ),
+            stages=ForecastPipeline.STAGES + ["email"],
+            run_id=run_id,
+            series=sheet_names,
+            files=input_paths + [output_path],
+        )
 
         return jsonify(
-            {"status": "ok", "message": "Sonuç iletildi, mailinizi kontrol edin"}
-        ), 200
+            {
+                "status": "queued",
+                "message": "Analiz kuyruğa alındı, sonuç mailinize iletilecek",
+                "job_id": job_id,
+                "status_url": url_for("job_status", job_id=job_id),
+            }
+        ), 202
 
     except Exception as e:
         traceback.print_exc()
@@ -123,5 +296,44 @@ def analyze():
         ), 500
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "İş bulunamadı"}), 404
+
+    response = {
+        "status": "ok",
+        "job_id": job["id"],
+        "state": job["state"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "stages": job["stages"],
+        "error": job["error"],
+        "result_url": None,
+        "email": None,
+    }
+    if job["state"] == "done":
+        response["result_url"] = url_for("job_result", job_id=job_id)
+        response["email"] = mail_queue.status(job["result"].get("email_id"))
+    return jsonify(response), 200
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None or job["state"] != "done":
+        return jsonify({"status": "error", "message": "Sonuç henüz hazır değil"}), 404
+    return send_from_directory(
+        os.path.join(BASE_DIR, OUTPUT_DIR), job["result"]["output"], as_attachment=True
+    )
+
+
 if __name__ == "__main__":
     app.run(debug=False)
@@ -0,0 +1,380 @@
+"""
+Stage-level benchmark of the forecast data preparation.
+
+Runs the stages of ``DataPrepare`` on a synthetic consumption series of 1 to
+10 years, with EPİAŞ and Open-Meteo answered by the local stand-ins, and
+reports the time of every stage. The fastest repeat of each stage is
+compared with a stored baseline; the run fails when a stage got slower than
+the tolerance allows.
+
+    python -m benchmarks.run --years 3 --repeat 3
+    python -m benchmarks.run --years 3 --save-baseline
+
+Runs are cold by default (empty stores and caches, like the first upload of
+a day); ``--warm`` measures an upload after a previous one on the same day.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from contextlib import contextmanager, redirect_stdout
+from statistics import median
+from unittest import mock
+import pandas as pd
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from benchmarks.synthetic import MIN_YEARS, MAX_YEARS, write_input  # noqa: E402
+from benchmarks.stand_ins import LocalEpiasClient, local_open_meteo  # noqa: E402
+from src import DataPrePare as data_prepare_module  # noqa: E402
+from src.DataPrePare import DataPrepare  # noqa: E402
+from src.calendar_data import CalendarDataProcessor  # noqa: E402
+from utils.data_prepare_config import data_prepare_config  # noqa: E402
+from utils.data_prepare_functions import DataPrepareFunctions  # noqa: E402
+from utils.model_registry import model_registry  # noqa: E402
+
+STAGES = [
+    "load",
+    "consumption",
+    "epias",
+    "solar",
+    "calendar",
+    "weather",
+    "main_data_prepare",
+    "process_save_main_data",
+    "score",
+]
+
+CONFIG_PATH = os.path.join(PROJECT_DIR, "utils", "config.json")
+DEFAULT_BASELINE = os.path.join(PROJECT_DIR, "benchmarks", "baseline.json")
+
+# Store and cache paths of the config, pointed into the work directory
+STORE_PATHS = [
+    ("epias", "store", "path"),
+    ("epias", "store", "features_path"),
+    ("epias", "client", "ticket_path"),
+    ("epias", "fetch", "bucket_path"),
+    ("solar", "cache_dir"),
+    ("historical_weather", "archive_dir"),
+    ("exogenous_store", "path"),
+]
+
+
+def model_config():
+    """
+    Model path (single model or bundle) and ensemble weights of the config.
+    """
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        model_cfg = json.load(f)["model"]
+    return os.path.join(PROJECT_DIR, model_cfg["path"]), model_cfg["weights"]
+
+
+class Stopwatch:
+    """
+    Progress callback that adds the wall time between calls to the stage
+    named in the previous call.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self._stage = None
+        self._started_at = None
+
+    def __call__(self, stage):
+        self.stop()
+        self._stage = stage
+        self._started_at = time.perf_counter()
+
+    def stop(self):
+        if self._stage is not None:
+            elapsed = time.perf_counter() - self._started_at
+            self.seconds[self._stage] = self.seconds.get(self._stage, 0.0) + elapsed
+        self._stage = None
+
+
+def benchmark_config(data, work_dir, compact=None):
+    """
+    The app config for ``data`` with every store inside ``work_dir`` and
+    the EPİAŞ rate limit lifted (the stand-in answers instantly).
+    ``compact`` overrides the memory mode of the config.
+    """
+    config = data_prepare_config(CONFIG_PATH, data_df=data)
+    if compact is not None:
+        config["memory"]["compact"] = compact
+    for path in STORE_PATHS:
+        section = config
+        for key in path[:-1]:
+            section = section[key]
+        section[path[-1]] = os.path.join(work_dir, section[path[-1]])
+    config["epias"]["fetch"]["rate_per_second"] = 1e6
+    config["epias"]["fetch"]["burst"] = 1e6
+    return config
+
+
+def run_once(input_path, work_dir, compact=None):
+    """
+    Run every stage once and return the seconds per stage.
+    """
+    stopwatch = Stopwatch()
+    prepare = DataPrepare(
+        input_path,
+        CONFIG_PATH,
+        os.path.join(work_dir, "historical_data"),
+        os.path.join(work_dir, "forecast_data"),
+    )
+
+    stopwatch("load")
+    data = prepare.load_data(input_path)
+    config = benchmark_config(data, work_dir, compact=compact)
+    prepare_functions = DataPrepareFunctions(compact=config["memory"]["compact"])
+
+    stopwatch("consumption")
+    consumption = prepare_functions.compact_frame(
+        prepare.consumption_data(config, data)
+    )
+
+    # Aligning the exogenous frames is counted as main data preparation
+    exogenous_data_prepare = prepare_functions.exogenous_data_prepare
+
+    def timed_exogenous_data_prepare(*args):
+        stopwatch("main_data_prepare")
+        return exogenous_data_prepare(*args)
+
+    prepare_functions.exogenous_data_prepare = timed_exogenous_data_prepare
+    exogenous_df = prepare.exogenous_data(config, prepare_functions, stopwatch)
+
+    stopwatch("main_data_prepare")
+    df = prepare_functions.main_data_prepare(data, consumption, exogenous_df)
+
+    stopwatch("process_save_main_data")
+    df, forecast_path = prepare_functions.process_save_main_data(
+        df, prepare.historical_path, prepare.forecast_path
+    )
+
+    # Scoring like ForecastPipeline.run, with the model already loaded
+    stopwatch("score")
+    forecast_df = pd.read_parquet(forecast_path)
+    model = model_registry.get(*model_config())
+    model.predict(forecast_df.drop(columns=["consumption"], errors="ignore"))
+    stopwatch.stop()
+
+    return stopwatch.seconds
+
+
+@contextmanager
+def local_services():
+    """
+    Answer EPİAŞ and Open-Meteo from the local stand-ins and provide dummy
+    credentials, so the benchmark never leaves the machine.
+    """
+    client = LocalEpiasClient()
+    with (
+        mock.patch.dict(
+            os.environ,
+            {"EPIAS_USERNAME": client.username, "EPIAS_PASSWORD": client.password},
+        ),
+        mock.patch.object(
+            data_prepare_module, "get_epias_client", lambda *args, **kwargs: client
+        ),
+        local_open_meteo(),
+    ):
+        yield
+
+
+def run_benchmark(years, repeat, warm=False, input_format="xlsx", compact=None):
+    """
+    Run the stages ``repeat`` times on a synthetic series of ``years``.
+
+    Returns:
+        dict: Stage name -> list of seconds, one per repeat
+    """
+    model_path, weights = model_config()
+    model_registry.preload(model_path, weights=weights)
+    timings = {stage: [] for stage in STAGES}
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory(prefix="forecast-bench-") as tmp_dir:
+        input_path = write_input(
+            os.path.join(tmp_dir, f"consumption.{input_format}"), years
+        )
+        try:
+            with local_services():
+                if warm:
+                    # The first upload of the day fills the stores
+                    work_dir = os.path.join(tmp_dir, "warm")
+                    os.makedirs(work_dir)
+                    os.chdir(work_dir)
+                    run_once(input_path, work_dir, compact=compact)
+
+                for i in range(repeat):
+                    if not warm:
+                        work_dir = os.path.join(tmp_dir, f"cold_{i}")
+                        os.makedirs(work_dir)
+                        os.chdir(work_dir)
+                        CalendarDataProcessor._cache.clear()
+                    seconds = run_once(input_path, work_dir, compact=compact)
+                    for stage in STAGES:
+                        timings[stage].append(seconds.get(stage, 0.0))
+        finally:
+            os.chdir(cwd)
+
+    return timings
+
+
+def baseline_key(years, warm, compact=None):
+    key = f"{years}y-{'warm' if warm else 'cold'}"
+    return f"{key}-compact" if compact else key
+
+
+def load_baseline(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path, key, timings):
+    baseline = load_baseline(path)
+    baseline[key] = {stage: round(min(values), 4) for stage, values in timings.items()}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def compare(timings, baseline, tolerance, min_delta):
+    """
+    Compare the fastest repeat of every stage with the baseline.
+
+    A stage regresses when it is more than ``tolerance`` (relative) and
+    ``min_delta`` seconds slower than its baseline.
+
+    Returns:
+        list: One row per stage (stage, min, median, baseline, change,
+        regressed)
+    """
+    rows = []
+    for stage in STAGES:
+        best = min(timings[stage])
+        base = baseline.get(stage)
+        change = None if not base else best / base - 1
+        regressed = (
+            base is not None
+            and best > base * (1 + tolerance)
+            and best - base > min_delta
+        )
+        rows.append(
+            {
+                "stage": stage,
+                "min": best,
+                "median": median(timings[stage]),
+                "baseline": base,
+                "change": change,
+                "regressed": regressed,
+            }
+        )
+    return rows
+
+
+def format_table(rows):
+    lines = [
+        f"{'stage':<24}{'min s':>10}{'median s':>10}{'baseline s':>12}{'change':>9}"
+    ]
+    for row in rows:
+        base = "-" if row["baseline"] is None else f"{row['baseline']:.3f}"
+        change = "-" if row["change"] is None else f"{row['change']:+.0%}"
+        flag = "  REGRESSION" if row["regressed"] else ""
+        lines.append(
+            f"{row['stage']:<24}{row['min']:>10.3f}{row['median']:>10.3f}"
+            f"{base:>12}{change:>9}{flag}"
+        )
+    total = sum(row["min"] for row in rows)
+    lines.append(f"{'total':<24}{total:>10.3f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--years",
+        type=int,
+        default=3,
+        choices=range(MIN_YEARS, MAX_YEARS + 1),
+        metavar=f"{{{MIN_YEARS}..{MAX_YEARS}}}",
+        help="Length of the synthetic consumption series",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Measured runs; the first one also builds the stand-in responses",
+    )
+    parser.add_argument(
+        "--warm", action="store_true", help="Measure with the stores already filled"
+    )
+    parser.add_argument(
+        "--input-format", default="xlsx", choices=["xlsx", "csv", "parquet"]
+    )
+    parser.add_argument(
+        "--compact",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Run in the memory-lean float32 mode (default: as in the config)",
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store this run as the baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed relative slowdown"
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=0.1,
+        help="Slowdowns below this many seconds are never regressions",
+    )
+    parser.add_argument("--format", default="table", choices=["table", "json"])
+    args = parser.parse_args(argv)
+
+    # The pipeline reports progress with print; keep stdout for the JSON
+    log = sys.stderr if args.format == "json" else sys.stdout
+    with redirect_stdout(log):
+        timings = run_benchmark(
+            args.years,
+            args.repeat,
+            warm=args.warm,
+            input_format=args.input_format,
+            compact=args.compact,
+        )
+    key = baseline_key(args.years, args.warm, args.compact)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, key, timings)
+        baseline = {}
+    else:
+        baseline = load_baseline(args.baseline).get(key, {})
+    rows = compare(timings, baseline, args.tolerance, args.min_delta)
+
+    if args.format == "json":
+        print(json.dumps({"key": key, "stages": rows}, indent=2))
+    else:
+        print(f"\n{key}, {args.repeat} run(s)")
+        print(format_table(rows))
+        if args.save_baseline:
+            print(f"Baseline saved to {args.baseline}")
+        elif not baseline:
+            print(f"No baseline for {key} in {args.baseline}")
+
+    return 1 if any(row["regressed"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import requests
+import openmeteo_requests
+from src.epias_data import EPIAS_DATASETS
+
+# Hours before now that the Open-Meteo archive has no data for yet
+ARCHIVE_DELAY_HOURS = 5 * 24
+
+_WEATHER_CODES = np.array([0, 1, 2, 3, 45, 51, 61, 63, 71, 80, 95, 3], dtype="float64")
+
+
+def _hours(start, end):
+    return pd.date_range(start, end, freq="h")
+
+
+def _epoch_hours(dates):
+    return dates.as_unit("ns").asi8 // 3_600_000_000_000
+
+
+class LocalEpiasClient:
+    """
+    Stand-in for ``EpiasClient`` that answers from deterministic fixtures.
+
+    Every service returns one value per hour of the requested range, up to
+    the end of tomorrow, derived from the hour itself, so repeated and
+    overlapping requests agree like the real service.
+    """
+
+    username = "benchmark"
+    password = "benchmark"
+
+    def __init__(self):
+        self._fields = {
+            spec["url"]: (dataset, spec["field"])
+            for dataset, spec in EPIAS_DATASETS.items()
+        }
+        # Bodies are built on the first request and reused by later repeats
+        self._responses = {}
+        self.requests = 0
+
+    def get_tgt(self, stale=None):
+        return "TGT-benchmark"
+
+    def post(self, url, body):
+        key = (url, body["startDate"], str(body["endDate"]))
+        content = self._responses.get(key)
+        if content is None:
+            content = self._content(url, body)
+            self._responses[key] = content
+        self.requests += 1
+
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = content
+        return response
+
+    def _content(self, url, body):
+        dataset, field = self._fields[url]
+        start = pd.Timestamp(body["startDate"][:19])
+        end = pd.Timestamp(str(body["endDate"])[:19]).normalize() + pd.Timedelta(
+            hours=23
+        )
+        end = min(end, pd.Timestamp.now().normalize() + pd.Timedelta(hours=47))
+        dates = _hours(start, end)
+        keys = _epoch_hours(dates)
+        values = 5000 + 800 * np.sin(keys / 24 * 2 * np.pi) + (keys * len(dataset)) % 97
+        stamps = np.char.add(
+            np.datetime_as_string(dates.to_numpy(), unit="s"), "+03:00"
+        )
+        items = pd.DataFrame({"date": stamps, field: values}).to_json(orient="records")
+        return b'{"items": ' + items.encode("utf-8") + b"}"
+
+
+class _Variable:
+    def __init__(self, values):
+        self._values = values
+
+    def ValuesAsNumpy(self):
+        return self._values
+
+
+class _Hourly:
+    def __init__(self, start, end, variables):
+        self._start = start
+        self._end = end
+        self._variables = variables
+
+    def Time(self):
+        return self._start
+
+    def TimeEnd(self):
+        return self._end
+
+    def Interval(self):
+        return 3600
+
+    def Variables(self, i):
+        return _Variable(self._variables[i])
+
+
+class LocalWeatherResponse:
+    """
+    Stand-in for one location of an Open-Meteo ``WeatherApiResponse``; only
+    the hourly block read by ``hourly_frame`` is provided.
+    """
+
+    def __init__(self, lat, lon, start_date, end_date, variables, archive=False):
+        start = pd.Timestamp(start_date, tz="Europe/Istanbul")
+        end = pd.Timestamp(end_date, tz="Europe/Istanbul") + pd.Timedelta(days=1)
+        dates = pd.date_range(start, end, freq="h", inclusive="left")
+        keys = _epoch_hours(dates).astype("float64")
+        phase = (lat * 1000 + lon * 7) % 1000
+
+        columns = []
+        for i, _ in enumerate(variables):
+            values = 15 + i + 12 * np.sin(keys / 24 * 2 * np.pi + phase)
+            values += 8 * np.cos(keys / (365 * 24) * 2 * np.pi)
+            if i == 1:
+                values = 40 + 30 * np.abs(np.sin(keys / 17 + phase))
+            elif i == 6:
+                values = _WEATHER_CODES[keys.astype("int64") % len(_WEATHER_CODES)]
+            elif i == 9:
+                values = (keys * 37) % 360
+            columns.append(values.astype("float32"))
+
+        if archive:
+            # The archive lags a few days behind
+            missing = dates >= pd.Timestamp.now(tz="Europe/Istanbul") - pd.Timedelta(
+                hours=ARCHIVE_DELAY_HOURS
+            )
+            for values in columns:
+                values[missing] = np.nan
+
+        self._hourly = _Hourly(int(start.timestamp()), int(end.timestamp()), columns)
+
+    def Hourly(self):
+        return self._hourly
+
+
+def local_weather_api(self, url, params, **kwargs):
+    """
+    Replacement of ``openmeteo_requests.Client.weather_api``.
+    """
+    lats, lons = params["latitude"], params["longitude"]
+    if not isinstance(lats, (list, tuple)):
+        lats, lons = [lats], [lons]
+    archive = "archive" in url
+    return [
+        LocalWeatherResponse(
+            lat,
+            lon,
+            params["start_date"],
+            params["end_date"],
+            params["hourly"],
+            archive=archive,
+        )
+        for lat, lon in zip(lats, lons)
+    ]
+
+
+@contextmanager
+def local_open_meteo():
+    """
+    Serve every Open-Meteo request of the block from ``local_weather_api``.
+    """
+    original = openmeteo_requests.Client.weather_api
+    openmeteo_requests.Client.weather_api = local_weather_api
+    try:
+        yield
+    finally:
+        openmeteo_requests.Client.weather_api = original
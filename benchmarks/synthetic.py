@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+MIN_YEARS = 1
+MAX_YEARS = 10
+
+
+def synthetic_consumption(years: int, end_date=None, seed: int = 0) -> pd.DataFrame:
+    """
+    Hourly consumption in the upload format (``date``, ``time``,
+    ``consumption``) with daily, weekly and yearly seasonality plus noise.
+
+    Args:
+        years (int): Length of the series in years (365 days each), 1 to 10
+        end_date (optional): Last day of the series, yesterday by default
+        seed (int): Seed of the noise
+
+    Returns:
+        pd.DataFrame: One row per hour
+    """
+    if not MIN_YEARS <= years <= MAX_YEARS:
+        raise ValueError(f"years must be between {MIN_YEARS} and {MAX_YEARS}")
+
+    if end_date is None:
+        end_date = pd.Timestamp.now().normalize() - pd.Timedelta(days=1)
+    end_date = pd.Timestamp(end_date).normalize()
+    days = pd.date_range(end=end_date, periods=365 * years, freq="D")
+
+    dates = np.repeat(days.to_numpy(), 24)
+    hours = np.tile(np.arange(24), len(days))
+    hour_of_year = (pd.DatetimeIndex(dates).dayofyear.to_numpy() - 1) * 24 + hours
+    day_of_week = pd.DatetimeIndex(dates).dayofweek.to_numpy()
+
+    rng = np.random.default_rng(seed)
+    consumption = (
+        1000
+        + 250 * np.sin((hours - 6) / 24 * 2 * np.pi)
+        - 120 * (day_of_week >= 5)
+        + 180 * np.cos(hour_of_year / (365 * 24) * 2 * np.pi)
+        + rng.normal(0, 25, len(dates))
+    )
+    return pd.DataFrame({"date": dates, "time": hours, "consumption": consumption})
+
+
+def write_input(path: str, years: int, end_date=None, seed: int = 0) -> str:
+    """
+    Write a synthetic upload as ``.xlsx``, ``.csv`` or ``.parquet`` (by the
+    extension of ``path``) and return the path.
+    """
+    df = synthetic_consumption(years, end_date=end_date, seed=seed)
+    if path.endswith(".csv"):
+        df.to_csv(path, index=False)
+    elif path.endswith(".parquet"):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_excel(path, index=False)
+    return path
@@ -1,19 +1,30 @@
 import os
+import json
 import glob
-import shutil
 import pandas as pd
-import catboost as cb
 from src.DataPrePare import DataPrepare
+from src.result_cache import (
+    ResultCache,
+    config_hash,
+    data_date,
+    result_key,
+    series_hash,
+)
+from utils.data_prepare_config import data_prepare_config
+from utils.data_prepare_functions import DataPrepareFunctions
+from utils.metrics import metrics
+from utils.model_registry import model_registry
 
 
 class ForecastPipeline:
+    STAGES = DataPrepare.STAGES + ["predict"]
+
     def __init__(self):
         self.BASE_DIR = os.path.dirname(os.path.abspath(__file__))
         self.config_path = os.path.join(self.BASE_DIR, "utils", "config.json")
         # Flat directories with underscores
         self.historical_path = os.path.join(self.BASE_DIR, "data", "historical_data")
         self.forecast_path = os.path.join(self.BASE_DIR, "data", "forecast_data")
-        self.model_path = os.path.join(self.BASE_DIR, "models", "exp_model.cbm")
         # Ensure directories exist (create if missing, do nothing if present)
         os.makedirs(self.historical_path, exist_ok=True)
         os.makedirs(self.forecast_path, exist_ok=True)
@@ -21,14 +32,92 @@ class ForecastPipeline:
         self.DP = DataPrepare(
             None, self.config_path, self.historical_path, self.forecast_path
         )
+        with open(self.config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        # A .cbm file or a bundle of fold models scored as one ensemble;
+        # weights (one per bundle model) override those of the bundle
+        self.model_path = os.path.join(self.BASE_DIR, config["model"]["path"])
+        self.model_weights = config["model"]["weights"]
+        # Forecasts of identical uploads are served from the result cache
+        cache_cfg = config["result_cache"]
+        self.result_cache = ResultCache(
+            os.path.join(self.BASE_DIR, cache_cfg["path"]),
+            max_age=cache_cfg["max_age_hours"] * 3600,
+            max_bytes=cache_cfg["max_size_mb"] * 1024 * 1024,
+        )
+
+    def preload(self):
+        """
+        Load the model into the process-wide registry and build the static
+        tables ahead of the first run.
+        """
+        model_registry.preload(self.model_path, weights=self.model_weights)
+        self.DP.preload(self.config_path)
+
+    def remove_old_day_dirs(self):
+        """
+        Remove the emptied day folders ``DataPrepare`` wrote to on earlier
+        days. The folder of the current day is kept, runs in progress may
+        still write into it.
+        """
+        today = DataPrepareFunctions().current_day
+        for day_dir in glob.glob(os.path.join(self.historical_path, "*", "")):
+            if os.path.basename(os.path.dirname(day_dir)) >= today:
+                continue
+            for sub_dir in ("Historical_Data", "Forecast_Data", ""):
+                try:
+                    os.rmdir(os.path.join(day_dir, sub_dir))
+                except OSError:
+                    # Not empty or already removed
+                    pass
+
+    def result_keys(self, datas: list) -> list:
+        """
+        Result cache keys of loaded consumption series: the series, the
+        model version, the config and the data date (EPİAŞ end date and
+        forecast weather issue) of a run started now.
+        """
+        with open(self.config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        date = data_date(data_prepare_config(self.config_path))
+        model_version = model_registry.version(self.model_path, self.model_weights)
+        return [
+            result_key(series_hash(data), model_version, config_hash(config), date)
+            for data in datas
+        ]
+
+    def cached_results(self, datas: list):
+        """
+        Look up the forecasts of loaded series in the result cache.
+
+        Returns:
+            tuple: Result keys and the cached forecast per series (None on
+            a miss)
+        """
+        keys = self.result_keys(datas)
+        cached = [self.result_cache.get(key) for key in keys]
+        for output_df in cached:
+            result = "miss" if output_df is None else "hit"
+            metrics.inc("result_cache_total", {"result": result})
+        return keys, cached
+
+    def run(self, input_path: str, timestamp: str, progress=None) -> pd.DataFrame:
+        if progress is not None:
+            progress("load")
+        data = self.DP.load_data(input_path)
+        (key,), (output_df,) = self.cached_results([data])
+        if output_df is not None:
+            print("Aynı veri için hesaplanmış tahmin kullanıldı")
+            return output_df
 
-    def run(self, input_path: str, timestamp: str) -> pd.DataFrame:
         # Prepare data; returns DataFrame and raw forecast parquet path
-        df, forecast_parquet = self.DP.DataPrepareFunction(
+        _, forecast_parquet = self.DP.DataPrepareFunction(
             input_path,
             self.config_path,
             self.historical_path,
             self.forecast_path,
+            progress=progress,
+            data=data,
         )
 
         # Move and rename forecast parquet to flat forecast_data folder
@@ -37,38 +126,110 @@ class ForecastPipeline:
         )
         os.replace(forecast_parquet, forecast_target)
 
-        # Handle nested historical parquet if present
-        nested = glob.glob(
-            os.path.join(self.historical_path, "*", "Historical_Data", "*.parquet")
+        # The historical parquet of this run sits next to its forecast one;
+        # other runs may be writing into the same day folder
+        hist_target = os.path.join(
+            self.historical_path, f"{timestamp}_historical_data.parquet"
         )
-        if nested:
-            orig_hist = nested[0]
-            hist_target = os.path.join(
-                self.historical_path, f"{timestamp}_historical_data.parquet"
-            )
-            os.replace(orig_hist, hist_target)
-            # Clean up nested folder
-            nested_date_dir = os.path.dirname(os.path.dirname(orig_hist))
-            shutil.rmtree(nested_date_dir, ignore_errors=True)
-        else:
-            # Fallback: write df to parquet
-            hist_target = os.path.join(
-                self.historical_path, f"{timestamp}_historical_data.parquet"
-            )
-            df.to_parquet(hist_target)
+        os.replace(
+            forecast_parquet.replace("Forecast_Data", "Historical_Data"), hist_target
+        )
+        self.remove_old_day_dirs()
 
         # Load forecast data and predict
+        if progress is not None:
+            progress("predict")
         forecast_df = pd.read_parquet(forecast_target)
-        model = cb.CatBoostRegressor()
-        model.load_model(self.model_path)
+        model = model_registry.get(self.model_path, self.model_weights)
         features = forecast_df.drop(columns=["consumption"], errors="ignore")
         predictions = model.predict(features)
         output_df = pd.DataFrame(
             predictions, columns=["Predicted_Consumption"], index=forecast_df.index
         )
         output_df = output_df.iloc[-24:, :]  # Keep only the last 24 hours
+        output_df.index = output_df.index.strftime("%Y-%m-%d %H:%M")
+        self.result_cache.put(key, output_df)
         return output_df
 
+    def run_batch(self, input_paths: list, timestamp: str, progress=None) -> list:
+        """
+        Forecast several consumption series with one exogenous build and one
+        model call.
+
+        Series found in the result cache are not prepared again.
+
+        Args:
+            input_paths (list): Consumption files, one per series
+            timestamp (str): Run id used in the stored file names
+
+        Returns:
+            list: One forecast frame per input, in order (same format as
+            ``run``)
+        """
+        if progress is not None:
+            progress("load")
+        datas = [self.DP.load_data(input_path) for input_path in input_paths]
+        keys, output_dfs = self.cached_results(datas)
+        missing = [i for i, output_df in enumerate(output_dfs) if output_df is None]
+        if len(missing) < len(input_paths):
+            print(
+                f"{len(input_paths) - len(missing)} seri için hesaplanmış tahmin "
+                "kullanıldı"
+            )
+        if not missing:
+            return output_dfs
+
+        results = self.DP.DataPrepareBatch(
+            [input_paths[i] for i in missing],
+            self.config_path,
+            self.historical_path,
+            self.forecast_path,
+            progress=progress,
+            datas=[datas[i] for i in missing],
+        )
+
+        forecast_dfs = []
+        for i, (df, forecast_parquet) in zip(missing, results):
+            forecast_target = os.path.join(
+                self.forecast_path, f"{timestamp}_{i}_forecast_data.parquet"
+            )
+            os.replace(forecast_parquet, forecast_target)
+            hist_target = os.path.join(
+                self.historical_path, f"{timestamp}_{i}_historical_data.parquet"
+            )
+            os.replace(
+                forecast_parquet.replace("Forecast_Data", "Historical_Data"),
+                hist_target,
+            )
+            forecast_dfs.append(pd.read_parquet(forecast_target))
+        self.remove_old_day_dirs()
+
+        # All series are scored in a single predict call
+        if progress is not None:
+            progress("predict")
+        model = model_registry.get(self.model_path, self.model_weights)
+        features = pd.concat(
+            [
+                forecast_df.drop(columns=["consumption"], errors="ignore")
+                for forecast_df in forecast_dfs
+            ]
+        )
+        predictions = model.predict(features)
+
+        offset = 0
+        for i, forecast_df in zip(missing, forecast_dfs):
+            output_df = pd.DataFrame(
+                predictions[offset : offset + len(forecast_df)],
+                columns=["Predicted_Consumption"],
+                index=forecast_df.index,
+            )
+            offset += len(forecast_df)
+            output_df = output_df.iloc[-24:, :]  # Keep only the last 24 hours
+            output_df.index = output_df.index.strftime("%Y-%m-%d %H:%M")
+            self.result_cache.put(keys[i], output_df)
+            output_dfs[i] = output_df
+        return output_dfs
+
 
 if __name__ == "__main__":
     import sys
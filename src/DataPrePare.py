@@ -3,13 +3,20 @@
 # -----------------------------
 from src.data_loader import DataLoader
 from src.epias_data import EpiasDataProcessor
+from src.epias_store import EpiasDataStore
+from src.epias_client import get_epias_client
 from src.solar_data import SolarDataProcessor
+from src.weather_archive import WeatherArchive
 from src.calendar_data import CalendarDataProcessor
 from src.consumption_data import ConsumptionDataProcessor
-from utils.data_prepare_config import data_prepare_config
+from src.exogenous_store import ExogenousFeatureStore, feature_set_version
+from utils.data_prepare_config import data_prepare_config, set_window, solar_end_date
 from utils.data_prepare_functions import DataPrepareFunctions
+from utils.fetch_scheduler import FetchScheduler
+from utils.transport import transport
 import pandas as pd
 import warnings
+import json
 import os
 
 # -----------------------------
@@ -21,6 +28,8 @@ warnings.filterwarnings("ignore")
 # -----------------------------
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BASE_DIR)
+PK_FILE = "2020_2025_pk.parquet"
 
 
 class DataPrepare:
@@ -35,44 +44,250 @@ class DataPrepare:
         self.historical_path = historical_path
         self.forecast_path = forecast_path
 
+    STAGES = [
+        "load",
+        "consumption",
+        "epias",
+        "solar",
+        "calendar",
+        "weather",
+        "assemble",
+        "save",
+    ]
+
     def DataPrepareFunction(
-        self, data_path, config_path, historical_path, forecast_path
+        self,
+        data_path,
+        config_path,
+        historical_path,
+        forecast_path,
+        progress=None,
+        data=None,
     ):
         """
         Main function to prepare data.
         This function orchestrates the data loading, processing, and saving.
+
+        Args:
+            progress (callable, optional): Called with the stage name from
+                ``STAGES`` whenever a new stage starts.
+            data (pd.DataFrame, optional): ``data_path`` already loaded with
+                ``load_data``
         """
+        report = progress or (lambda stage: None)
+
         # -----------------------------
         # Data Loader
         # -----------------------------
-        data_loader = DataLoader(file_path=data_path)
-        data = data_loader.load_excel()
+        if data is None:
+            report("load")
+            data = self.load_data(data_path)
         # -----------------------------
 
         # -----------------------------
         # Konfigürasyonu yükle
         # -----------------------------
         config = data_prepare_config(config_path, data_df=data)
-        prepare_functions = DataPrepareFunctions()
+        prepare_functions = DataPrepareFunctions(compact=config["memory"]["compact"])
         # -----------------------------
 
         # -----------------------------
         # Consumption Data
         # -----------------------------
+        report("consumption")
+        consumption = prepare_functions.compact_frame(
+            self.consumption_data(config, data)
+        )
+        # -----------------------------
+
+        # -----------------------------
+        # Exogenous Data (EPİAŞ, solar, calendar, weather)
+        # -----------------------------
+        exogenous_df = self.stored_exogenous_data(config, prepare_functions, report)
+        # -----------------------------
+
+        # -----------------------------
+        # Prepare Main Data
+        # -----------------------------
+        report("assemble")
+        df = prepare_functions.main_data_prepare(data, consumption, exogenous_df)
+        # -----------------------------
+
+        # -----------------------------
+        # Process and Save Main Data
+        # -----------------------------
+        report("save")
+        df, forecast_df_result_path = prepare_functions.process_save_main_data(
+            df, self.historical_path, self.forecast_path
+        )
+        # -----------------------------
+
+        return df, forecast_df_result_path
+
+    def DataPrepareBatch(
+        self,
+        data_paths,
+        config_path,
+        historical_path,
+        forecast_path,
+        progress=None,
+        datas=None,
+    ):
+        """
+        Prepare several consumption series (e.g. meters or feeders) at once.
+
+        The exogenous features are built once for the window covering every
+        series and joined to the consumption features of each series.
+
+        Args:
+            data_paths (list): Consumption files, one per series
+            progress (callable, optional): Called with the stage name from
+                ``STAGES`` whenever a new stage starts.
+            datas (list, optional): ``data_paths`` already loaded with
+                ``load_data``
+
+        Returns:
+            list: ``(df, forecast_df_result_path)`` per series, in order
+        """
+        report = progress or (lambda stage: None)
+
+        if datas is None:
+            report("load")
+            datas = [self.load_data(data_path) for data_path in data_paths]
+
+        # Pencere tüm serileri kapsar
+        config = data_prepare_config(
+            config_path, data_df=pd.concat([data[["date"]] for data in datas])
+        )
+        prepare_functions = DataPrepareFunctions(compact=config["memory"]["compact"])
+
+        report("consumption")
+        consumptions = [
+            prepare_functions.compact_frame(self.consumption_data(config, data))
+            for data in datas
+        ]
+
+        exogenous_df = self.stored_exogenous_data(config, prepare_functions, report)
+
+        report("assemble")
+        dfs = [
+            prepare_functions.main_data_prepare(data, consumption, exogenous_df)
+            for data, consumption in zip(datas, consumptions)
+        ]
+
+        report("save")
+        return [
+            prepare_functions.process_save_main_data(
+                df, self.historical_path, self.forecast_path, suffix=f"_{i}"
+            )
+            for i, df in enumerate(dfs)
+        ]
+
+    def preload(self, config_path):
+        """
+        Build the static tables every run reads: the PK profiles, the solar
+        features of the 10-year range and the calendar of the same range.
+
+        Called in the gunicorn master before the workers fork (see
+        ``ForecastPipeline.preload``), so the tables are built once per host
+        and shared by the workers instead of being built by each of them on
+        its first request. Runs only slice them; the tables are never
+        modified.
+        """
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        EpiasDataProcessor.read_pk(os.path.join(BASE_DIR, PK_FILE))
+
+        solar_cfg = config["solar"]
+        end_date = solar_end_date(config)
+        SolarDataProcessor(
+            lat=solar_cfg["lat"],
+            long=solar_cfg["long"],
+            alt=solar_cfg["alt"],
+            timezone=solar_cfg["timezone"],
+            cache_dir=os.path.join(PROJECT_DIR, solar_cfg["cache_dir"]),
+        ).process_data(start_date=solar_cfg["start_date"], end_date=end_date)
+
+        CalendarDataProcessor().preload(solar_cfg["start_date"], f"{end_date} 23:00:00")
+
+    def load_data(self, data_path):
+        data_loader = DataLoader(file_path=data_path)
+        return data_loader.load()
+
+    def consumption_data(self, config, data):
         consumption_cfg = config["consumption"]
         consumption_processor = ConsumptionDataProcessor(
             variables=consumption_cfg["variables"],
             lags=consumption_cfg["lags"],
             functions=consumption_cfg["functions"],
         )
-        consumption = consumption_processor.transform(df=data)
-        # -----------------------------
+        return consumption_processor.transform(df=data)
+
+    def stored_exogenous_data(self, config, prepare_functions, report):
+        """
+        Read the exogenous features of ``config["window"]`` from the store of
+        the current weather forecast issue, computing and storing them when
+        they are not there yet.
+        """
+        window_cfg = config["window"]
+        exogenous_store = ExogenousFeatureStore(
+            os.path.join(PROJECT_DIR, config["exogenous_store"]["path"]),
+            version=feature_set_version(config),
+            issue=config["forecast_weather"]["issue"],
+        )
+
+        def compute(start_date, end_date):
+            # Aynı yayının önceki istekleriyle birlikte hesaplanır ve saklanır
+            set_window(config, start_date, end_date)
+            return self.exogenous_data(config, prepare_functions, report)
+
+        return exogenous_store.get(
+            window_cfg["start_date"], window_cfg["end_date"], compute
+        )
+
+    def exogenous_data(self, config, prepare_functions, report):
+        """
+        Compute the exogenous features (EPİAŞ, solar, calendar and weather)
+        of ``config["window"]``.
+
+        Returns:
+            pd.DataFrame: ``hour_key`` and the exogenous feature columns
+        """
+        window_cfg = config["window"]
 
         # -----------------------------
         # Epias Data
         # -----------------------------
+        report("epias")
         epias_cfg = config["epias"]
-        epias_processor = EpiasDataProcessor()
+        epias_store_cfg = epias_cfg["store"]
+        epias_client_cfg = epias_cfg["client"]
+        epias_fetch_cfg = dict(
+            epias_cfg["fetch"],
+            bucket_path=os.path.join(PROJECT_DIR, epias_cfg["fetch"]["bucket_path"]),
+        )
+        epias_processor = EpiasDataProcessor(
+            store=EpiasDataStore(os.path.join(PROJECT_DIR, epias_store_cfg["path"])),
+            refetch_days=epias_store_cfg["refetch_days"],
+            # Kayıttan okunan yanıtlar için bekleme yapılmaz; hız sınırı
+            # hesap başınadır ve sunucudaki tüm işçiler tarafından paylaşılır
+            scheduler=FetchScheduler(
+                **epias_fetch_cfg,
+                bucket_key=epias_cfg["username"],
+                throttle=not transport.replaying,
+            ),
+            client=get_epias_client(
+                epias_cfg["username"],
+                epias_cfg["password"],
+                ticket_path=os.path.join(PROJECT_DIR, epias_client_cfg["ticket_path"]),
+                ticket_ttl=epias_client_cfg["ticket_ttl"],
+                pool_size=epias_client_cfg["pool_size"],
+            ),
+            feature_store=EpiasDataStore(
+                os.path.join(PROJECT_DIR, epias_store_cfg["features_path"]),
+                partition="%Y",
+            ),
+        )
         epias_df_raw = epias_processor.create_epias(
             username=epias_cfg["username"],
             password=epias_cfg["password"],
@@ -85,7 +300,7 @@ class DataPrepare:
         )
 
         epias_proc = epias_cfg["process"]
-        pk_path = os.path.join(BASE_DIR, "2020_2025_pk.parquet")
+        pk_path = os.path.join(BASE_DIR, PK_FILE)
         epias_df = epias_processor.epias_processor(
             epias_df_raw,
             epias_proc["epias_periods"],
@@ -94,64 +309,67 @@ class DataPrepare:
             epias_proc["epias_window"],
             pk_path=pk_path,
             start_date=epias_proc["start_date"],
+            target_window=(window_cfg["start_date"], window_cfg["end_date"]),
         )
+        # Kompakt modda her çıktı üretildiği anda küçültülür
+        epias_df = prepare_functions.compact_frame(epias_df)
         # -----------------------------
 
         # -----------------------------
         # Solar Data
         # -----------------------------
+        report("solar")
         solar_cfg = config["solar"]
         solar_processor = SolarDataProcessor(
             lat=solar_cfg["lat"],
             long=solar_cfg["long"],
             alt=solar_cfg["alt"],
             timezone=solar_cfg["timezone"],
+            cache_dir=os.path.join(PROJECT_DIR, solar_cfg["cache_dir"]),
         )
 
         solar_df = solar_processor.process_data(
-            start_date=solar_cfg["start_date"], end_date=solar_cfg["end_date"]
+            start_date=solar_cfg["start_date"],
+            end_date=solar_cfg["end_date"],
+            window_start=window_cfg["start_date"],
         )
+        solar_df = prepare_functions.compact_frame(solar_df)
         # -----------------------------
 
         # -----------------------------
         # Calendar Data
         # -----------------------------
+        report("calendar")
         calendar_processor = CalendarDataProcessor()
         calendar_df = calendar_processor.process_calendar_data(
             start_date=config["calendar"]["start_date"],
             end_date=config["calendar"]["end_date"],
         )
+        calendar_df = prepare_functions.compact_frame(calendar_df)
         # -----------------------------
 
         # -----------------------------
         # Weather Data
         # -----------------------------
-        weather_df = prepare_functions.generate_multi_location_weather_data(config)
+        report("weather")
+        weather_archive = WeatherArchive(
+            os.path.join(PROJECT_DIR, config["historical_weather"]["archive_dir"])
+        )
+        weather_df = prepare_functions.generate_multi_location_weather_data(
+            config, archive=weather_archive
+        )
         weighted_weather_df = prepare_functions.weighted_average_weather_data(
             weather_df, config["location_weights"]
         )
+        # Ağırlıklı ortalama tam hassasiyetli veriden alındıktan sonra
+        weather_df = prepare_functions.compact_frame(weather_df)
+        weighted_weather_df = prepare_functions.compact_frame(weighted_weather_df)
         # -----------------------------
 
-        # -----------------------------
-        # Prepare Main Data
-        # -----------------------------
-        df = prepare_functions.main_data_prepare(
-            data,
-            consumption,
+        return prepare_functions.exogenous_data_prepare(
             epias_df,
             solar_df,
             calendar_df,
             weather_df,
             weighted_weather_df,
         )
-        # -----------------------------
-
-        # -----------------------------
-        # Process and Save Main Data
-        # -----------------------------
-        df, forecast_df_result_path = prepare_functions.process_save_main_data(
-            df, self.historical_path, self.forecast_path
-        )
-        # -----------------------------
-
-        return df, forecast_df_result_path
@@ -2,7 +2,7 @@ import holidays
 import pandas as pd
 import numpy as np
 from feature_engine.datetime import DatetimeFeatures
-from feature_engine.creation import CyclicalFeatures
+from utils.hour_key import HOUR_KEY, to_hour_key
 from pytz import timezone
 import warnings
 
@@ -12,6 +12,35 @@ warnings.filterwarnings("ignore")
 
 
 class CalendarDataProcessor:
+    # Date features computed directly from the DatetimeIndex; any other
+    # feature falls back to feature_engine's DatetimeFeatures
+    DATE_FEATURES = {
+        "month": lambda dates: dates.month.to_numpy(dtype="int32"),
+        "week": lambda dates: dates.isocalendar().week.to_numpy(dtype="int64"),
+        "day_of_week": lambda dates: dates.dayofweek.to_numpy(dtype="int32"),
+        "weekend": lambda dates: (dates.dayofweek >= 5).astype("int64"),
+        "hour": lambda dates: dates.hour.to_numpy(dtype="int32"),
+    }
+    # Döngüsel periyotlar: çok yillik takvimlerde görülen en büyük değerler.
+    # Sabit tutulur, böylece her tarih araliği ayni kodlamayi üretir.
+    CYCLICAL_PERIODS = {
+        "date_month": 12,
+        "date_week": 53,
+        "date_day_of_week": 6,
+        "date_hour": 23,
+    }
+    # Tatil öncesi/sonrasi işaretleri için aralığın iki yanina eklenen pay
+    HOLIDAY_MARGIN = pd.Timedelta(days=1)
+
+    DEFAULT_FEATURES = ["month", "week", "day_of_week", "weekend", "hour"]
+
+    # Calendars already built in this process, keyed by their arguments
+    _cache = {}
+    _cache_size = 8
+    # Hourly calendar of the whole config range (see ``preload``); windows
+    # inside it are sliced from it instead of being built
+    _preloaded = None
+
     def __init__(self):
         """
         CalendarDataProcessor sinifini başlatir.
@@ -25,11 +54,15 @@ class CalendarDataProcessor:
         start_date,
         end_date,
         freq="H",
-        features_to_extract=["month", "week", "day_of_week", "weekend", "hour"],
+        features_to_extract=DEFAULT_FEATURES,
     ):
         """
         Belirtilen tarih araliği için takvim özelliklerini oluşturur.
 
+        Sadece istenen aralik hesaplanir; tatil öncesi/sonrasi işaretleri için
+        aralik bir gün genişletilip sonra kirpilir. Aynı argümanlarla yapılan
+        çağrılar süreç içinde önbellekten döner.
+
         Args:
             start_date (str): Başlangiç tarihi
             end_date (str): Bitiş tarihi
@@ -43,67 +76,136 @@ class CalendarDataProcessor:
         start_date = pd.to_datetime(start_date)
         end_date = pd.to_datetime(end_date)
 
-        dates = pd.date_range(start=start_date, end=end_date, freq=freq)
+        key = (start_date, end_date, freq, tuple(features_to_extract))
+        calendar = self._cache.get(key)
+        if calendar is None:
+            calendar = self._preloaded_window(
+                start_date, end_date, freq, features_to_extract
+            )
+        if calendar is None:
+            calendar = self._build_calendar(
+                start_date, end_date, freq, features_to_extract
+            )
+            if len(self._cache) >= self._cache_size:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[key] = calendar
+        return calendar.copy()
+
+    def preload(self, start_date, end_date):
+        """
+        Build the hourly calendar from ``start_date`` to ``end_date`` with the
+        default features and serve every window inside it from this table.
+
+        Run before gunicorn forks the workers so that they share the table
+        and the first request of a worker needs no calendar build.
+        """
+        CalendarDataProcessor._preloaded = self._build_calendar(
+            pd.to_datetime(start_date),
+            pd.to_datetime(end_date),
+            "H",
+            self.DEFAULT_FEATURES,
+        )
+
+    def _preloaded_window(self, start_date, end_date, freq, features_to_extract):
+        """
+        Slice the window from the preloaded calendar, or None when it is not
+        covered. The holiday margin of the preloaded table is wider than the
+        window's, so the sliced rows equal a calendar built for the window.
+        """
+        calendar = self._preloaded
+        if (
+            calendar is None
+            or freq != "H"
+            or list(features_to_extract) != self.DEFAULT_FEATURES
+        ):
+            return None
+        first_key, last_key = to_hour_key([start_date, end_date])
+        keys = calendar[HOUR_KEY].to_numpy()
+        if first_key < keys[0] or last_key > keys[-1]:
+            return None
+        return calendar.iloc[
+            keys.searchsorted(first_key) : keys.searchsorted(last_key, "right")
+        ].reset_index(drop=True)
+
+    def _holiday_index(self, days):
+        """
+        Tatil isimlerini gün bazında bir kez hesaplar ("None": tatil değil).
+
+        Args:
+            days (pd.DatetimeIndex): Normalize edilmiş (gün başı) tarihler
+
+        Returns:
+            numpy.ndarray: ``days`` ile aynı uzunlukta tatil isimleri
+        """
+        first_day, last_day = days[0], days[-1]
+        day_range = pd.date_range(first_day, last_day, freq="D")
+        tr_holidays = holidays.Turkey(
+            language="tr", years=range(first_day.year, last_day.year + 1)
+        )
+        daily_names = np.array(
+            [tr_holidays.get(day, "None") for day in day_range.date], dtype=object
+        )
+        day_positions = (days - first_day).days.to_numpy()
+        return daily_names[day_positions]
+
+    def _build_calendar(self, start_date, end_date, freq, features_to_extract):
+        dates = pd.date_range(
+            start=start_date - self.HOLIDAY_MARGIN,
+            end=end_date + self.HOLIDAY_MARGIN,
+            freq=freq,
+        )
         calendar = pd.DataFrame({"date": dates})
 
         # Tatil günlerini ekle
-        tr_holidays = holidays.Turkey(language="tr")
-        calendar["Holiday_Flag"] = calendar["date"].apply(
-            lambda x: tr_holidays.get(x.strftime("%Y-%m-%d"), "None")
-        )
+        holiday_flag = self._holiday_index(dates.normalize())
+        calendar["Holiday_Flag"] = holiday_flag
 
         # Tarih özelliklerini çikar
-        calendar = (
-            DatetimeFeatures(
-                variables=None,
-                features_to_extract=features_to_extract,
-                drop_original=False,
+        if set(features_to_extract) <= set(self.DATE_FEATURES):
+            for feature in features_to_extract:
+                calendar[f"date_{feature}"] = self.DATE_FEATURES[feature](dates)
+        else:
+            calendar = (
+                DatetimeFeatures(
+                    variables=None,
+                    features_to_extract=features_to_extract,
+                    drop_original=False,
+                )
+                .fit(calendar)
+                .transform(calendar)
             )
-            .fit(calendar)
-            .transform(calendar)
-        )
 
         # Döngüsel özellikleri ekle
-        calendar = (
-            CyclicalFeatures(
-                variables=["date_month", "date_week", "date_day_of_week", "date_hour"],
-                drop_original=False,
-            )
-            .fit(calendar)
-            .transform(calendar)
-        )
+        for variable, period in self.CYCLICAL_PERIODS.items():
+            values = calendar[variable].to_numpy()
+            angle = values * (2.0 * np.pi / period)
+            calendar[f"{variable}_sin"] = np.sin(angle)
+            calendar[f"{variable}_cos"] = np.cos(angle)
 
         # Yillik mevsimsel döngüleri ekle
-        calendar["Yearly_Sin"] = np.sin(
-            2 * np.pi * calendar["date"].dt.dayofyear / 365.25
-        )
-        calendar["Yearly_Cos"] = np.cos(
-            2 * np.pi * calendar["date"].dt.dayofyear / 365.25
-        )
+        day_of_year = dates.dayofyear.to_numpy()
+        calendar["Yearly_Sin"] = np.sin(2 * np.pi * day_of_year / 365.25)
+        calendar["Yearly_Cos"] = np.cos(2 * np.pi * day_of_year / 365.25)
 
         # Çeyrek yili ekle
-        calendar["Quarter"] = calendar["date"].dt.quarter
-
-        # Tatil öncesi ve sonrasi günleri işaretle
-        calendar["Pre_Holiday"] = (
-            calendar["Holiday_Flag"]
-            .shift(-24)
-            .fillna("None")
-            .apply(lambda x: 1 if x != "None" else 0)
-        )
-        calendar["Post_Holiday"] = (
-            calendar["Holiday_Flag"]
-            .shift(24)
-            .fillna("None")
-            .apply(lambda x: 1 if x != "None" else 0)
-        )
+        calendar["Quarter"] = dates.quarter.to_numpy(dtype="int32")
 
-        # Hafta içi/sonu işaretleri
-        calendar["Weekday_Flag"] = calendar["date"].dt.weekday.apply(
-            lambda x: 1 if x < 5 else 0
-        )
-        calendar["Weekend_Flag"] = calendar["date"].dt.weekday.apply(
-            lambda x: 1 if x >= 5 else 0
-        )
+        # Tatil öncesi ve sonrasi günleri işaretle (24 satır kaydırarak)
+        is_holiday = (holiday_flag != "None").astype("int64")
+        pre_holiday = np.zeros(len(dates), dtype="int64")
+        post_holiday = np.zeros(len(dates), dtype="int64")
+        pre_holiday[:-24] = is_holiday[24:]
+        post_holiday[24:] = is_holiday[:-24]
+        calendar["Pre_Holiday"] = pre_holiday
+        calendar["Post_Holiday"] = post_holiday
 
+        # Hafta içi/sonu işaretleri
+        weekday = dates.weekday.to_numpy()
+        calendar["Weekday_Flag"] = (weekday < 5).astype("int64")
+        calendar["Weekend_Flag"] = (weekday >= 5).astype("int64")
+
+        # Pay satirlarini at
+        in_range = (dates >= start_date) & (dates <= end_date)
+        calendar = calendar[in_range].reset_index(drop=True)
+        calendar.insert(1, HOUR_KEY, to_hour_key(dates[in_range]))
         return calendar
@@ -1,10 +1,5 @@
 import pandas as pd
-from sklearn.pipeline import Pipeline
-from feature_engine.timeseries.forecasting import (
-    LagFeatures,
-    WindowFeatures,
-    ExpandingWindowFeatures,
-)
+from src.feature_state import StreamingFeatureState
 
 pd.set_option("display.width", 50000)
 pd.set_option("display.max_columns", None)
@@ -15,46 +10,33 @@ class ConsumptionDataProcessor:
         self.variables = variables
         self.lags = lags
         self.functions = functions
-        self.pipeline = self._build_pipeline()
-
-    def _build_pipeline(self):
-        return Pipeline(
-            [
-                (
-                    "lag",
-                    LagFeatures(
-                        variables=self.variables,
-                        periods=self.lags,
-                        missing_values="ignore",
-                    ),
-                ),
-                (
-                    "window",
-                    WindowFeatures(
-                        variables=self.variables,
-                        window=self.lags,
-                        functions=self.functions,
-                        min_periods=1,
-                        missing_values="ignore",
-                    ),
-                ),
-                (
-                    "expanding",
-                    ExpandingWindowFeatures(
-                        variables=self.variables,
-                        functions=self.functions,
-                        missing_values="ignore",
-                    ),
-                ),
-            ]
+        self.state = StreamingFeatureState(
+            variables=self.variables,
+            lags=self.lags,
+            windows=self.lags,
+            functions=self.functions,
         )
 
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Build the lag, window and expanding consumption features.
+
+        The rows up to the last known consumption are built in one batch and
+        the forecast rows after them are emitted from the feature state, which
+        is left at the end of the input (``self.state``).
+        """
         df = df.copy()
         df["date"] = pd.to_datetime(df["date"])
         df.set_index("date", inplace=True)
 
-        df = self.pipeline.fit_transform(df)
+        observed = df[self.variables].notna().any(axis=1).to_numpy()
+        history_end = observed.nonzero()[0][-1] + 1 if observed.any() else 0
+        df = pd.concat(
+            [
+                self.state.fit(df.iloc[:history_end]),
+                self.state.update(df.iloc[history_end:]),
+            ]
+        )
 
         df.drop(columns=["consumption"], inplace=True, errors="ignore")
         return df.reset_index()
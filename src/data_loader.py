@@ -1,10 +1,49 @@
+import os
+import time
 import pandas as pd
+from utils.hour_key import HOUR_KEY, to_hour_key
+from utils.xlsx_reader import read_xlsx_columns
+
+# Yüklenen dosyadan okunan sütunlar
+COLUMNS = ["date", "time", "consumption"]
+SUPPORTED_EXTENSIONS = (".xlsx", ".csv", ".parquet")
 
 
 class DataLoader:
     def __init__(self, file_path: str):
         self.file_path = file_path
         self.df = None
+        self.parse_seconds = None
+
+    def load(self, shift_hours: int = 48) -> pd.DataFrame:
+        """
+        Dosyayı uzantısına göre (.xlsx, .csv, .parquet) yükler ve date
+        sütununu belirtilen saatte ileri taşır
+
+        Args:
+            shift_hours: Date sütununu kaç saat ileri taşıyacak (varsayılan: 48)
+
+        Returns:
+            pd.DataFrame: İşlenmiş veri
+        """
+        extension = os.path.splitext(self.file_path)[1].lower()
+        if extension == ".xlsx":
+            return self.load_excel(shift_hours=shift_hours)
+
+        try:
+            start = time.perf_counter()
+            if extension == ".csv":
+                df = pd.read_csv(self.file_path, usecols=COLUMNS)
+            elif extension == ".parquet":
+                df = pd.read_parquet(self.file_path, columns=COLUMNS)
+            else:
+                raise ValueError(f"Desteklenmeyen dosya türü: {extension}")
+            self._report_parse_time(start, df)
+
+            return self._prepare(df, shift_hours)
+
+        except Exception as e:
+            raise RuntimeError(f"Dosya okunamadi veya islenemedi: {e}")
 
     def load_excel(self, sheet_name: str = 0, shift_hours: int = 48) -> pd.DataFrame:
         """
@@ -18,27 +57,38 @@ class DataLoader:
             pd.DataFrame: İşlenmiş veri
         """
         try:
-            # Excel dosyasını oku
-            df = pd.read_excel(self.file_path, sheet_name=sheet_name)
-
-            # Date ve time sütunlarını birleştir
-            df["date"] = pd.to_datetime(df["date"]) + pd.to_timedelta(
-                df["time"], unit="h"
+            start = time.perf_counter()
+            # Sadece gerekli sütunlar, sayfa XML'i satır satır okunarak alınır
+            df = read_xlsx_columns(
+                self.file_path, COLUMNS, sheet_name=sheet_name, date_columns=["date"]
             )
+            self._report_parse_time(start, df)
 
-            df = df.sort_values(by="date")
-            df = df[["date", "consumption"]].copy()
+            return self._prepare(df, shift_hours)
 
-            min_date = df["date"].min()
-            index = pd.date_range(
-                start=min_date, periods=(len(df) + shift_hours), freq="H"
-            )
+        except Exception as e:
+            raise RuntimeError(f"Excel dosyasi okunamadi veya islenemedi: {e}")
 
-            self.result = pd.DataFrame({"date": index})
+    def _report_parse_time(self, start, df):
+        self.parse_seconds = time.perf_counter() - start
+        print(
+            f"{os.path.basename(self.file_path)} okundu: {len(df)} satır, "
+            f"{self.parse_seconds:.2f} sn"
+        )
 
-            self.result = self.result.merge(df, how="left", on=["date"])
+    def _prepare(self, df: pd.DataFrame, shift_hours: int) -> pd.DataFrame:
+        # Date ve time sütunlarını birleştir
+        df["date"] = pd.to_datetime(df["date"]) + pd.to_timedelta(df["time"], unit="h")
 
-            return self.result
+        df = df.sort_values(by="date")
+        df = df[["date", "consumption"]].copy()
 
-        except Exception as e:
-            raise RuntimeError(f"Excel dosyasi okunamadi veya islenemedi: {e}")
+        min_date = df["date"].min()
+        index = pd.date_range(start=min_date, periods=(len(df) + shift_hours), freq="H")
+
+        self.result = pd.DataFrame({"date": index})
+
+        self.result = self.result.merge(df, how="left", on=["date"])
+        self.result.insert(1, HOUR_KEY, to_hour_key(self.result["date"]))
+
+        return self.result
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import fcntl
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from utils.metrics import metrics
+from utils.transport import transport
+
+TGT_URL = "https://giris.epias.com.tr/cas/v1/tickets"
+
+
+class EpiasClient:
+    """
+    HTTP client for the EPİAŞ transparency services.
+
+    Keeps one pooled keep-alive session with gzip enabled and caches the CAS
+    TGT ticket until it expires. The ticket is also written to
+    ``ticket_path`` so that every worker process on the host reuses it;
+    a ``401`` answer forces a new ticket and the request is sent once more.
+    """
+
+    def __init__(
+        self,
+        username,
+        password,
+        ticket_path=None,
+        ticket_ttl=7200,
+        ticket_margin=300,
+        pool_size=8,
+    ):
+        """
+        Args:
+            username (str): EPİAŞ user name
+            password (str): EPİAŞ password
+            ticket_path (str, optional): File shared by processes to cache the
+                TGT ticket. Without it the ticket is cached in memory only.
+            ticket_ttl (int): Ticket validity in seconds (EPİAŞ: 2 hours)
+            ticket_margin (int): Seconds before expiry to request a new ticket
+            pool_size (int): Keep-alive connections kept per host
+        """
+        self.username = username
+        self.password = password
+        self.ticket_path = ticket_path
+        self.ticket_ttl = ticket_ttl
+        self.ticket_margin = ticket_margin
+        self._ticket = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        metrics.instrument(self.session)
+        transport.mount(self.session)
+
+    def _valid(self, expires_at):
+        return time.time() < expires_at - self.ticket_margin
+
+    def _request_ticket(self):
+        response = self.session.post(
+            TGT_URL,
+            data={"username": self.username, "password": self.password},
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Accept": "text/plain",
+            },
+        )
+        response.raise_for_status()
+        return response.text, time.time() + self.ticket_ttl
+
+    def _read_ticket_file(self):
+        try:
+            with open(self.ticket_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None, 0.0
+        if cached.get("username") != self.username:
+            return None, 0.0
+        return cached["ticket"], cached["expires_at"]
+
+    def _write_ticket_file(self, ticket, expires_at):
+        tmp_path = f"{self.ticket_path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(
+                {"username": self.username, "ticket": ticket, "expires_at": expires_at},
+                f,
+            )
+        os.replace(tmp_path, self.ticket_path)
+
+    def get_tgt(self, stale=None):
+        """
+        Return a valid TGT ticket, requesting a new one only when needed.
+
+        Args:
+            stale (str, optional): Ticket the server just rejected; it is not
+                reused even if it has not expired yet.
+
+        Returns:
+            str: TGT ticket
+        """
+        with self._lock:
+            if self._ticket != stale and self._valid(self._expires_at):
+                return self._ticket
+
+            if self.ticket_path is None:
+                self._ticket, self._expires_at = self._request_ticket()
+                return self._ticket
+
+            os.makedirs(os.path.dirname(self.ticket_path) or ".", exist_ok=True)
+            # The file lock keeps workers from requesting tickets in parallel
+            with open(f"{self.ticket_path}.lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                ticket, expires_at = self._read_ticket_file()
+                if ticket is None or ticket == stale or not self._valid(expires_at):
+                    ticket, expires_at = self._request_ticket()
+                    self._write_ticket_file(ticket, expires_at)
+            self._ticket, self._expires_at = ticket, expires_at
+            return self._ticket
+
+    def post(self, url, body):
+        """
+        POST a JSON body to an EPİAŞ service with the cached TGT ticket.
+
+        Returns:
+            requests.Response: Service response
+        """
+        ticket = self.get_tgt()
+        response = self.session.post(
+            url, json=body, headers={"Content-Type": "application/json", "TGT": ticket}
+        )
+        if response.status_code == 401:
+            ticket = self.get_tgt(stale=ticket)
+            response = self.session.post(
+                url,
+                json=body,
+                headers={"Content-Type": "application/json", "TGT": ticket},
+            )
+        return response
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_epias_client(username, password, **kwargs) -> EpiasClient:
+    """
+    Return the process-wide client for ``username``, creating it once.
+    """
+    with _clients_lock:
+        client = _clients.get(username)
+        if client is None or client.password != password:
+            client = EpiasClient(username, password, **kwargs)
+            _clients[username] = client
+        return client
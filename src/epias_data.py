@@ -1,35 +1,97 @@
-import requests
+import os
 import json
+import fcntl
 import pandas as pd
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from functools import reduce
-import time
-from sklearn.pipeline import Pipeline
-from feature_engine.timeseries.forecasting import (
-    LagFeatures,
-    WindowFeatures,
-    ExpandingWindowFeatures,
-)
+from functools import partial
+from utils.fetch_scheduler import FetchScheduler
+from src.epias_client import EpiasClient
+from utils.transport import transport
+from src.feature_state import StreamingFeatureState
+from utils.hour_key import HOUR_KEY, to_hour_key, from_hour_key, align_on_hour_key
 
 pd.set_option("display.width", 50000)
 pd.set_option("display.max_columns", None)
 
+EPIAS_SERVICE_URL = "https://seffaflik.epias.com.tr/electricity-service/v1"
+
+# Raw EPİAŞ series: endpoint, response field and how the history is chunked
+EPIAS_DATASETS = {
+    "KGUP": {
+        "url": EPIAS_SERVICE_URL + "/generation/data/dpp",
+        "field": "toplam",
+        "body": {"region": "TR1"},
+        "period": "quarter",
+    },
+    "GercekTuketim": {
+        "url": EPIAS_SERVICE_URL + "/consumption/data/realtime-consumption",
+        "field": "consumption",
+        "body": {},
+        "period": "year",
+    },
+    "GopAlis": {
+        "url": EPIAS_SERVICE_URL + "/markets/dam/data/clearing-quantity",
+        "field": "matchedBids",
+        "body": {},
+        "period": "year",
+    },
+    "IaAlis": {
+        "url": EPIAS_SERVICE_URL
+        + "/markets/bilateral-contracts/data/bilateral-contracts-bid-quantity",
+        "field": "quantity",
+        "body": {},
+        "period": "year",
+    },
+    "YukTahmin": {
+        "url": EPIAS_SERVICE_URL + "/consumption/data/load-estimation-plan",
+        "field": "lep",
+        "body": {},
+        "period": "year",
+    },
+}
+
 
 class EpiasDataProcessor:
-    def __init__(self):
+    # PK profiles already read in this process: path -> (mtime, df)
+    _pk_tables = {}
+
+    def __init__(
+        self,
+        store=None,
+        refetch_days=3,
+        scheduler=None,
+        client=None,
+        feature_store=None,
+    ):
+        """
+        Args:
+            store (EpiasDataStore, optional): Local store of raw series. When
+                given, only the hours after the last stored hour (plus
+                ``refetch_days`` of possibly revised data) are downloaded.
+            refetch_days (int): Days before the last stored hour to download
+                again on every run
+            scheduler (FetchScheduler, optional): Rate limited scheduler used
+                for the data requests
+            client (EpiasClient, optional): Pooled client holding the TGT
+                ticket. Created from the credentials in ``create_epias`` when
+                not given.
+            feature_store (EpiasDataStore, optional): Store of the features
+                of settled hours and their feature state. When given, only
+                the hours after the stored ones are run through the feature
+                state.
+        """
         self.tgt_code = None
+        self.store = store
+        self.refetch_days = refetch_days
+        self.scheduler = scheduler or FetchScheduler()
+        self.client = client
+        self.feature_store = feature_store
 
     def get_tgt_code(self, username, password):
-        tgt_url = "https://giris.epias.com.tr/cas/v1/tickets"
-        ıd_pass = {"username": username, "password": password}
-        tgt_body = {"username": ıd_pass["username"], "password": ıd_pass["password"]}
-        tgt_headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Accept": "text/plain",
-        }
-        tgt_response = requests.post(tgt_url, data=tgt_body, headers=tgt_headers)
-        self.tgt_code = tgt_response.text
+        if self.client is None or self.client.username != username:
+            self.client = EpiasClient(username, password)
+        self.tgt_code = self.client.get_tgt()
         return self.tgt_code
 
     def calculate_quarters(
@@ -37,13 +99,7 @@ class EpiasDataProcessor:
     ):
         start_date = datetime(start_year, start_month, 1)
         if not end_year or not end_month:
-            now = datetime.now()
-            current_quarter_start = (now.month - 1) // 3 * 3 + 1
-            end_date = (
-                datetime(now.year, current_quarter_start, 1)
-                + relativedelta(months=3)
-                - timedelta(seconds=1)
-            )
+            end_date = self._current_quarter_end()
         else:
             end_date = (
                 datetime(end_year, end_month, 1)
@@ -51,48 +107,35 @@ class EpiasDataProcessor:
                 - timedelta(seconds=1)
             )
 
-        quarters_start = []
-        quarters_end = []
-
-        current_date = start_date
-        while current_date < end_date:
-            quarter_start = current_date
-            quarter_end = quarter_start + relativedelta(months=3) - timedelta(seconds=1)
-
-            quarter_start_str = quarter_start.strftime("%Y-%m-%dT%H:%M:%S+03:00")
-            quarter_end_str = quarter_end.strftime("%Y-%m-%dT%H:%M:%S+03:00")
-
-            quarters_start.append(quarter_start_str)
-            quarters_end.append(quarter_end_str)
-
-            current_date += relativedelta(months=3)
+        periods = self.split_dates_into_quarters(start_date, end_date)
+        quarters_start = [period_start for period_start, _ in periods]
+        quarters_end = [period_end for _, period_end in periods]
         return quarters_start, quarters_end
 
-    def get_kgup_data(
-        self, start_year, start_month, end_year=None, end_month=None, tgt_code=None
-    ):
-        quarters_start, quarters_end = self.calculate_quarters(
-            start_year, start_month, end_year, end_month
+    def _current_quarter_end(self):
+        now = transport.now()
+        current_quarter_start = (now.month - 1) // 3 * 3 + 1
+        return (
+            datetime(now.year, current_quarter_start, 1)
+            + relativedelta(months=3)
+            - timedelta(seconds=1)
         )
-        kgup = pd.DataFrame(columns=["date", "toplam"])
-        for i in range(len(quarters_start)):
-            kgup_url = "https://seffaflik.epias.com.tr/electricity-service/v1/generation/data/dpp"
-            kgup_headers = {"Content-Type": "application/json", "TGT": tgt_code}
-            kgup_body = {
-                "startDate": quarters_start[i],
-                "endDate": quarters_end[i],
-                "region": "TR1",
-            }
-            kgup_response = requests.post(
-                kgup_url, json=kgup_body, headers=kgup_headers
+
+    def split_dates_into_quarters(self, start_date, end_date):
+        periods = []
+        current_date = pd.to_datetime(start_date).tz_localize(None).to_pydatetime()
+        end_date = pd.to_datetime(end_date).tz_localize(None).to_pydatetime()
+
+        while current_date < end_date:
+            quarter_end = current_date + relativedelta(months=3) - timedelta(seconds=1)
+            periods.append(
+                (
+                    current_date.strftime("%Y-%m-%dT%H:%M:%S+03:00"),
+                    quarter_end.strftime("%Y-%m-%dT%H:%M:%S+03:00"),
+                )
             )
-            kgup_cache = pd.DataFrame(json.loads(kgup_response.content)["items"])[
-                ["date", "toplam"]
-            ]
-            kgup = pd.concat([kgup, kgup_cache], ignore_index=True)
-        kgup.columns = ["date", "KGUP"]
-        kgup["date"] = pd.to_datetime(kgup["date"]).dt.strftime("%Y-%m-%d %H:%M")
-        return kgup
+            current_date += relativedelta(months=3)
+        return periods
 
     def split_dates_into_years(self, start_date, end_date):
         periods = []
@@ -113,103 +156,137 @@ class EpiasDataProcessor:
 
         return periods
 
-    def get_gercek_tuketim_data_by_year(self, start_date, end_date, tgt_code=None):
-        gt_url = "https://seffaflik.epias.com.tr/electricity-service/v1/consumption/data/realtime-consumption"
-        gt_headers = {"Content-Type": "application/json", "TGT": tgt_code}
-
-        all_data = pd.DataFrame()
-        periods = self.split_dates_into_years(start_date, end_date)
-
-        for period_start, period_end in periods:
-            gt_body = {
-                "startDate": period_start,
-                "endDate": period_end,
-            }
-            gt_response = requests.post(gt_url, json=gt_body, headers=gt_headers)
-            period_data = pd.DataFrame(json.loads(gt_response.content)["items"])[
-                ["date", "consumption"]
-            ]
-            period_data.columns = ["date", "GercekTuketim"]
-            period_data["date"] = pd.to_datetime(period_data["date"]).dt.strftime(
-                "%Y-%m-%d %H:%M"
+    def _split_periods(self, dataset, start_date, end_date):
+        if EPIAS_DATASETS[dataset]["period"] == "quarter":
+            return self.split_dates_into_quarters(start_date, end_date)
+        return self.split_dates_into_years(start_date, end_date)
+
+    def _parse_items(self, dataset, content):
+        """
+        Convert an EPİAŞ response body into a ``date`` / ``dataset`` frame
+        with naive local (UTC+3) timestamps.
+        """
+        field = EPIAS_DATASETS[dataset]["field"]
+        period_data = pd.DataFrame(json.loads(content)["items"])
+        if period_data.empty:
+            return pd.DataFrame(
+                {
+                    "date": pd.Series(dtype="datetime64[ns]"),
+                    dataset: pd.Series(dtype="float64"),
+                }
             )
-            all_data = pd.concat([all_data, period_data], ignore_index=True)
-
-        return all_data
-
-    def get_gop_alis_data_by_year(self, start_date, end_date, tgt_code=None):
-        gop_url = "https://seffaflik.epias.com.tr/electricity-service/v1/markets/dam/data/clearing-quantity"
-        gop_headers = {"Content-Type": "application/json", "TGT": tgt_code}
-
-        all_data = pd.DataFrame()
-        periods = self.split_dates_into_years(start_date, end_date)
-
-        for period_start, period_end in periods:
-            gop_body = {
-                "startDate": period_start,
-                "endDate": period_end,
-            }
-            gop_response = requests.post(gop_url, json=gop_body, headers=gop_headers)
-            period_data = pd.DataFrame(json.loads(gop_response.content)["items"])[
-                ["date", "matchedBids"]
-            ]
-            period_data.columns = ["date", "GopAlis"]
-            period_data["date"] = pd.to_datetime(period_data["date"]).dt.strftime(
-                "%Y-%m-%d %H:%M"
+        period_data = period_data[["date", field]]
+        period_data.columns = ["date", dataset]
+        period_data["date"] = pd.to_datetime(period_data["date"]).dt.tz_localize(None)
+        return period_data
+
+    def _post_period(self, dataset, period_start, period_end):
+        spec = EPIAS_DATASETS[dataset]
+        body = {"startDate": period_start, "endDate": period_end, **spec["body"]}
+        return self.client.post(spec["url"], body)
+
+    def fetch_datasets(self, ranges):
+        """
+        Download several datasets at once.
+
+        Every (dataset, period) request is handed to the fetch scheduler, so
+        requests of all datasets run concurrently within the rate limit.
+
+        Args:
+            ranges (dict): Dataset name -> (start_date, end_date)
+
+        Returns:
+            dict: Dataset name -> ``date`` (naive local datetime) and value
+            columns
+        """
+        tasks = [
+            (dataset, period_start, period_end)
+            for dataset, (start_date, end_date) in ranges.items()
+            for period_start, period_end in self._split_periods(
+                dataset, start_date, end_date
             )
-            all_data = pd.concat([all_data, period_data], ignore_index=True)
-
-        return all_data
-
-    def get_ia_alis_data_by_year(self, start_date, end_date, tgt_code=None):
-        ia_url = "https://seffaflik.epias.com.tr/electricity-service/v1/markets/bilateral-contracts/data/bilateral-contracts-bid-quantity"
-        ia_headers = {"Content-Type": "application/json", "TGT": tgt_code}
-
-        all_data = pd.DataFrame()
-        periods = self.split_dates_into_years(start_date, end_date)
-
-        for period_start, period_end in periods:
-            ia_body = {
-                "startDate": period_start,
-                "endDate": period_end,
-            }
-            ia_response = requests.post(ia_url, json=ia_body, headers=ia_headers)
-            period_data = pd.DataFrame(json.loads(ia_response.content)["items"])[
-                ["date", "quantity"]
+        ]
+        responses = self.scheduler.map(
+            [
+                partial(self._post_period, dataset, period_start, period_end)
+                for dataset, period_start, period_end in tasks
             ]
-            period_data.columns = ["date", "IaAlis"]
-            period_data["date"] = pd.to_datetime(period_data["date"]).dt.strftime(
-                "%Y-%m-%d %H:%M"
-            )
-            all_data = pd.concat([all_data, period_data], ignore_index=True)
-
-        return all_data
+        )
 
-    def get_yuk_tahmin_data_by_year(self, start_date, end_date, tgt_code=None):
-        yuk_tahmin_url = "https://seffaflik.epias.com.tr/electricity-service/v1/consumption/data/load-estimation-plan"
-        yuk_tahmin_headers = {"Content-Type": "application/json", "TGT": tgt_code}
+        frames = {dataset: [] for dataset in ranges}
+        for (dataset, _, _), response in zip(tasks, responses):
+            frames[dataset].append(self._parse_items(dataset, response.content))
 
-        all_data = pd.DataFrame()
-        periods = self.split_dates_into_years(start_date, end_date)
+        return {
+            dataset: pd.concat(dataset_frames, ignore_index=True)
+            if dataset_frames
+            else self._parse_items(dataset, '{"items": []}')
+            for dataset, dataset_frames in frames.items()
+        }
 
-        for period_start, period_end in periods:
-            yuk_tahmin_body = {
-                "startDate": period_start,
-                "endDate": period_end,
-            }
-            yuk_tahmin_response = requests.post(
-                yuk_tahmin_url, json=yuk_tahmin_body, headers=yuk_tahmin_headers
-            )
-            period_data = pd.DataFrame(
-                json.loads(yuk_tahmin_response.content)["items"]
-            )[["date", "lep"]]
-            period_data.columns = ["date", "YukTahmin"]
-            period_data["date"] = pd.to_datetime(period_data["date"]).dt.strftime(
-                "%Y-%m-%d %H:%M"
+    def fetch_dataset(self, dataset, start_date, end_date):
+        """
+        Download ``dataset`` between ``start_date`` and ``end_date`` from EPİAŞ.
+
+        Returns:
+            pd.DataFrame: ``date`` (naive local datetime) and value columns
+        """
+        return self.fetch_datasets({dataset: (start_date, end_date)})[dataset]
+
+    def _dataset_end(self, dataset, end_date):
+        # KGUP is published ahead of time, so it is read up to the end of the
+        # current quarter like before; the other series stop at end_date
+        if EPIAS_DATASETS[dataset]["period"] == "quarter":
+            return self._current_quarter_end()
+        return pd.to_datetime(end_date).tz_localize(None)
+
+    def update_datasets(self, dataset_starts, end_date):
+        """
+        Bring the given datasets up to date and return their rows.
+
+        Without a store the whole range is downloaded. With a store only the
+        hours after the last stored hour, minus ``refetch_days`` for revised
+        values, are downloaded and upserted before reading back the range.
+
+        Args:
+            dataset_starts (dict): Dataset name -> first date to return
+            end_date (str): Last date for the non-KGUP series
+
+        Returns:
+            dict: Dataset name -> ``date`` (naive local datetime) and value
+            columns
+        """
+        starts = {
+            dataset: pd.to_datetime(start_date).tz_localize(None)
+            for dataset, start_date in dataset_starts.items()
+        }
+        ranges = {}
+        for dataset, start in starts.items():
+            fetch_start = start
+            if self.store is not None:
+                first = self.store.first_timestamp(dataset)
+                last = self.store.last_timestamp(dataset)
+                if first is not None and first <= start + timedelta(days=1):
+                    refetch_from = (
+                        last - timedelta(days=self.refetch_days)
+                    ).normalize()
+                    fetch_start = max(start, refetch_from)
+            end = self._dataset_end(dataset, end_date)
+            print(
+                f"EPİAŞ {dataset}: {fetch_start:%Y-%m-%d} - {end:%Y-%m-%d} indiriliyor"
             )
-            all_data = pd.concat([all_data, period_data], ignore_index=True)
+            ranges[dataset] = (fetch_start, end)
 
-        return all_data
+        fetched = self.fetch_datasets(ranges)
+        if self.store is None:
+            return fetched
+
+        for dataset, df in fetched.items():
+            self.store.write(dataset, df)
+        return {
+            dataset: self.store.read(dataset, start=start)
+            for dataset, start in starts.items()
+        }
 
     def create_epias(
         self,
@@ -227,77 +304,166 @@ class EpiasDataProcessor:
 
         print(f"İşlem Başladı. {current_time_str()}")
 
-        TGT_code = self.get_tgt_code(username, password)
-        time.sleep(5)
-        kgup_data = self.get_kgup_data(start_year, start_month, tgt_code=TGT_code)
-        time.sleep(25)  # To avoid rate limiting
+        # Fails fast on bad credentials; the ticket is cached by the client
+        self.get_tgt_code(username, password)
 
-        gercek_tuketim_data = self.get_gercek_tuketim_data_by_year(
-            start_date, end_date, tgt_code=TGT_code
-        )
-        time.sleep(25)
-        gop_alis_data = self.get_gop_alis_data_by_year(
-            start_date, end_date, tgt_code=TGT_code
-        )
-        time.sleep(25)
-        ia_alis_data = self.get_ia_alis_data_by_year(
-            start_date, end_date, tgt_code=TGT_code
-        )
-        time.sleep(25)
-        yuk_tahmin_alis_data = self.get_yuk_tahmin_data_by_year(
-            start_date, end_date, tgt_code=TGT_code
-        )
+        # KGUP history starts at start_year/start_month, the rest at start_date
+        dataset_starts = {
+            dataset: datetime(start_year, start_month, 1)
+            if spec["period"] == "quarter"
+            else start_date
+            for dataset, spec in EPIAS_DATASETS.items()
+        }
         dfs = [
-            kgup_data,
-            gercek_tuketim_data,
-            gop_alis_data,
-            ia_alis_data,
-            yuk_tahmin_alis_data,
+            df.assign(**{HOUR_KEY: to_hour_key(df["date"])})
+            for df in self.update_datasets(dataset_starts, end_date).values()
         ]
-        epias_df = reduce(
-            lambda left, right: pd.merge(left, right, on="date", how="inner"), dfs
-        )
+
+        epias_df = align_on_hour_key(dfs)
+        epias_df.insert(0, "date", from_hour_key(epias_df[HOUR_KEY]))
         print(f"İşlem tamamlandı. {current_time_str()}")
         return epias_df
 
+    def _stored_features(self, epias, state, settled_until, start=None):
+        """
+        Build the features with the persisted feature state.
+
+        Hours before ``settled_until`` are no longer re-fetched, so their
+        features are final: they are kept in the feature store and the saved
+        state only advances over them. The later hours (re-fetched and
+        forecast hours) are emitted from a copy of the state on every run.
+
+        Args:
+            epias (pd.DataFrame): Hourly ``hour_key`` and variable columns
+            state (StreamingFeatureState): Empty state with the feature config
+            settled_until (pd.Timestamp): First hour that may still change
+            start (optional): First hour to read from the feature store
+
+        Returns:
+            pd.DataFrame: ``hour_key`` and feature columns
+        """
+        keys = epias[HOUR_KEY].to_numpy()
+        settled_key = to_hour_key([settled_until])[0]
+        settled = keys < settled_key
+        state_path = os.path.join(self.feature_store.root, "state.json")
+
+        # Jobs of every worker share the store; advancing (or rebuilding) it
+        # and reading it back is one step, so no job reads a partial store
+        with open(
+            os.path.join(self.feature_store.root, "state.lock"), "a"
+        ) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = self._advance_features(
+                    epias, state, settled, settled_key, state_path
+                )
+                stored = self.feature_store.read("features", start=start)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        tail = state.copy().update(epias[~settled]).drop(columns=state.variables)
+        if stored.empty:
+            return tail
+        return pd.concat([stored[tail.columns], tail], ignore_index=True)
+
+    def _advance_features(self, epias, state, settled, settled_key, state_path):
+        """
+        Bring the feature store and the saved state up to the settled hours
+        and return the state. Called under the lock of ``_stored_features``.
+        """
+        keys = epias[HOUR_KEY].to_numpy()
+        saved = StreamingFeatureState.load(state_path)
+        if (
+            saved is not None
+            and saved.config == state.config
+            and saved.first_key == keys[0]
+            and saved.last_key < settled_key
+        ):
+            state = saved
+            new = state.update(epias[settled & (keys > state.last_key)])
+        else:
+            # Different features, history start or settled range: rebuild
+            self.feature_store.clear("features")
+            new = state.fit(epias[settled])
+
+        if not new.empty:
+            new = new.drop(columns=state.variables)
+            self.feature_store.write(
+                "features", new.assign(date=from_hour_key(new[HOUR_KEY]))
+            )
+            state.save(state_path)
+        return state
+
+    @classmethod
+    def read_pk(cls, pk_path):
+        """
+        Return the PK profiles of ``pk_path`` keyed by ``hour_key``.
+
+        The table is read once per process and kept as NumPy columns only
+        (the date strings are replaced by the key); read before gunicorn
+        forks, the workers share it. Callers must not modify it.
+        """
+        mtime = os.path.getmtime(pk_path)
+        cached = cls._pk_tables.get(pk_path)
+        if cached is None or cached[0] != mtime:
+            pk = pd.read_parquet(pk_path)
+            pk.insert(0, HOUR_KEY, to_hour_key(pk.pop("date")))
+            cached = (mtime, pk)
+            cls._pk_tables[pk_path] = cached
+        return cached[1]
+
     def epias_processor(
-        self, data, periods, variables, functions, window, pk_path, start_date
+        self,
+        data,
+        periods,
+        variables,
+        functions,
+        window,
+        pk_path,
+        start_date,
+        target_window=None,
     ):
-        epias = data.copy()
-        date = pd.DataFrame(
+        """
+        Build the EPİAŞ lag, window and expanding features and join the PK
+        profiles.
+
+        The expanding statistics start at ``start_date``. Without a feature
+        store the whole history is built in one batch; with one, see
+        ``_stored_features``. With ``target_window`` only the rows between
+        its two dates are joined and returned.
+
+        Args:
+            target_window (tuple, optional): (start, end) local datetimes
+        """
+        hours = pd.DataFrame(
             {
-                "date": pd.date_range(
-                    start=start_date, periods=len(epias) + 48, freq="H"
-                ).strftime("%Y-%m-%d %H:%M")
+                HOUR_KEY: to_hour_key(
+                    pd.date_range(start=start_date, periods=len(data) + 48, freq="H")
+                )
             }
         )
-        epias = pd.merge(date, epias, on="date", how="outer")
+        epias = align_on_hour_key([hours, data], how="outer")
 
-        lag_transformer = LagFeatures(
-            variables=variables, periods=periods, missing_values="ignore"
-        )
-        window_transformer = WindowFeatures(
-            variables=variables,
-            window=window,
-            functions=functions,
-            missing_values="ignore",
-        )
-        expanding_transformer = ExpandingWindowFeatures(
-            variables=variables, functions=functions, missing_values="ignore"
+        state = StreamingFeatureState(
+            variables=variables, lags=periods, windows=window, functions=functions
         )
-        pipeline = Pipeline(
-            [
-                ("lag", lag_transformer),
-                ("window", window_transformer),
-                ("expanding", expanding_transformer),
-            ]
-        )
-        epias = pipeline.fit_transform(epias)
-        epias.drop(variables, axis=1, inplace=True)
-        pk = pd.read_parquet(pk_path)
-        epias = reduce(
-            lambda left, right: pd.merge(left, right, on="date", how="inner"),
-            [epias, pk],
-        )
-        epias["date"] = pd.to_datetime(epias["date"])
+        if self.feature_store is None:
+            epias = state.fit(epias).drop(columns=variables)
+        else:
+            settled_until = (
+                data["date"].max() - timedelta(days=self.refetch_days)
+            ).normalize()
+            epias = self._stored_features(
+                epias,
+                state,
+                settled_until,
+                None if target_window is None else target_window[0],
+            )
+        if target_window is not None:
+            first_key, last_key = to_hour_key(list(target_window))
+            keys = epias[HOUR_KEY].to_numpy()
+            epias = epias[(keys >= first_key) & (keys <= last_key)]
+        pk = self.read_pk(pk_path)
+        epias = align_on_hour_key([epias, pk])
+        epias.insert(0, "date", from_hour_key(epias[HOUR_KEY]))
         return epias
@@ -0,0 +1,136 @@
+import os
+import glob
+import fcntl
+import shutil
+import threading
+import pandas as pd
+
+
+class EpiasDataStore:
+    """
+    Persistent local store of raw hourly EPİAŞ series.
+
+    Every dataset is kept as one Parquet file per calendar month under
+    ``<root>/<dataset>/<YYYY-MM>.parquet`` (or per ``partition`` period) with
+    a naive local ``date`` column and the dataset's value columns. Writes
+    upsert by ``date`` so re-fetched (revised) hours replace the stored ones;
+    a partition is locked (``flock`` on ``<period>.lock``) while it is
+    merged, so concurrent writers of the same period keep each other's rows.
+    """
+
+    def __init__(self, root: str, partition: str = "%Y-%m"):
+        """
+        Args:
+            root (str): Store directory
+            partition (str): strftime format of the partition names, e.g.
+                ``"%Y"`` for one file per year
+        """
+        self.root = root
+        self.partition = partition
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dataset_dir(self, dataset):
+        return os.path.join(self.root, dataset)
+
+    def _partition_path(self, dataset, period):
+        return os.path.join(self._dataset_dir(dataset), f"{period}.parquet")
+
+    @staticmethod
+    def _period(path):
+        return os.path.basename(path)[: -len(".parquet")]
+
+    def _partitions(self, dataset):
+        return sorted(glob.glob(os.path.join(self._dataset_dir(dataset), "*.parquet")))
+
+    def first_timestamp(self, dataset):
+        """
+        Return the earliest stored hour of ``dataset`` or None if empty.
+        """
+        partitions = self._partitions(dataset)
+        if not partitions:
+            return None
+        return pd.read_parquet(partitions[0], columns=["date"])["date"].min()
+
+    def last_timestamp(self, dataset):
+        """
+        Return the latest stored hour of ``dataset`` or None if empty.
+        """
+        partitions = self._partitions(dataset)
+        if not partitions:
+            return None
+        return pd.read_parquet(partitions[-1], columns=["date"])["date"].max()
+
+    def clear(self, dataset: str):
+        """
+        Delete every stored partition of ``dataset``.
+        """
+        shutil.rmtree(self._dataset_dir(dataset), ignore_errors=True)
+
+    def write(self, dataset: str, df: pd.DataFrame):
+        """
+        Upsert hourly rows into the monthly partitions of ``dataset``.
+
+        Args:
+            dataset (str): Dataset name, e.g. ``"KGUP"``
+            df (pd.DataFrame): Frame with a naive datetime ``date`` column
+        """
+        if df.empty:
+            return
+        os.makedirs(self._dataset_dir(dataset), exist_ok=True)
+        periods = df["date"].dt.strftime(self.partition)
+        for period, part in df.groupby(periods):
+            path = self._partition_path(dataset, period)
+            lock_path = os.path.join(self._dataset_dir(dataset), f"{period}.lock")
+            with open(lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._merge(path, part)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _merge(self, path, part):
+        if os.path.exists(path):
+            part = pd.concat([pd.read_parquet(path), part], ignore_index=True)
+        part = (
+            part.drop_duplicates(subset="date", keep="last")
+            .sort_values("date")
+            .reset_index(drop=True)
+        )
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        part.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def read(self, dataset: str, start=None, end=None) -> pd.DataFrame:
+        """
+        Read the stored rows of ``dataset`` between ``start`` and ``end``.
+
+        Args:
+            dataset (str): Dataset name
+            start (optional): First hour to return (inclusive)
+            end (optional): Last hour to return (inclusive)
+
+        Returns:
+            pd.DataFrame: Rows sorted by ``date``
+        """
+        partitions = self._partitions(dataset)
+        if start is not None:
+            start = pd.Timestamp(start)
+            partitions = [
+                p
+                for p in partitions
+                if self._period(p) >= start.strftime(self.partition)
+            ]
+        if end is not None:
+            end = pd.Timestamp(end)
+            partitions = [
+                p for p in partitions if self._period(p) <= end.strftime(self.partition)
+            ]
+        if not partitions:
+            return pd.DataFrame(columns=["date"])
+
+        df = pd.concat([pd.read_parquet(p) for p in partitions], ignore_index=True)
+        if start is not None:
+            df = df[df["date"] >= start]
+        if end is not None:
+            df = df[df["date"] <= end]
+        return df.reset_index(drop=True)
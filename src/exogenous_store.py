@@ -0,0 +1,257 @@
+import os
+import json
+import glob
+import fcntl
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+import pandas as pd
+import pyarrow.parquet as pq
+from utils.hour_key import HOUR_KEY, to_hour_key
+
+# Bump when the code of an exogenous feature (EPİAŞ, solar, calendar,
+# weather) changes so that features stored by the old code are not reused
+FEATURE_SET_VERSION = 1
+
+
+def feature_set_version(config: dict) -> str:
+    """
+    Version of the exogenous feature set for a prepared config.
+
+    Combines ``FEATURE_SET_VERSION`` with a hash of the settings the
+    exogenous features depend on. Dates that move every day are left out,
+    the store is kept per weather forecast issue anyway.
+    """
+    epias_cfg = config["epias"]
+    settings = {
+        "epias": {
+            key: epias_cfg[key]
+            for key in ("start_date", "company_name", "reading_type", "process")
+        },
+        "solar": {
+            key: config["solar"][key]
+            for key in ("start_date", "lat", "long", "alt", "timezone")
+        },
+        "locations": config["locations"],
+        "location_weights": config["location_weights"],
+        "historical_weather": {
+            key: config["historical_weather"][key]
+            for key in ("timezone", "h_start_date")
+        },
+        "forecast_weather": {"timezone": config["forecast_weather"]["timezone"]},
+        "memory": config["memory"],
+    }
+    digest = hashlib.sha1(
+        json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    return f"{FEATURE_SET_VERSION}-{digest[:12]}"
+
+
+class ExogenousFeatureStore:
+    """
+    Store of the exogenous (EPİAŞ, solar, calendar, weather) features per
+    weather forecast issue.
+
+    The features of an hour do not depend on the uploaded consumption, only
+    on the data available when they are computed: the EPİAŞ data of the day
+    and the weather forecast of the current issue. They are kept as
+    ``<root>/<issue>/<version>.parquet`` keyed by ``hour_key``, with the
+    hour range they were computed for and the categories of the categorical
+    columns in ``<version>.json``. Uploads of the same issue read their
+    window from it; a window outside the stored range is computed together
+    with the stored range, so the file only grows. The next issue starts a
+    new store, so the forecast weather rows are never older than the issue;
+    earlier issues are deleted on write.
+
+    Jobs of every worker share the store through ``get``: reads hold a
+    shared ``flock`` on ``<root>/<issue>.lock`` and computing and writing an
+    extended range an exclusive one, so a reader never sees the range of one
+    write with the rows of another. An earlier issue is only deleted when no
+    job holds its lock.
+    """
+
+    def __init__(self, root: str, version: str, issue: str):
+        """
+        Args:
+            root (str): Store directory
+            version (str): Feature set version, see ``feature_set_version``
+            issue (str): Weather forecast issue of the stored features
+                (YYYY-MM-DDTHH, ``forecast_weather.issue`` of the config)
+        """
+        self.root = root
+        self.version = version
+        self.issue = issue
+
+    def _path(self, extension):
+        return os.path.join(self.root, self.issue, f"{self.version}.{extension}")
+
+    def _lock_path(self, issue):
+        return os.path.join(self.root, f"{issue}.lock")
+
+    @contextmanager
+    def lock(self, shared=False):
+        """
+        Hold the lock of the issue, shared (reading) or exclusive (writing).
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._lock_path(self.issue), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, start_date, end_date, compute):
+        """
+        Return the features of the hours from ``start_date`` to ``end_date``,
+        computing them when the store does not cover them.
+
+        Args:
+            start_date (str): First hour (local time)
+            end_date (str): Last hour (local time)
+            compute (callable): Called with the first and last hour of the
+                range to compute (see ``span``), returns its features
+
+        Returns:
+            pd.DataFrame: ``hour_key`` and the exogenous feature columns (of
+            the whole computed range when they were computed)
+        """
+        with self.lock(shared=True):
+            df = self.read(start_date, end_date)
+        if df is not None:
+            return df
+
+        with self.lock():
+            # Another job may have stored the window while this one waited
+            df = self.read(start_date, end_date)
+            if df is not None:
+                return df
+            start, end = self.span(start_date, end_date)
+            df = compute(start, end)
+            self.write(df, start, end)
+        self.remove_earlier_issues()
+        return df
+
+    def _tmp_path(self, path):
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _stored(self):
+        try:
+            with open(self._path("json"), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return None
+        # Written before the row count was kept
+        return stored if "rows" in stored else None
+
+    def read(self, start_date, end_date):
+        """
+        Return the stored features of the hours from ``start_date`` to
+        ``end_date``, or None when the store does not cover them. Called
+        under ``lock``.
+
+        Args:
+            start_date (str): First hour (local time)
+            end_date (str): Last hour (local time)
+
+        Returns:
+            pd.DataFrame: ``hour_key`` and the exogenous feature columns
+        """
+        stored = self._stored()
+        start_key, end_key = to_hour_key([start_date, end_date])
+        if (
+            stored is None
+            or start_key < stored["start_key"]
+            or end_key > stored["end_key"]
+        ):
+            return None
+        # The rows have to be those of the stored range (the same write)
+        if pq.read_metadata(self._path("parquet")).num_rows != stored["rows"]:
+            return None
+        df = pd.read_parquet(
+            self._path("parquet"),
+            filters=[(HOUR_KEY, ">=", start_key), (HOUR_KEY, "<=", end_key)],
+        ).reset_index(drop=True)
+
+        # A read Parquet category only has the values of the read rows
+        dtypes = {
+            column: pd.CategoricalDtype(dtype["categories"], ordered=dtype["ordered"])
+            for column, dtype in stored["categories"].items()
+        }
+        return df.astype(dtypes)
+
+    def span(self, start_date, end_date):
+        """
+        Return the hours to compute for a window: the window extended by the
+        range already stored for the issue. Called under the exclusive
+        ``lock``.
+
+        Returns:
+            tuple: First and last hour (local time) as timestamps
+        """
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        stored = self._stored()
+        if stored is not None:
+            start = min(start, pd.Timestamp(stored["start_date"]))
+            end = max(end, pd.Timestamp(stored["end_date"]))
+        return start, end
+
+    def write(self, df: pd.DataFrame, start_date, end_date):
+        """
+        Store the features computed for the hours from ``start_date`` to
+        ``end_date``. Called under the exclusive ``lock``.
+
+        Args:
+            df (pd.DataFrame): ``hour_key`` and the exogenous feature columns
+            start_date: First computed hour (local time)
+            end_date: Last computed hour (local time)
+        """
+        os.makedirs(os.path.join(self.root, self.issue), exist_ok=True)
+        path = self._path("parquet")
+        tmp_path = self._tmp_path(path)
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+        # The range is written last, a reader never sees it before the rows
+        start_key, end_key = to_hour_key([start_date, end_date])
+        stored = {
+            "start_date": str(pd.Timestamp(start_date)),
+            "end_date": str(pd.Timestamp(end_date)),
+            "start_key": int(start_key),
+            "end_key": int(end_key),
+            "rows": len(df),
+            "categories": {
+                column: {
+                    "categories": df[column].cat.categories.tolist(),
+                    "ordered": bool(df[column].cat.ordered),
+                }
+                for column in df.select_dtypes("category").columns
+            },
+        }
+        path = self._path("json")
+        tmp_path = self._tmp_path(path)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, path)
+
+    def remove_earlier_issues(self):
+        """
+        Delete the stores of earlier issues that no job is using.
+        """
+        issues = {
+            os.path.basename(path).split(".")[0]
+            for path in glob.glob(os.path.join(self.root, "*"))
+        }
+        for issue in sorted(issues):
+            if issue >= self.issue:
+                continue
+            lock_path = self._lock_path(issue)
+            with open(lock_path, "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Still read or written; removed by a later write
+                    continue
+                shutil.rmtree(os.path.join(self.root, issue), ignore_errors=True)
+                os.remove(lock_path)
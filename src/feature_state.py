@@ -0,0 +1,366 @@
+import os
+import json
+import copy
+import bisect
+import threading
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+from feature_engine.timeseries.forecasting import (
+    LagFeatures,
+    WindowFeatures,
+    ExpandingWindowFeatures,
+)
+from utils.hour_key import HOUR_KEY
+
+
+def _median(values):
+    n = len(values)
+    if n == 0:
+        return np.nan
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2
+
+
+class StreamingFeatureState:
+    """
+    Online version of the LagFeatures -> WindowFeatures ->
+    ExpandingWindowFeatures pipeline used by the processors.
+
+    ``fit`` runs the feature_engine pipeline over a history and keeps, per
+    variable, a ring buffer of the last values (as many as the longest lag
+    or window) and running aggregates of the expanding statistics (count,
+    compensated sum, Welford mean/M2, min, max and the sorted values for the
+    median, only when it is requested). ``update`` emits the features of new
+    rows from that state and advances it, so its cost depends on the new
+    rows only.
+
+    Names and semantics follow feature_engine: lags shift by rows, window and
+    expanding statistics are shifted by one row, a window needs ``window``
+    non-missing values and an expanding statistic one (two for std). The
+    output equals the batch transformers up to floating point rounding of the
+    means and standard deviations.
+    """
+
+    FUNCTIONS = ("mean", "std", "min", "max", "median", "sum")
+
+    def __init__(self, variables, lags, windows, functions):
+        """
+        Args:
+            variables (list): Columns to build features from
+            lags (list): Lag periods in rows
+            windows (list): Rolling window sizes in rows
+            functions (list): Window and expanding functions, from ``FUNCTIONS``
+        """
+        unsupported = set(functions) - set(self.FUNCTIONS)
+        if unsupported:
+            raise ValueError(f"Desteklenmeyen fonksiyonlar: {sorted(unsupported)}")
+
+        self.variables = list(variables)
+        self.lags = list(lags)
+        self.windows = list(windows)
+        self.functions = list(functions)
+        self.size = max(self.lags + self.windows)
+        # The expanding median needs every value seen so far
+        self._keeps_sorted = "median" in self.functions
+        self._reset()
+
+    def _reset(self):
+        self.rows = 0
+        self.first_key = None
+        self.last_key = None
+        self._buffer = np.full((len(self.variables), self.size), np.nan)
+        self._head = 0
+        self._expanding = [self._empty_aggregate() for _ in self.variables]
+
+    @property
+    def config(self):
+        return {
+            "variables": self.variables,
+            "lags": self.lags,
+            "windows": self.windows,
+            "functions": self.functions,
+        }
+
+    def feature_names(self):
+        """
+        Return the feature columns in feature_engine's order.
+        """
+        return (
+            [f"{var}_lag_{lag}" for lag in self.lags for var in self.variables]
+            + [
+                f"{var}_window_{window}_{func}"
+                for window in self.windows
+                for var in self.variables
+                for func in self.functions
+            ]
+            + [
+                f"{var}_expanding_{func}"
+                for var in self.variables
+                for func in self.functions
+            ]
+        )
+
+    def _pipeline(self):
+        return Pipeline(
+            [
+                (
+                    "lag",
+                    LagFeatures(
+                        variables=self.variables,
+                        periods=self.lags,
+                        missing_values="ignore",
+                    ),
+                ),
+                (
+                    "window",
+                    WindowFeatures(
+                        variables=self.variables,
+                        window=self.windows,
+                        functions=self.functions,
+                        missing_values="ignore",
+                    ),
+                ),
+                (
+                    "expanding",
+                    ExpandingWindowFeatures(
+                        variables=self.variables,
+                        functions=self.functions,
+                        missing_values="ignore",
+                    ),
+                ),
+            ]
+        )
+
+    @staticmethod
+    def _empty_aggregate():
+        return {
+            "count": 0,
+            "sum": 0.0,
+            "compensation": 0.0,
+            "mean": 0.0,
+            "m2": 0.0,
+            "min": np.inf,
+            "max": -np.inf,
+            "sorted": [],
+        }
+
+    def _check_keys(self, df):
+        if HOUR_KEY not in df.columns or df.empty:
+            return
+        keys = df[HOUR_KEY].to_numpy()
+        if self.last_key is not None and keys[0] != self.last_key + 1:
+            raise ValueError(
+                f"Yeni satirlar {self.last_key + 1} saatinden başlamali, "
+                f"{keys[0]} geldi"
+            )
+        if self.first_key is None:
+            self.first_key = int(keys[0])
+        self.last_key = int(keys[-1])
+
+    def fit(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Build the features of a whole history with feature_engine and set the
+        state to its end.
+
+        Args:
+            df (pd.DataFrame): Rows in time order with the ``variables``
+                columns (and optionally ``hour_key``)
+
+        Returns:
+            pd.DataFrame: ``df`` with the feature columns appended
+        """
+        self._reset()
+        if df.empty:
+            return df.reindex(columns=list(df.columns) + self.feature_names())
+
+        self._check_keys(df)
+        out = self._pipeline().fit_transform(df)
+
+        values = df[self.variables].to_numpy(dtype="float64")
+        tail = values[-self.size :].T
+        self._buffer[:, : tail.shape[1]] = tail
+        self._head = tail.shape[1] % self.size
+        self.rows = len(df)
+
+        for i, column in enumerate(values.T):
+            observed = column[~np.isnan(column)]
+            aggregate = self._expanding[i]
+            if not len(observed):
+                continue
+            aggregate["count"] = len(observed)
+            aggregate["sum"] = float(observed.sum())
+            aggregate["mean"] = float(observed.mean())
+            aggregate["m2"] = float(((observed - aggregate["mean"]) ** 2).sum())
+            aggregate["min"] = float(observed.min())
+            aggregate["max"] = float(observed.max())
+            if self._keeps_sorted:
+                aggregate["sorted"] = np.sort(observed).tolist()
+        return out
+
+    def _last(self, n):
+        positions = np.arange(self._head - n, self._head) % self.size
+        return self._buffer[:, positions]
+
+    def _window_value(self, values, func):
+        if func == "mean":
+            return values.mean()
+        if func == "std":
+            return values.std(ddof=1) if len(values) > 1 else np.nan
+        if func == "min":
+            return values.min()
+        if func == "max":
+            return values.max()
+        if func == "median":
+            return np.median(values)
+        return values.sum()
+
+    def _expanding_value(self, aggregate, func):
+        count = aggregate["count"]
+        if count == 0 or (func == "std" and count < 2):
+            return np.nan
+        if func == "mean":
+            return aggregate["sum"] / count
+        if func == "std":
+            return np.sqrt(max(aggregate["m2"], 0.0) / (count - 1))
+        if func == "median":
+            return _median(aggregate["sorted"])
+        return aggregate[func]
+
+    def _emit(self):
+        row = []
+        for lag in self.lags:
+            row.extend(self._last(lag)[:, 0])
+        for window in self.windows:
+            last = self._last(window)
+            for values in last:
+                complete = not np.isnan(values).any()
+                for func in self.functions:
+                    row.append(self._window_value(values, func) if complete else np.nan)
+        for aggregate in self._expanding:
+            for func in self.functions:
+                row.append(self._expanding_value(aggregate, func))
+        return row
+
+    def _push(self, values):
+        self._buffer[:, self._head] = values
+        self._head = (self._head + 1) % self.size
+        self.rows += 1
+        for value, aggregate in zip(values, self._expanding):
+            if np.isnan(value):
+                continue
+            # Kahan summation for the mean, Welford's method for the variance
+            y = value - aggregate["compensation"]
+            total = aggregate["sum"] + y
+            aggregate["compensation"] = (total - aggregate["sum"]) - y
+            aggregate["sum"] = total
+
+            aggregate["count"] += 1
+            delta = value - aggregate["mean"]
+            aggregate["mean"] += delta / aggregate["count"]
+            aggregate["m2"] += delta * (value - aggregate["mean"])
+
+            aggregate["min"] = min(aggregate["min"], value)
+            aggregate["max"] = max(aggregate["max"], value)
+            if self._keeps_sorted:
+                bisect.insort(aggregate["sorted"], value)
+
+    def update(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Emit the features of rows that follow the current state and advance
+        the state over them.
+
+        Args:
+            df (pd.DataFrame): New rows in time order. With an ``hour_key``
+                column the rows must start right after ``last_key``.
+
+        Returns:
+            pd.DataFrame: ``df`` with the feature columns appended
+        """
+        self._check_keys(df)
+        values = df[self.variables].to_numpy(dtype="float64")
+        rows = []
+        with np.errstate(invalid="ignore"):
+            for row_values in values:
+                rows.append(self._emit())
+                self._push(row_values)
+
+        columns = self.feature_names()
+        features = pd.DataFrame(
+            np.array(rows, dtype="float64").reshape(len(rows), len(columns)),
+            columns=columns,
+            index=df.index,
+        )
+        return pd.concat([df, features], axis=1)
+
+    def copy(self):
+        state = copy.copy(self)
+        state._buffer = self._buffer.copy()
+        state._expanding = [
+            {**aggregate, "sorted": list(aggregate["sorted"])}
+            for aggregate in self._expanding
+        ]
+        return state
+
+    def to_dict(self):
+        def encode(value):
+            return None if np.isnan(value) or np.isinf(value) else float(value)
+
+        return {
+            "config": self.config,
+            "rows": self.rows,
+            "first_key": self.first_key,
+            "last_key": self.last_key,
+            "head": self._head,
+            "buffer": [[encode(v) for v in row] for row in self._buffer],
+            "expanding": [
+                {
+                    **{
+                        key: encode(aggregate[key])
+                        for key in ("sum", "compensation", "mean", "m2", "min", "max")
+                    },
+                    "count": aggregate["count"],
+                    "sorted": aggregate["sorted"],
+                }
+                for aggregate in self._expanding
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(**data["config"])
+        state.rows = data["rows"]
+        state.first_key = data["first_key"]
+        state.last_key = data["last_key"]
+        state._head = data["head"]
+        state._buffer = np.array(
+            [[np.nan if v is None else v for v in row] for row in data["buffer"]],
+            dtype="float64",
+        ).reshape(len(state.variables), state.size)
+        defaults = {"min": np.inf, "max": -np.inf}
+        for aggregate, saved in zip(state._expanding, data["expanding"]):
+            for key, value in saved.items():
+                aggregate[key] = defaults.get(key, 0.0) if value is None else value
+        return state
+
+    def save(self, path):
+        """
+        Write the state as JSON (atomically).
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a state written by ``save``; None when the file does not exist.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
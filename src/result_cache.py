@@ -0,0 +1,144 @@
+import os
+import json
+import glob
+import time
+import hashlib
+import threading
+import pandas as pd
+
+# Bump when the output of a forecast run changes for the same inputs, so
+# that results stored by the old code are not returned
+RESULT_FORMAT_VERSION = 1
+
+# Sections of the config that do not change the forecast (a retrained
+# model changes the model version)
+_UNKEYED_SECTIONS = ("result_cache", "training")
+
+# Decimals of the consumption kept for the hash; the same workbook saved as
+# .xlsx or .csv differs only in the last bits
+CONSUMPTION_DECIMALS = 6
+
+
+def series_hash(data: pd.DataFrame) -> str:
+    """
+    Hash of a loaded consumption series (``date`` and ``consumption``).
+
+    The series is hashed after ``DataLoader`` normalized it (date and hour
+    combined, sorted, forecast hours appended) and the consumption rounded
+    to ``CONSUMPTION_DECIMALS``, so the same data uploaded as ``.xlsx``,
+    ``.csv`` or ``.parquet`` gets the same hash.
+    """
+    series = data[["date", "consumption"]].round({"consumption": CONSUMPTION_DECIMALS})
+    values = pd.util.hash_pandas_object(series, index=False)
+    return hashlib.sha1(values.to_numpy().tobytes()).hexdigest()
+
+
+def config_hash(config: dict) -> str:
+    """
+    Hash of the settings a forecast depends on; ``config`` is the config
+    file as loaded, before the daily dates and the credentials are added.
+    """
+    settings = {
+        section: value
+        for section, value in config.items()
+        if section not in _UNKEYED_SECTIONS
+    }
+    return hashlib.sha1(
+        json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def data_date(config: dict) -> str:
+    """
+    Date of the external data a forecast made now is based on: the EPİAŞ
+    end date and the forecast weather issue (the current time floored to
+    ``forecast_weather.issue_hours``, see ``data_prepare_config``).
+
+    Args:
+        config (dict): Prepared config (``data_prepare_config``)
+    """
+    return "{}|{}".format(
+        config["epias"]["end_date"], config["forecast_weather"]["issue"]
+    )
+
+
+def result_key(series: str, model_version: str, config: str, date: str) -> str:
+    """
+    Cache key of a forecast from the hashes of its inputs.
+    """
+    key = json.dumps([RESULT_FORMAT_VERSION, series, model_version, config, date])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Store of finished forecasts keyed by ``result_key``.
+
+    An upload identical to an earlier one (same consumption series, model,
+    config and data date) gets the stored forecast back without running the
+    pipeline. Each result is ``<root>/<key>.parquet``. Entries older than
+    ``max_age`` seconds are misses and are deleted on write, together with
+    the oldest entries while the store is larger than ``max_bytes``.
+    """
+
+    def __init__(self, root: str, max_age: float = 86400, max_bytes: int = None):
+        """
+        Args:
+            root (str): Store directory
+            max_age (float): Seconds a result is served after it was stored
+            max_bytes (int, optional): Largest total size of the store
+        """
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.parquet")
+
+    def get(self, key: str) -> pd.DataFrame:
+        """
+        Return the stored forecast of ``key``, or None.
+        """
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            return pd.read_parquet(path)
+        except (FileNotFoundError, OSError):
+            return None
+
+    def put(self, key: str, df: pd.DataFrame):
+        """
+        Store the forecast of ``key`` and evict old entries.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the expired entries, then the oldest ones until the store
+        fits in ``max_bytes``.
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.root, "*.parquet")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            expired = now - mtime > self.max_age
+            if not expired and (self.max_bytes is None or total <= self.max_bytes):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
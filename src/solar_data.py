@@ -1,11 +1,17 @@
+import os
+import hashlib
+import threading
 import pandas as pd
 import pvlib
 import numpy as np
-from functools import reduce
+from utils.hour_key import HOUR_KEY, to_hour_key
 
 
 class SolarDataProcessor:
-    def __init__(self, lat, long, alt, timezone="Europe/Istanbul"):
+    # Tables already read from the cache in this process: path -> (mtime, df)
+    _memory_cache = {}
+
+    def __init__(self, lat, long, alt, timezone="Europe/Istanbul", cache_dir=None):
         """
         Initialize the solar data processor with location parameters.
 
@@ -14,20 +20,31 @@ class SolarDataProcessor:
             long (float): Longitude in degrees
             alt (float): Altitude in meters
             timezone (str): Timezone string, default is 'Europe/Istanbul'
+            cache_dir (str, optional): Directory of the persistent solar
+                feature cache. Disabled when None.
         """
         self.lat = lat
         self.long = long
         self.alt = alt
         self.timezone = timezone
+        self.cache_dir = cache_dir
         self.location = pvlib.location.Location(lat, long, timezone, alt)
 
-    def process_data(self, start_date, end_date):
+    def process_data(self, start_date, end_date, window_start=None):
         """
         Process solar data for the given date range.
 
+        With a cache directory the feature table of this location and start
+        date is read from disk and only extended when ``end_date`` lies past
+        the stored range.
+
+        The cumulative features run from ``start_date``, so the table always
+        starts there; ``window_start`` only limits the returned rows.
+
         Args:
             start_date (str): Start date in YYYY-MM-DD format
             end_date (str): End date in YYYY-MM-DD format
+            window_start (str, optional): First returned hour (local time)
 
         Returns:
             pd.DataFrame: Processed solar data with additional features
@@ -35,6 +52,82 @@ class SolarDataProcessor:
         # Create hourly time range
         times = pd.date_range(start_date, end_date, freq="h", tz=self.timezone)
 
+        if self.cache_dir is None:
+            solar_data = self._add_features(
+                self._add_cumulative(self._compute_base(times))
+            )
+            return self._finish(solar_data, window_start)
+
+        path = self._cache_path(times[0])
+        solar_data = self._read_cache(path)
+        if solar_data is None:
+            solar_data = self._add_features(
+                self._add_cumulative(self._compute_base(times))
+            )
+            self._write_cache(path, solar_data)
+        elif solar_data["date"].iloc[-1] < times[-1]:
+            # Only the missing tail goes through pvlib; the cumulative and
+            # rolling features are rebuilt over the extended table
+            new_times = pd.date_range(
+                solar_data["date"].iloc[-1] + pd.Timedelta(hours=1),
+                times[-1],
+                freq="h",
+            )
+            base = pd.concat(
+                [solar_data.loc[:, :"daylight"], self._compute_base(new_times)],
+                ignore_index=True,
+            )
+            solar_data = self._add_features(self._add_cumulative(base))
+            self._write_cache(path, solar_data)
+
+        return self._finish(solar_data.iloc[: len(times)], window_start)
+
+    def _finish(self, solar_data, window_start):
+        if window_start is not None:
+            start = pd.Timestamp(window_start).tz_localize(self.timezone)
+            solar_data = solar_data[solar_data["date"] >= start]
+        solar_data = solar_data.reset_index(drop=True)
+        solar_data.insert(1, HOUR_KEY, to_hour_key(solar_data["date"]))
+        return solar_data
+
+    def _cache_path(self, start):
+        key = "|".join(
+            str(value)
+            for value in (
+                self.lat,
+                self.long,
+                self.alt,
+                self.timezone,
+                start.isoformat(),
+            )
+        )
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"solar_{digest}.parquet")
+
+    def _read_cache(self, path):
+        if not os.path.exists(path):
+            return None
+        mtime = os.path.getmtime(path)
+        cached = self._memory_cache.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, pd.read_parquet(path))
+            self._memory_cache[path] = cached
+        return cached[1]
+
+    def _write_cache(self, path, solar_data):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        solar_data.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self._memory_cache[path] = (os.path.getmtime(path), solar_data)
+
+    def _compute_base(self, times):
+        """
+        Compute the pvlib clear-sky and solar position values for ``times``.
+
+        Every row only depends on its own timestamp, so tables computed for
+        consecutive ranges can be concatenated.
+        """
         # Get clear-sky data
         clear_sky = self.location.get_clearsky(times)
         solar_position_data = self.location.get_solarposition(times)
@@ -48,29 +141,26 @@ class SolarDataProcessor:
         )
 
         # Calculate sunrise and sunset times
-        solar_position_data["sunrise"] = solar_position_data["apparent_zenith"].apply(
-            lambda x: x < 90
-        )
-        solar_position_data["sunset"] = solar_position_data["apparent_zenith"].apply(
-            lambda x: x >= 90
-        )
+        solar_position_data["sunrise"] = solar_position_data["apparent_zenith"] < 90
+        solar_position_data["sunset"] = solar_position_data["apparent_zenith"] >= 90
 
         # Calculate daylight duration
         solar_position_data["daylight"] = solar_position_data["sunrise"].astype(
             int
         ) - solar_position_data["sunset"].astype(int)
-        solar_position_data["daylight_hours"] = solar_position_data["daylight"].cumsum()
-
-        # Merge clear-sky and solar position data
-        clear_sky.reset_index(inplace=True)
-        solar_position_data.reset_index(inplace=True)
-        dfs = [clear_sky, solar_position_data]
-        solar_data = reduce(
-            lambda left, right: pd.merge(left, right, on="index", how="inner"), dfs
-        )
-        solar_data.rename(columns={"index": "date"}, inplace=True)
 
-        return self._add_features(solar_data)
+        # Clear-sky and solar position data share the same time index
+        solar_data = pd.concat([clear_sky, solar_position_data], axis=1)
+        solar_data = solar_data.rename_axis("date").reset_index()
+
+        return solar_data
+
+    def _add_cumulative(self, solar_data):
+        """
+        Add the daylight duration running from the first row of the table.
+        """
+        solar_data["daylight_hours"] = solar_data["daylight"].cumsum()
+        return solar_data
 
     def _add_features(self, solar_data):
         """
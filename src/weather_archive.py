@@ -0,0 +1,123 @@
+import os
+import fcntl
+import threading
+import pandas as pd
+from src.weather_features import HOURLY_VARIABLES
+
+
+class WeatherArchive:
+    """
+    Append-only local archive of raw hourly Open-Meteo archive variables.
+
+    Every location is kept as one Parquet file under
+    ``<root>/<lat>_<lon>.parquet`` with a time zone aware ``date`` column and
+    the ``HOURLY_VARIABLES`` columns. Trailing hours the archive API has not
+    filled yet are stored empty, and their days are downloaded again on the
+    next run. A location is locked (``flock`` on ``<lat>_<lon>.lock``) while
+    it is merged, so concurrent jobs extending it keep each other's hours.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, lat, lon):
+        return os.path.join(self.root, f"{lat:.4f}_{lon:.4f}.parquet")
+
+    def next_day(self, lat, lon, start_date):
+        """
+        Return the first day that has to be downloaded for a location.
+
+        Args:
+            lat (float): Latitude
+            lon (float): Longitude
+            start_date (str): First day the caller needs (YYYY-MM-DD)
+
+        Returns:
+            pd.Timestamp: ``start_date`` when the archive is empty or starts
+            later, otherwise the day after the last stored day, or the first
+            day with trailing empty hours
+        """
+        start = pd.Timestamp(start_date).normalize()
+        path = self._path(lat, lon)
+        if not os.path.exists(path):
+            return start
+        df = pd.read_parquet(path)
+        if df.empty or pd.Timestamp(df["date"].iloc[0].date()) > start:
+            return start
+
+        has_value = df[HOURLY_VARIABLES].notna().any(axis=1).to_numpy()
+        if has_value[-1]:
+            return pd.Timestamp(df["date"].iloc[-1].date()) + pd.Timedelta(days=1)
+        first_empty = (
+            len(has_value) - has_value[::-1].argmax() if has_value.any() else 0
+        )
+        return pd.Timestamp(df["date"].iloc[first_empty].date())
+
+    def append(self, lat, lon, df: pd.DataFrame):
+        """
+        Append newly downloaded hours of a location.
+
+        Stored hours in the downloaded range are replaced, so previously
+        empty trailing hours are filled in.
+
+        Args:
+            lat (float): Latitude
+            lon (float): Longitude
+            df (pd.DataFrame): Raw hourly frame from ``hourly_frame``
+        """
+        if df.empty:
+            return
+
+        path = self._path(lat, lon)
+        with open(f"{path[: -len('.parquet')]}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._merge(path, df)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _merge(self, path, df):
+        if os.path.exists(path):
+            stored = pd.read_parquet(path)
+            df = df.assign(date=df["date"].dt.tz_convert(stored["date"].dt.tz))
+            # Hours another job stored after this download are kept
+            after = stored[stored["date"] > df["date"].iloc[-1]]
+            stored = stored[stored["date"] < df["date"].iloc[0]]
+            df = pd.concat([stored, df, after], ignore_index=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    def read(self, lat, lon, start_date, end_date, timezone="Europe/Istanbul"):
+        """
+        Read every hour of the days from ``start_date`` to ``end_date``.
+
+        Hours missing from the archive are returned as empty rows, the same
+        way the archive API reports hours it has no data for.
+
+        Args:
+            lat (float): Latitude
+            lon (float): Longitude
+            start_date (str): First day (YYYY-MM-DD)
+            end_date (str): Last day (YYYY-MM-DD)
+            timezone (str): Timezone of the returned ``date`` column
+
+        Returns:
+            pd.DataFrame: ``date`` and ``HOURLY_VARIABLES`` columns
+        """
+        hours = pd.date_range(
+            start=pd.Timestamp(start_date).tz_localize(timezone),
+            end=pd.Timestamp(end_date).tz_localize(timezone) + pd.Timedelta(days=1),
+            freq="h",
+            inclusive="left",
+            name="date",
+        )
+        path = self._path(lat, lon)
+        if not os.path.exists(path):
+            df = pd.DataFrame(index=hours, columns=HOURLY_VARIABLES, dtype="float32")
+            return df.reset_index()
+
+        df = pd.read_parquet(path)
+        df["date"] = df["date"].dt.tz_convert(timezone)
+        return df.set_index("date").reindex(hours).reset_index()
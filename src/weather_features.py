@@ -0,0 +1,233 @@
+import numpy as np
+import pandas as pd
+from utils.hour_key import HOUR_KEY, to_hour_key
+
+WEATHER_MAPPING = {
+    0: "Clear sky",
+    1: "Mainly clear",
+    2: "Partly cloudy",
+    3: "Overcast",
+    45: "Fog",
+    48: "Depositing rime fog",
+    51: "Drizzle: Light",
+    53: "Drizzle: Moderate",
+    55: "Drizzle: Dense intensity",
+    56: "Freezing Drizzle: Light",
+    57: "Freezing Drizzle: Dense intensity",
+    61: "Rain: Slight",
+    63: "Rain: Moderate",
+    65: "Rain: Heavy intensity",
+    66: "Freezing Rain: Light",
+    67: "Freezing Rain: Heavy intensity",
+    71: "Snow fall: Slight",
+    73: "Snow fall: Moderate",
+    75: "Snow fall: Heavy intensity",
+    77: "Snow grains",
+    80: "Rain showers: Slight",
+    81: "Rain showers: Moderate",
+    82: "Rain showers: Violent",
+    85: "Snow showers: Slight",
+    86: "Snow showers: Heavy",
+    95: "Thunderstorm: Slight or moderate",
+    96: "Thunderstorm with slight hail",
+    99: "Thunderstorm with heavy hail",
+}
+
+WEATHER_SEVERITY = {
+    "Clear sky": 0,
+    "Mainly clear": 0,
+    "Partly cloudy": 1,
+    "Overcast": 1,
+    "Fog": 2,
+    "Depositing rime fog": 2,
+    "Drizzle: Light": 3,
+    "Drizzle: Moderate": 3,
+    "Drizzle: Dense intensity": 3,
+    "Freezing Drizzle: Light": 4,
+    "Freezing Drizzle: Dense intensity": 4,
+    "Rain: Slight": 5,
+    "Rain: Moderate": 5,
+    "Rain: Heavy intensity": 5,
+    "Freezing Rain: Light": 6,
+    "Freezing Rain: Heavy intensity": 6,
+    "Snow fall: Slight": 7,
+    "Snow fall: Moderate": 7,
+    "Snow fall: Heavy intensity": 7,
+    "Snow grains": 7,
+    "Rain showers: Slight": 8,
+    "Rain showers: Moderate": 8,
+    "Rain showers: Violent": 8,
+    "Snow showers: Slight": 9,
+    "Snow showers: Heavy": 9,
+    "Thunderstorm: Slight or moderate": 10,
+    "Thunderstorm with slight hail": 10,
+    "Thunderstorm with heavy hail": 10,
+}
+
+WIND_DIRECTIONS = np.array(["N", "NE", "E", "SE", "S", "SW", "W", "NW"], dtype=object)
+
+HOURLY_VARIABLES = [
+    "temperature_2m",
+    "relative_humidity_2m",
+    "dew_point_2m",
+    "apparent_temperature",
+    "precipitation",
+    "snow_depth",
+    "weather_code",
+    "surface_pressure",
+    "wind_speed_10m",
+    "wind_direction_10m",
+    "shortwave_radiation",
+]
+
+LAG_HOURS = [1, 2, 3, 4, 5, 6, 24, 48]
+# Hours before the first returned row that the lag and rolling features read
+LOOKBACK_HOURS = max(LAG_HOURS)
+
+
+def hourly_frame(response, timezone="Europe/Istanbul") -> pd.DataFrame:
+    """
+    Convert one Open-Meteo location response into a raw hourly frame.
+
+    Args:
+        response: ``WeatherApiResponse`` requested with ``HOURLY_VARIABLES``
+        timezone (str): Timezone of the returned ``date`` column
+
+    Returns:
+        pd.DataFrame: ``date`` and ``HOURLY_VARIABLES`` columns
+    """
+    hourly = response.Hourly()
+    dates = pd.date_range(
+        start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
+        end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
+        freq=pd.Timedelta(seconds=hourly.Interval()),
+        inclusive="left",
+    )
+
+    data = {"date": dates}
+    for i, variable in enumerate(HOURLY_VARIABLES):
+        data[variable] = hourly.Variables(i).ValuesAsNumpy()
+
+    df = pd.DataFrame(data)
+    df["date"] = df["date"].dt.tz_convert(timezone)
+    return df
+
+
+def wind_direction_category(degrees):
+    """
+    Map wind directions in degrees to 8 compass sectors of 45 degrees.
+
+    The sector index is ``(degree + 22.5) % 360 // 45``. Missing directions
+    stay missing (None).
+    """
+    degrees = np.asarray(degrees, dtype="float64")
+    valid = ~np.isnan(degrees)
+    sectors = np.full(degrees.shape, None, dtype=object)
+    index = ((degrees[valid] + 22.5) % 360 // 45).astype("int64")
+    sectors[valid] = WIND_DIRECTIONS[index]
+    return sectors
+
+
+def hdd_cdd(temp, base_temp=18):
+    """
+    Heating and cooling degree hours around ``base_temp``.
+    """
+    temp = np.asarray(temp, dtype="float64")
+    return np.clip(base_temp - temp, 0, None), np.clip(temp - base_temp, 0, None)
+
+
+def wind_chill(temp, wind_speed):
+    temp = np.asarray(temp, dtype="float64")
+    wind_factor = np.asarray(wind_speed, dtype="float64") ** 0.16
+    return 13.12 + 0.6215 * temp - 11.37 * wind_factor + 0.3965 * temp * wind_factor
+
+
+def heat_index(temp, humidity):
+    """
+    Rothfusz heat index for temperatures of 27°C and above, the temperature
+    itself below that.
+    """
+    temp = np.asarray(temp, dtype="float64")
+    humidity = np.asarray(humidity, dtype="float64")
+    index = (
+        -42.379
+        + 2.04901523 * temp
+        + 10.14333127 * humidity
+        - 0.22475541 * temp * humidity
+        - 6.83783e-3 * temp**2
+        - 5.481717e-2 * humidity**2
+        + 1.22874e-3 * temp**2 * humidity
+        + 8.5282e-4 * temp * humidity**2
+        - 1.99e-6 * temp**2 * humidity**2
+    )
+    return np.where(temp < 27, temp, index)
+
+
+def add_weather_features(df: pd.DataFrame, window_start=None) -> pd.DataFrame:
+    """
+    Add the derived weather features to a raw hourly Open-Meteo frame.
+
+    The temperature and humidity levels are deciles of the whole frame. With
+    ``window_start`` the other features are only computed from
+    ``LOOKBACK_HOURS`` (rounded down to the day) before it, and only the rows
+    from ``window_start`` on are returned.
+
+    Args:
+        df (pd.DataFrame): ``date`` (local time) and ``HOURLY_VARIABLES`` columns
+        window_start (str, optional): First returned hour (local time)
+
+    Returns:
+        pd.DataFrame: ``df`` with categorized and derived feature columns and
+        the ``hour_key`` column
+    """
+    temperature_cut = pd.qcut(
+        df["temperature_2m"].rank(method="first"),
+        10,
+        labels=[f"temperature_level_{i}" for i in range(1, 11)],
+    )
+    humidity_cut = pd.qcut(
+        df["relative_humidity_2m"].rank(method="first"),
+        10,
+        labels=[f"humidity_level_{i}" for i in range(1, 11)],
+    )
+    if window_start is not None:
+        window_start = pd.Timestamp(window_start).tz_localize(df["date"].dt.tz)
+        first_day = (window_start - pd.Timedelta(hours=LOOKBACK_HOURS)).normalize()
+        keep = (df["date"] >= first_day).to_numpy()
+        df = df[keep].reset_index(drop=True)
+        temperature_cut = temperature_cut[keep].reset_index(drop=True)
+        humidity_cut = humidity_cut[keep].reset_index(drop=True)
+
+    temp = df["temperature_2m"].to_numpy()
+    humidity = df["relative_humidity_2m"].to_numpy()
+
+    daily_temp = df.groupby(df["date"].dt.date)["temperature_2m"]
+    df["daily_temp_range"] = daily_temp.transform("max").astype(
+        "float64"
+    ) - daily_temp.transform("min").astype("float64")
+
+    df["wind_direction_10m"] = wind_direction_category(df["wind_direction_10m"])
+    df["temperature_cut"] = temperature_cut
+    df["humidity_cut"] = humidity_cut
+    df["weather_code"] = df["weather_code"].replace(WEATHER_MAPPING)
+
+    df["HDD"], df["CDD"] = hdd_cdd(temp)
+    df["precipitation_duration"] = (df["precipitation"] > 0).rolling(24).sum()
+    df["wind_chill"] = wind_chill(temp, df["wind_speed_10m"].to_numpy())
+    df["cumulative_precipitation_24h"] = df["precipitation"].rolling(24).sum()
+    df["heat_index"] = heat_index(temp, humidity)
+
+    for lag in LAG_HOURS:
+        df[f"temp_lag_{lag}h"] = df["temperature_2m"].shift(lag)
+        df[f"humidity_lag_{lag}h"] = df["relative_humidity_2m"].shift(lag)
+
+    df["weather_severity"] = df["weather_code"].map(WEATHER_SEVERITY)
+    df["weather_change_score"] = df["weather_severity"].diff().abs()
+    df["temperature_humidity_cut"] = (
+        df["temperature_cut"].astype(str) + "--" + df["humidity_cut"].astype(str)
+    )
+    df[HOUR_KEY] = to_hour_key(df["date"])
+
+    if window_start is not None:
+        df = df[df["date"] >= window_start].reset_index(drop=True)
+    return df
@@ -0,0 +1,256 @@
+"""
+Train the forecast model on the prepared historical data.
+
+The training period is split with ``TimeSeriesSplit`` (``get_tscv_splits``)
+and one CatBoost model is trained per split, the splits in parallel in a
+process pool. The split models, their metrics and the feature list are
+written as one model bundle, which the pipeline serves as an ensemble when
+``model.path`` in the config points at it.
+
+    python train.py
+    python train.py --data-path data/raw --max-workers 3
+
+Settings come from the ``training`` section of ``utils/config.json``; the
+options override them.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import catboost as cb
+from utils.model_bundle import write_bundle
+from utils.model_train_functions import ModelTrainFunctions
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(BASE_DIR, "utils", "config.json")
+
+WEIGHTINGS = ("uniform", "inverse_val_mape")
+
+# Training data of a pool worker, loaded once per process
+_data = {}
+
+
+def _load_data(data_path, unseen_size):
+    historical_data, _ = ModelTrainFunctions().get_data(data_path)
+    _data["train"] = historical_data.iloc[:-unseen_size, :]
+    _data["unseen"] = historical_data.iloc[-unseen_size:, :]
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _features(df, cat_cols):
+    X = df.drop(columns=["consumption"])
+    # CatBoost takes no missing categories; "None" as in Holiday_Flag
+    X[cat_cols] = X[cat_cols].astype(object).fillna("None")
+    return X
+
+
+def categorical_columns(df):
+    return (
+        df.drop(columns=["consumption"])
+        .select_dtypes(include=["category", "object"])
+        .columns.tolist()
+    )
+
+
+def train_split(split, params, early_stopping_rounds, thread_count):
+    """
+    Train the model of one split in a pool worker.
+
+    Returns:
+        tuple: The fitted model and its metrics (train, validation and
+        unseen MAPE, best iteration, seconds)
+    """
+    mtf = ModelTrainFunctions()
+    train, unseen = _data["train"], _data["unseen"]
+    train_df = train[split["train_period"][0] : split["train_period"][1]]
+    val_df = train[split["val_period"][0] : split["val_period"][1]]
+    cat_cols = categorical_columns(train)
+    X_train, y_train = _features(train_df, cat_cols), train_df["consumption"]
+    X_val, y_val = _features(val_df, cat_cols), val_df["consumption"]
+
+    started_at = time.perf_counter()
+    model = cb.CatBoostRegressor(
+        **params, thread_count=thread_count, allow_writing_files=False
+    )
+    model.fit(
+        cb.Pool(X_train, label=y_train, cat_features=cat_cols),
+        eval_set=cb.Pool(X_val, label=y_val, cat_features=cat_cols),
+        early_stopping_rounds=early_stopping_rounds,
+        verbose=False,
+    )
+    seconds = time.perf_counter() - started_at
+
+    unseen_features = _features(unseen, cat_cols)
+    metrics = {
+        "train_mape": mtf.calculate_mape(y_train, model.predict(X_train))[1],
+        "val_mape": mtf.calculate_mape(y_val, model.predict(X_val))[1],
+        "unseen_mape": mtf.calculate_mape(
+            unseen["consumption"], model.predict(unseen_features)
+        )[1],
+        "best_iteration": model.get_best_iteration(),
+        "seconds": round(seconds, 1),
+    }
+    return model, {key: float(value) for key, value in metrics.items()}
+
+
+def split_weights(metrics, weighting):
+    """
+    Ensemble weight per split model: equal, or inversely proportional to
+    the validation MAPE.
+    """
+    if weighting == "uniform":
+        return [1.0 for _ in metrics]
+    if weighting == "inverse_val_mape":
+        return [1.0 / max(split["val_mape"], 1e-6) for split in metrics]
+    raise ValueError(f"Weighting must be one of {WEIGHTINGS}: {weighting}")
+
+
+def train(training_cfg, max_workers=None):
+    """
+    Train one model per split in a process pool and write the bundle.
+
+    Each worker gets an equal share of the CPUs as CatBoost threads, so the
+    parallel splits together use every core without oversubscribing.
+
+    Returns:
+        dict: Manifest of the written bundle
+    """
+    data_path = os.path.join(BASE_DIR, training_cfg["data_path"])
+    unseen_size = training_cfg["unseen_size"]
+    _load_data(data_path, unseen_size)
+    train_df = _data["train"]
+    splits = ModelTrainFunctions().get_tscv_splits(
+        train_df.index,
+        n_splits=training_cfg["n_splits"],
+        test_size=training_cfg["val_size"],
+    )
+    ModelTrainFunctions().print_splits_info(splits)
+
+    cpus = available_cpus()
+    workers = min(len(splits), max_workers or training_cfg["max_workers"] or cpus)
+    thread_count = max(1, cpus // workers)
+    print(
+        f"{len(splits)} splits on {workers} processes x {thread_count} CatBoost threads"
+    )
+
+    started_at = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_load_data,
+        initargs=(data_path, unseen_size),
+    ) as executor:
+        futures = [
+            executor.submit(
+                train_split,
+                split,
+                training_cfg["params"],
+                training_cfg["early_stopping_rounds"],
+                thread_count,
+            )
+            for split in splits
+        ]
+        results = [future.result() for future in futures]
+    print(f"Training completed in {time.perf_counter() - started_at:.1f} s")
+
+    metrics = [split_metrics for _, split_metrics in results]
+    weights = split_weights(metrics, training_cfg["weights"])
+    summary = {
+        name: {
+            "mean": float(np.mean([split[name] for split in metrics])),
+            "std": float(np.std([split[name] for split in metrics])),
+        }
+        for name in ("train_mape", "val_mape", "unseen_mape")
+    }
+    models = [
+        (
+            f"split_{i + 1}",
+            model,
+            weight,
+            {
+                "split": {
+                    "train_period": [str(date) for date in split["train_period"]],
+                    "val_period": [str(date) for date in split["val_period"]],
+                },
+                "metrics": split_metrics,
+            },
+        )
+        for i, (split, (model, split_metrics), weight) in enumerate(
+            zip(splits, results, weights)
+        )
+    ]
+    return write_bundle(
+        os.path.join(BASE_DIR, training_cfg["bundle_path"]),
+        models,
+        metadata={
+            "feature_names": train_df.columns.drop("consumption").tolist(),
+            "cat_features": categorical_columns(train_df),
+            "metrics": summary,
+            "training": training_cfg,
+        },
+    )
+
+
+def format_metrics(manifest):
+    header = (
+        f"{'model':<12}{'weight':>8}{'train %':>10}{'val %':>8}{'unseen %':>10}"
+        f"{'iter':>7}"
+    )
+    lines = [header]
+    total = sum(model["weight"] for model in manifest["models"])
+    for model in manifest["models"]:
+        metrics = model["metrics"]
+        lines.append(
+            f"{model['file'][:-4]:<12}{model['weight'] / total:>8.3f}"
+            f"{metrics['train_mape']:>10.2f}{metrics['val_mape']:>8.2f}"
+            f"{metrics['unseen_mape']:>10.2f}{metrics['best_iteration']:>7.0f}"
+        )
+    summary = manifest["metrics"]
+    lines.append(
+        f"{'mean':<20}{summary['train_mape']['mean']:>10.2f}"
+        f"{summary['val_mape']['mean']:>8.2f}{summary['unseen_mape']['mean']:>10.2f}"
+    )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--config", default=CONFIG_PATH)
+    parser.add_argument(
+        "--data-path",
+        help="Directory of Historical_Data.parquet and Forecast_Data.parquet",
+    )
+    parser.add_argument("--bundle-path", help="Model bundle to write")
+    parser.add_argument("--n-splits", type=int)
+    parser.add_argument(
+        "--max-workers", type=int, help="Parallel splits (default: one per CPU)"
+    )
+    parser.add_argument("--weights", choices=WEIGHTINGS)
+    args = parser.parse_args(argv)
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        training_cfg = json.load(f)["training"]
+    for key in ("data_path", "bundle_path", "n_splits", "weights"):
+        if getattr(args, key) is not None:
+            training_cfg[key] = getattr(args, key)
+
+    manifest = train(training_cfg, max_workers=args.max_workers)
+    print(format_metrics(manifest))
+    print(
+        f"Model bundle {manifest['version']} written to "
+        f"{training_cfg['bundle_path']}; serve it by setting model.path to it"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,17 +2,47 @@ import json
 from datetime import datetime, timedelta
 import pandas as pd
 from dotenv import load_dotenv
+from utils.transport import transport
 import os
 
 load_dotenv()
 
 
+def set_window(config: dict, start_date, end_date) -> dict:
+    """
+    Hedef pencereyi (ilk ve son saat) ayarlar. Takvim sadece bu pencere için,
+    güneş verisi de pencerenin son gününün sonuna kadar hesaplanır.
+    """
+    min_date = pd.to_datetime(start_date)
+    max_date = pd.to_datetime(end_date)
+    config["window"] = {
+        "start_date": min_date.strftime("%Y-%m-%d %H:%M:%S"),
+        "end_date": max_date.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    config["calendar"] = dict(config["window"])
+    config["solar"]["end_date"] = (
+        max_date.normalize() + pd.Timedelta(days=1)
+    ).strftime("%Y-%m-%d")
+    return config
+
+
+def solar_end_date(config: dict) -> str:
+    """
+    Solar end_date, start_date'e 10 yıl eklenerek hesaplanır.
+    """
+    solar_start = datetime.strptime(config["solar"]["start_date"], "%Y-%m-%d")
+    return solar_start.replace(year=solar_start.year + 10).strftime("%Y-%m-%d")
+
+
 def data_prepare_config(config_path: str, data_df: pd.DataFrame = None) -> dict:
     with open(config_path, "r", encoding="utf-8") as f:
         config = json.load(f)
 
+    # Çalışma zamanı; kayıttan okunurken kaydın zamanı (bkz. Transport.now)
+    now = transport.now()
+
     # EPİAŞ end_date dinamik olarak bugünün bir gün öncesi yapılır
-    today = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%dT00:00:00+03:00")
+    today = (now - timedelta(days=1)).strftime("%Y-%m-%dT00:00:00+03:00")
     if config["epias"]["end_date"] is None:
         config["epias"]["end_date"] = today
 
@@ -27,29 +57,30 @@ def data_prepare_config(config_path: str, data_df: pd.DataFrame = None) -> dict:
     config["epias"]["username"] = epias_username
     config["epias"]["password"] = epias_password
 
-    # Solar end_date, start_date'e 10 yıl eklenerek hesaplanır
-    solar_start = datetime.strptime(config["solar"]["start_date"], "%Y-%m-%d")
-    solar_end = (solar_start.replace(year=solar_start.year + 10)).strftime("%Y-%m-%d")
-    config["solar"]["end_date"] = solar_end
+    config["solar"]["end_date"] = solar_end_date(config)
 
-    # Calendar tarihleri eğer veri seti verildiyse onun üzerinden hesaplanır
+    # Veri seti verildiyse hedef pencere tüketim aralığı + tahmin ufkudur
+    # (DataLoader 48 saati zaten ekler).
     if data_df is not None and "date" in data_df.columns:
-        min_date = pd.to_datetime(data_df["date"].min())
-        max_date = min_date + pd.DateOffset(years=10)
-        config["calendar"] = {
-            "start_date": min_date.strftime("%Y-%m-%d %H:%M:%S"),
-            "end_date": max_date.strftime("%Y-%m-%d %H:%M:%S"),
-        }
+        set_window(config, data_df["date"].min(), data_df["date"].max())
 
     # Eğer h_end_date boşsa bugünden 5 gün öncesi olarak ayarla
     if config["historical_weather"]["h_end_date"] is None:
-        h_end = datetime.now() - timedelta(days=5)
+        h_end = now - timedelta(days=5)
         config["historical_weather"]["h_end_date"] = h_end.strftime("%Y-%m-%d")
 
     # Forecast weather tarihleri her gün dinamik olarak ayarlanır
-    config["forecast_weather"]["f_start_date"] = datetime.today().strftime("%Y-%m-%d")
-    config["forecast_weather"]["f_end_date"] = (
-        datetime.today() + timedelta(days=6)
-    ).strftime("%Y-%m-%d")
+    config["forecast_weather"]["f_start_date"] = now.strftime("%Y-%m-%d")
+    config["forecast_weather"]["f_end_date"] = (now + timedelta(days=6)).strftime(
+        "%Y-%m-%d"
+    )
+
+    # Open-Meteo tahminin hangi model çalışmasından geldiğini bildirmez;
+    # issue_hours saatlik dilimin başı tahminin yayın zamanı kabul edilir
+    issue_hours = config["forecast_weather"]["issue_hours"]
+    issue = now.replace(
+        hour=now.hour - now.hour % issue_hours, minute=0, second=0, microsecond=0
+    )
+    config["forecast_weather"]["issue"] = issue.strftime("%Y-%m-%dT%H")
 
     return config
@@ -1,16 +1,43 @@
 import pandas as pd
-from functools import reduce
 from src.historical_weather_data import HistoricalWeatherDataProcessor
 from src.forecast_weather_data import ForecastWeatherDataProcessor
+from utils.hour_key import HOUR_KEY, from_hour_key, align_on_hour_key
 import time
 import os
 
 
 class DataPrepareFunctions:
-    def __init__(self):
+    def __init__(self, compact=False):
+        """
+        Args:
+            compact (bool): Memory-lean mode; processor outputs are kept
+                compact (see ``compact_frame``), the main data is assembled
+                as float32 in one allocation and saved as float32.
+        """
         self.current_time = time.strftime("%Y_%m_%d %H_%M_%S", time.localtime())
         self.current_day = time.strftime("%Y_%m_%d", time.localtime())
-        pass
+        self.compact = compact
+        self.float_dtype = "float32" if compact else "float"
+
+    def compact_frame(self, df):
+        """
+        In compact mode return ``df`` with float32 floats, the smallest
+        integer type for integers (except ``hour_key``) and categories for
+        object columns; otherwise return it unchanged.
+        """
+        if not self.compact:
+            return df
+        dtypes = {}
+        for column, dtype in df.dtypes.items():
+            if column == HOUR_KEY:
+                continue
+            if pd.api.types.is_float_dtype(dtype):
+                dtypes[column] = "float32"
+            elif pd.api.types.is_integer_dtype(dtype):
+                dtypes[column] = pd.to_numeric(df[column], downcast="integer").dtype
+            elif pd.api.types.is_object_dtype(dtype):
+                dtypes[column] = "category"
+        return df.astype(dtypes)
 
     def prepare_weather_data(self, historical_weather_df, forecast_weather_df):
         weather_df = pd.concat(
@@ -18,10 +45,8 @@ class DataPrepareFunctions:
         )
         return weather_df.reset_index(drop=True)
 
-    def main_data_prepare(
+    def exogenous_data_prepare(
         self,
-        data,
-        consumption,
         epias_df,
         solar_df,
         calendar_df,
@@ -29,28 +54,30 @@ class DataPrepareFunctions:
         weighted_weather_df,
     ):
         dataframes = [
-            data,
-            consumption,
             epias_df,
             solar_df,
             calendar_df,
             weather_df,
             weighted_weather_df,
         ]
-        # Tüm dataframe'lerdeki 'date' sütunlarının timezone'unu kaldır
-        for i in range(len(dataframes)):
-            if pd.api.types.is_datetime64tz_dtype(dataframes[i]["date"]):
-                dataframes[i]["date"] = dataframes[i]["date"].dt.tz_localize(None)
-        df = reduce(
-            lambda left, right: pd.merge(left, right, on="date", how="inner"),
-            dataframes,
-        )
-        df["date"] = df["date"].dt.strftime("%Y-%m-%d %H:%M")
-        df = df.set_index("date")
+        # Tüketimden bağımsız (dışsal) değişkenler saat anahtarıyla hizalanır
+        return align_on_hour_key(dataframes, float_dtype=self._block_dtype())
+
+    def _block_dtype(self):
+        # Kompakt modda sayısal sütunlar tek bir float32 blokta toplanır
+        return self.float_dtype if self.compact else None
+
+    def main_data_prepare(self, data, consumption, exogenous_df):
+        dataframes = [data, consumption, exogenous_df]
+        # Tüm dataframe'ler saat anahtarı (hour_key) üzerinden hizalanır
+        df = align_on_hour_key(dataframes, float_dtype=self._block_dtype())
+        df.index = from_hour_key(df.pop(HOUR_KEY)).rename("date")
 
         return df
 
-    def process_save_main_data(self, df, historical_df_path, forecast_df_path):
+    def process_save_main_data(
+        self, df, historical_df_path, forecast_df_path, suffix=""
+    ):
         day_folder = os.path.join(historical_df_path, self.current_day)
 
         # Create directories if they do not exist
@@ -62,84 +89,122 @@ class DataPrepareFunctions:
         os.makedirs(historical_df_path, exist_ok=True)
         os.makedirs(forecast_df_path, exist_ok=True)
 
-        cat_cols = df.select_dtypes(exclude="number").columns
-        num_cols = df.select_dtypes(include="number").columns
+        # Sadece tipi değişecek sütunlar dönüştürülür
+        cat_cols = [
+            col
+            for col in df.select_dtypes(exclude="number").columns
+            if not isinstance(df[col].dtype, pd.CategoricalDtype)
+        ]
+        num_cols = [
+            col
+            for col in df.select_dtypes(include="number").columns
+            if df[col].dtype != self.float_dtype
+        ]
 
         df[cat_cols] = df[cat_cols].astype("category")
-        df[num_cols] = df[num_cols].astype("float")
+        df[num_cols] = df[num_cols].astype(self.float_dtype)
 
         bool_cols = df.columns[df.nunique() == 2]
         df[bool_cols] = df[bool_cols].apply(lambda x: x.astype(bool))
 
-        historical_df = df.iloc[:-48, :].copy()
+        historical_df = df.iloc[:-48, :]
         historical_df.to_parquet(
-            historical_df_path + "/Historical_Data_" + self.current_time + ".parquet"
+            historical_df_path
+            + "/Historical_Data_"
+            + self.current_time
+            + suffix
+            + ".parquet"
         )
-        forecast_df = df.iloc[-48:, :].copy()
+        forecast_df = df.iloc[-48:, :]
         forecast_df.to_parquet(
-            forecast_df_path + "/Forecast_Data_" + self.current_time + ".parquet"
+            forecast_df_path
+            + "/Forecast_Data_"
+            + self.current_time
+            + suffix
+            + ".parquet"
         )
         forecast_df_result_path = (
-            forecast_df_path + "/Forecast_Data_" + self.current_time + ".parquet"
+            forecast_df_path
+            + "/Forecast_Data_"
+            + self.current_time
+            + suffix
+            + ".parquet"
         )
         return df, forecast_df_result_path
 
-    def generate_multi_location_weather_data(self, config):
-        weather_dfs = []
-
-        for location_name, coords in config["locations"].items():
-            # --- Historical ---
-            h_weather_cfg = config["historical_weather"]
-            historical_data_processor = HistoricalWeatherDataProcessor(
-                lat=coords["lat"],
-                lon=coords["long"],
-                start_date=h_weather_cfg["h_start_date"],
-                end_date=h_weather_cfg["h_end_date"],
-                timezone=h_weather_cfg["timezone"],
-            )
-            historical_df = historical_data_processor.fetch()
-
-            # --- Forecast ---
-            f_weather_cfg = config["forecast_weather"]
-            forecast_data_processor = ForecastWeatherDataProcessor(
-                lat=coords["lat"],
-                lon=coords["long"],
-                start_date=f_weather_cfg["f_start_date"],
-                end_date=f_weather_cfg["f_end_date"],
-                timezone=f_weather_cfg["timezone"],
-            )
-            forecast_df = forecast_data_processor.fetch()
+    def generate_multi_location_weather_data(self, config, archive=None):
+        window_start = config.get("window", {}).get("start_date")
+        location_names = list(config["locations"])
+        lats = [config["locations"][name]["lat"] for name in location_names]
+        lons = [config["locations"][name]["long"] for name in location_names]
+
+        # --- Historical: all locations in one request ---
+        h_weather_cfg = config["historical_weather"]
+        historical_data_processor = HistoricalWeatherDataProcessor(
+            lat=lats,
+            lon=lons,
+            start_date=h_weather_cfg["h_start_date"],
+            end_date=h_weather_cfg["h_end_date"],
+            timezone=h_weather_cfg["timezone"],
+            archive=archive,
+            window_start=window_start,
+        )
+        historical_dfs = historical_data_processor.fetch_all()
+
+        # --- Forecast: all locations in one request ---
+        f_weather_cfg = config["forecast_weather"]
+        forecast_data_processor = ForecastWeatherDataProcessor(
+            lat=lats,
+            lon=lons,
+            start_date=f_weather_cfg["f_start_date"],
+            end_date=f_weather_cfg["f_end_date"],
+            timezone=f_weather_cfg["timezone"],
+            window_start=window_start,
+        )
+        forecast_dfs = forecast_data_processor.fetch_all()
 
+        weather_dfs = []
+        for location_name, historical_df, forecast_df in zip(
+            location_names, historical_dfs, forecast_dfs
+        ):
             # --- Merge both & rename ---
             merged_weather = self.prepare_weather_data(historical_df, forecast_df)
 
             renamed_weather = merged_weather.rename(
                 columns={
-                    col: f"{col}_{location_name}" if col != "date" else col
+                    col: f"{col}_{location_name}"
+                    if col not in ("date", HOUR_KEY)
+                    else col
                     for col in merged_weather.columns
                 }
             )
 
             weather_dfs.append(renamed_weather)
 
-        # --- Merge all on 'date'
-        weather_df_final = weather_dfs[0]
-        for df in weather_dfs[1:]:
-            weather_df_final = pd.merge(weather_df_final, df, on="date", how="outer")
+        # --- Align all on 'hour_key'
+        weather_df_final = align_on_hour_key(weather_dfs, how="outer")
+        weather_df_final.insert(
+            0,
+            "date",
+            from_hour_key(
+                weather_df_final[HOUR_KEY], h_weather_cfg["timezone"], naive=False
+            ),
+        )
 
-        return weather_df_final.reset_index(drop=True)
+        return weather_df_final
 
     def weighted_average_weather_data(self, weather_df, location_weights):
         weather_df = weather_df.copy()
 
         # Ortak zaman indeksini al (zaten tüm lokasyonlarda ortak)
-        base_df = pd.DataFrame({"date": weather_df["date"]})
+        base_df = weather_df[["date", HOUR_KEY]].copy()
 
         # Sadece sayısal sütunlar
         numeric_cols = [
             col
             for col in weather_df.columns
-            if col != "date" and pd.api.types.is_numeric_dtype(weather_df[col])
+            if col not in ("date", HOUR_KEY)
+            and pd.api.types.is_numeric_dtype(weather_df[col])
         ]
 
         # Her bir ölçüm (örneğin temperature_2m) için
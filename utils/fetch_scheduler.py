@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import fcntl
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: ``rate`` tokens per second, at most ``capacity``.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedTokenBucket:
+    """
+    Token bucket shared by every process on the host: ``rate`` tokens per
+    second, at most ``capacity``, per ``key`` (e.g. the EPİAŞ account).
+
+    The state (tokens and the time they were counted, per key) is kept in
+    ``path`` and read and updated under an ``flock``, so the gunicorn
+    workers and their job threads together stay within one rate limit.
+    """
+
+    def __init__(self, path: str, rate: float, capacity: float, key: str = ""):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self.key = key
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _take(self):
+        """
+        Take a token if one is available; return the seconds to wait
+        otherwise (0 when it was taken).
+        """
+        with open(self.path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                now = time.time()
+                bucket = state.get(self.key, {"tokens": self.capacity, "at": now})
+                elapsed = max(now - bucket["at"], 0.0)
+                tokens = min(self.capacity, bucket["tokens"] + elapsed * self.rate)
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / self.rate
+                state[self.key] = {"tokens": tokens, "at": now}
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def acquire(self):
+        """
+        Block until a token is available and take it.
+        """
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+
+class FetchScheduler:
+    """
+    Runs HTTP requests concurrently under a shared token-bucket rate limit.
+
+    Every attempt takes a token. With ``bucket_path`` the bucket is a
+    ``SharedTokenBucket`` (per ``bucket_key``), so the limit holds for all
+    schedulers on the host; otherwise it is the scheduler's own. Responses with a retryable status (429 and
+    5xx) and connection errors are retried, honouring ``Retry-After`` when
+    the server sends it and backing off exponentially otherwise. Without
+    ``throttle`` (e.g. for replayed responses) nothing waits: no rate limit
+    and no delay between retries.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        rate_per_second: float = 2.0,
+        burst: int = 4,
+        max_workers: int = 4,
+        max_retries: int = 5,
+        backoff_factor: float = 2.0,
+        throttle: bool = True,
+        bucket_path: str = None,
+        bucket_key: str = "",
+    ):
+        if bucket_path is None:
+            self.bucket = TokenBucket(rate_per_second, burst)
+        else:
+            self.bucket = SharedTokenBucket(
+                bucket_path, rate_per_second, burst, key=bucket_key
+            )
+        self.throttle = throttle
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+    def _retry_delay(self, response, attempt):
+        retry_after = None if response is None else response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return max(float(retry_after), 0.0)
+            except ValueError:
+                pass
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+            except (TypeError, ValueError):
+                # Malformed (or zone-less) date: back off as without it
+                pass
+        return self.backoff_factor * (2**attempt)
+
+    def _wait(self, response, attempt):
+        if self.throttle:
+            time.sleep(self._retry_delay(response, attempt))
+
+    def request(self, send):
+        """
+        Call ``send()`` (which performs one HTTP request) with rate limiting
+        and retries.
+
+        Returns:
+            requests.Response: First successful response
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.throttle:
+                self.bucket.acquire()
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self._wait(None, attempt)
+                continue
+
+            if (
+                response.status_code not in self.RETRY_STATUSES
+                or attempt == self.max_retries
+            ):
+                response.raise_for_status()
+                return response
+            self._wait(response, attempt)
+
+    def map(self, sends):
+        """
+        Run every callable in ``sends`` through ``request`` concurrently.
+
+        Returns:
+            list: Responses in the order of ``sends``
+        """
+        if not sends:
+            return []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.request, sends))
@@ -0,0 +1,133 @@
+from functools import reduce
+import numpy as np
+import pandas as pd
+
+HOUR_KEY = "hour_key"
+TIMEZONE = "Europe/Istanbul"
+
+_NS_PER_HOUR = 3_600 * 10**9
+
+
+def to_hour_key(dates, timezone=TIMEZONE) -> np.ndarray:
+    """
+    Convert dates to the canonical hourly join key.
+
+    The key is the number of whole hours since the Unix epoch (UTC), so it
+    is the same for a time zone aware timestamp and its local wall time.
+    Naive dates are read as wall times in ``timezone`` (DST aware).
+
+    Args:
+        dates: Datetimes, date strings or a datetime column
+        timezone (str): Time zone of naive dates
+
+    Returns:
+        np.ndarray: int64 hour keys
+    """
+    dates = pd.DatetimeIndex(dates)
+    if dates.tz is None:
+        dates = dates.tz_localize(
+            timezone, ambiguous=False, nonexistent="shift_forward"
+        )
+    return dates.as_unit("ns").asi8 // _NS_PER_HOUR
+
+
+def from_hour_key(keys, timezone=TIMEZONE, naive=True) -> pd.DatetimeIndex:
+    """
+    Convert hour keys back to local datetimes.
+
+    Args:
+        keys: int64 hour keys
+        timezone (str): Time zone of the returned dates
+        naive (bool): Drop the time zone and return local wall times
+
+    Returns:
+        pd.DatetimeIndex: One date per key
+    """
+    dates = pd.to_datetime(
+        np.asarray(keys, dtype="int64") * _NS_PER_HOUR, utc=True
+    ).tz_convert(timezone)
+    return dates.tz_localize(None) if naive else dates
+
+
+def align_on_hour_key(frames, how="inner", float_dtype=None) -> pd.DataFrame:
+    """
+    Join frames side by side on their ``hour_key`` column.
+
+    The keys of the result are computed once with sorted set operations and
+    every frame is gathered by position (``take``) into it, so no hash join
+    is needed. ``date`` columns are dropped; the caller rebuilds the dates
+    it needs from the key. A key repeated in a frame uses its first row.
+
+    Args:
+        frames (list): Frames with an ``hour_key`` column
+        how (str): ``"inner"`` for the keys every frame has, ``"outer"`` for
+            the keys any frame has (missing rows are empty)
+        float_dtype (str, optional): When given, every numeric (not bool)
+            column is gathered as this float type straight into one block
+            allocated for the result, and the columns of the result are
+            views of that block. Without it the dtypes are kept.
+
+    Returns:
+        pd.DataFrame: ``hour_key`` in ascending order followed by the other
+        columns of every frame in order
+    """
+    keys = [frame[HOUR_KEY].to_numpy(dtype="int64") for frame in frames]
+    combine = np.intersect1d if how == "inner" else np.union1d
+    common = reduce(combine, keys)
+
+    gathered = []
+    for frame, frame_keys in zip(frames, keys):
+        values = frame.drop(columns=[HOUR_KEY, "date"], errors="ignore")
+        order = np.argsort(frame_keys, kind="stable")
+        sorted_keys = frame_keys[order]
+        index = np.searchsorted(sorted_keys, common)
+        found = index < len(sorted_keys)
+        found[found] = sorted_keys[index[found]] == common[found]
+        gathered.append((values, order[np.where(found, index, 0)], found))
+
+    if float_dtype is not None:
+        return _gather_into_block(common, gathered, np.dtype(float_dtype))
+
+    parts = [pd.DataFrame({HOUR_KEY: common})]
+    for values, positions, found in gathered:
+        part = values.take(positions).reset_index(drop=True)
+        if not found.all():
+            part = part.where(np.broadcast_to(found[:, None], part.shape))
+        parts.append(part)
+
+    return pd.concat(parts, axis=1)
+
+
+def _is_block_column(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(
+        series
+    )
+
+
+def _gather_into_block(common, gathered, float_dtype):
+    block_size = sum(
+        _is_block_column(values[column])
+        for values, _, _ in gathered
+        for column in values.columns
+    )
+    block = np.empty((block_size, len(common)), dtype=float_dtype)
+
+    columns = {HOUR_KEY: common}
+    row = 0
+    for values, positions, found in gathered:
+        missing = ~found
+        for column in values.columns:
+            series = values[column]
+            if _is_block_column(series):
+                target = block[row]
+                row += 1
+                target[:] = series.to_numpy()[positions]
+                target[missing] = np.nan
+            else:
+                target = series.take(positions).reset_index(drop=True)
+                if missing.any():
+                    target = target.where(found)
+            columns[column] = target
+
+    # Without a copy every block column stays a view of ``block``
+    return pd.DataFrame(columns, copy=False)
@@ -0,0 +1,204 @@
+import os
+import re
+import json
+import glob
+import uuid
+import threading
+import traceback
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class JobQueue:
+    """
+    Local background job queue for long running forecast requests.
+
+    Jobs run on a small thread pool inside the web process while their state
+    is persisted as one JSON file per job under ``job_dir``. Because the state
+    lives on disk, any gunicorn worker on the host can answer a status query
+    for a job that was submitted to another worker.
+
+    Finished jobs are kept for ``max_age`` seconds, then their JSON file and
+    the files listed in their ``files`` field (uploaded inputs, the output)
+    are deleted.
+    """
+
+    def __init__(self, job_dir: str, max_workers: int = 1, max_age: float = None):
+        self.job_dir = job_dir
+        self.max_age = max_age
+        os.makedirs(self.job_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="forecast-job"
+        )
+        self._lock = threading.Lock()
+
+    def _now(self):
+        return datetime.now().isoformat(timespec="seconds")
+
+    def _job_path(self, job_id):
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def _write(self, job):
+        # Write to a temp file first so readers never see a half written job
+        path = self._job_path(job["id"])
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _read(self, job_id):
+        try:
+            with open(self._job_path(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._read(job_id)
+            if job is None:
+                # Evicted meanwhile
+                return None
+            job.update(fields)
+            self._write(job)
+            return job
+
+    def submit(self, fn, stages, **meta) -> str:
+        """
+        Queue ``fn`` for background execution and return the new job id.
+
+        Args:
+            fn (callable): Job body, called as ``fn(progress)`` where
+                ``progress(stage_name)`` marks the start of a pipeline stage.
+                Its return value must be JSON serializable and is stored as
+                the job result.
+            stages (list): Ordered stage names used to report progress
+            **meta: Extra JSON serializable fields stored with the job; a
+                ``files`` list names the files deleted with the job
+
+        Returns:
+            str: Job id
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "state": "queued",
+            "pid": os.getpid(),
+            "created_at": self._now(),
+            "started_at": None,
+            "finished_at": None,
+            "stages": [{"name": name, "state": "pending"} for name in stages],
+            "result": None,
+            "error": None,
+        }
+        job.update(meta)
+        with self._lock:
+            self._write(job)
+        self.executor.submit(self._run, job_id, fn)
+        self.evict()
+        return job_id
+
+    def _run(self, job_id, fn):
+        self._update(job_id, state="running", started_at=self._now())
+        try:
+            result = fn(lambda stage: self.set_stage(job_id, stage))
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                job = self._read(job_id)
+                for stage in job["stages"]:
+                    if stage["state"] == "running":
+                        stage["state"] = "failed"
+                        stage["finished_at"] = self._now()
+                job.update(state="failed", error=str(e), finished_at=self._now())
+                self._write(job)
+            return
+
+        with self._lock:
+            job = self._read(job_id)
+            for stage in job["stages"]:
+                if stage["state"] == "running":
+                    stage["finished_at"] = self._now()
+                stage["state"] = "done"
+            job.update(state="done", result=result, finished_at=self._now())
+            self._write(job)
+
+    def set_stage(self, job_id, stage_name):
+        """
+        Mark ``stage_name`` as running and every earlier running stage as done.
+        """
+        with self._lock:
+            job = self._read(job_id)
+            now = self._now()
+            stages = job["stages"]
+            for stage in stages:
+                if stage["state"] == "running":
+                    stage["state"] = "done"
+                    stage["finished_at"] = now
+            names = [stage["name"] for stage in stages]
+            if stage_name not in names:
+                stages.append({"name": stage_name, "state": "pending"})
+                names.append(stage_name)
+            current = stages[names.index(stage_name)]
+            current.update(state="running", started_at=now)
+            self._write(job)
+
+    def get(self, job_id):
+        """
+        Return the stored state of a job, or None for unknown ids.
+
+        Jobs whose owning worker process is gone (restart, crash) are
+        reported as failed instead of staying queued forever.
+        """
+        if not JOB_ID_PATTERN.match(job_id or ""):
+            return None
+        job = self._read(job_id)
+        if job is None or job["state"] not in ("queued", "running"):
+            return job
+        if not self._pid_alive(job["pid"]):
+            job = self._update(
+                job_id,
+                state="failed",
+                error="İşi çalıştıran süreç sonlandı",
+                finished_at=self._now(),
+            )
+        return job
+
+    def _pid_alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def evict(self):
+        """
+        Delete the jobs that finished more than ``max_age`` seconds ago,
+        together with their files. Jobs left queued or running by a process
+        that is gone count from their creation.
+        """
+        if self.max_age is None:
+            return
+        expires = datetime.now() - timedelta(seconds=self.max_age)
+        for path in glob.glob(os.path.join(self.job_dir, "*.json")):
+            job_id = os.path.basename(path)[: -len(".json")]
+            job = self._read(job_id)
+            if job is None:
+                continue
+            if job["state"] in ("queued", "running"):
+                if self._pid_alive(job["pid"]):
+                    continue
+                finished_at = job["created_at"]
+            else:
+                finished_at = job["finished_at"]
+            if datetime.fromisoformat(finished_at) > expires:
+                continue
+            for file_path in job.get("files", []) + [path]:
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
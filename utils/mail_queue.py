@@ -0,0 +1,346 @@
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import glob
+import smtplib
+import threading
+import traceback
+from datetime import datetime
+from email import policy
+from email.parser import BytesParser
+from utils.metrics import metrics
+
+MESSAGE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class MailQueue:
+    """
+    Persistent outbound mail queue.
+
+    ``enqueue`` only writes the message to ``spool_dir`` (``<id>.eml`` and
+    its delivery state ``<id>.json``) and returns, so a slow or failing mail
+    server never holds up a forecast. A delivery thread per process sends
+    the due messages over one authenticated SMTP connection that is reused
+    between messages and closed after ``idle_timeout`` seconds without
+    mail. A failed attempt is retried with exponential backoff up to
+    ``max_attempts``; a permanent refusal (5xx) fails the message at once.
+
+    Like the job queue the state lives on disk: every gunicorn worker can
+    report the status of any message and deliver the messages of a worker
+    that died. A message is locked (``flock``) while it is being sent so
+    that only one process sends it. Sent messages are moved to
+    ``sent_dir``. The state of a finished (sent or failed) message is moved
+    to ``<spool_dir>/done``, together with the content of a failed one, so
+    the spool only holds the messages still to be delivered.
+    """
+
+    def __init__(
+        self,
+        spool_dir: str,
+        sent_dir: str,
+        server: str,
+        port: int = 587,
+        username: str = None,
+        password: str = None,
+        timeout: float = 30,
+        max_attempts: int = 6,
+        backoff_factor: float = 30,
+        max_backoff: float = 1800,
+        idle_timeout: float = 60,
+        poll_interval: float = 30,
+    ):
+        """
+        Args:
+            spool_dir (str): Directory of the queued messages and their state
+            sent_dir (str): Directory the sent messages are moved to
+            server (str): SMTP server
+            port (int): SMTP port (STARTTLS)
+            username (str, optional): SMTP user; no login without it
+            password (str, optional): SMTP password
+            timeout (float): Socket timeout of the SMTP connection in seconds
+            max_attempts (int): Delivery attempts before a message fails
+            backoff_factor (float): Seconds before the first retry, doubled
+                for every further attempt
+            max_backoff (float): Longest wait between two attempts
+            idle_timeout (float): Seconds an unused connection is kept open
+            poll_interval (float): Seconds between two looks at the spool for
+                messages queued by other processes or waiting for a retry
+        """
+        self.spool_dir = spool_dir
+        self.sent_dir = sent_dir
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.done_dir = os.path.join(self.spool_dir, "done")
+        os.makedirs(self.done_dir, exist_ok=True)
+        os.makedirs(self.sent_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._smtp = None
+        self._smtp_used_at = 0.0
+
+    @property
+    def endpoint(self):
+        return "smtp://{}:{}".format(self.server, self.port)
+
+    def _now(self):
+        return datetime.now().isoformat(timespec="seconds")
+
+    def _path(self, message_id, extension, directory=None):
+        return os.path.join(directory or self.spool_dir, f"{message_id}.{extension}")
+
+    def _write_state(self, state, directory=None):
+        path = self._path(state["id"], "json", directory)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _read_state(self, message_id, directory=None):
+        try:
+            with open(
+                self._path(message_id, "json", directory), "r", encoding="utf-8"
+            ) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _finish(self, state):
+        # The done state is written before the queued one is removed, so the
+        # status of the message can always be read from one of them
+        self._write_state(state, self.done_dir)
+        try:
+            os.remove(self._path(state["id"], "json"))
+        except FileNotFoundError:
+            pass
+
+    def enqueue(self, message, name=None) -> str:
+        """
+        Queue an ``EmailMessage`` for delivery and return its id.
+
+        Args:
+            message (EmailMessage): Complete message (From, To, body,
+                attachments)
+            name (str, optional): File name of the sent copy in ``sent_dir``
+                (without extension), the message id by default
+        """
+        message_id = uuid.uuid4().hex
+        eml_path = self._path(message_id, "eml")
+        tmp_path = f"{eml_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(message.as_bytes())
+        os.replace(tmp_path, eml_path)
+
+        # The state is written last, the delivery thread never sees a
+        # message without its content
+        self._write_state(
+            {
+                "id": message_id,
+                "name": name or message_id,
+                "to": message["To"],
+                "subject": message["Subject"],
+                "state": "queued",
+                "attempts": 0,
+                "created_at": self._now(),
+                "next_attempt_at": time.time(),
+                "sent_at": None,
+                "error": None,
+            }
+        )
+        metrics.inc("mail_messages_total", {"state": "queued"})
+        self.start()
+        self._wake.set()
+        return message_id
+
+    def status(self, message_id):
+        """
+        Return the delivery state of a message (``queued``, ``sent`` or
+        ``failed`` with the attempts and the last error), or None.
+        """
+        if not MESSAGE_ID_PATTERN.match(message_id or ""):
+            return None
+        state = self._read_state(message_id) or self._read_state(
+            message_id, self.done_dir
+        )
+        if state is None:
+            return None
+        return {
+            key: state[key]
+            for key in ("state", "attempts", "created_at", "sent_at", "error")
+        }
+
+    def start(self):
+        """
+        Start the delivery thread of this process if it is not running.
+
+        Safe to call often; a process forked from one with a running thread
+        starts its own.
+        """
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._smtp = None
+            self._thread = threading.Thread(
+                target=self._deliver_forever, name="mail-queue", daemon=True
+            )
+            self._thread.start()
+
+    def _deliver_forever(self):
+        while True:
+            try:
+                next_due = self.deliver_due()
+            except Exception:
+                traceback.print_exc()
+                next_due = None
+
+            wait = self.poll_interval
+            if next_due is not None:
+                wait = min(wait, max(next_due - time.time(), 0.0))
+            if self._smtp is not None:
+                idle_left = self._smtp_used_at + self.idle_timeout - time.time()
+                if idle_left <= 0:
+                    self._close()
+                else:
+                    wait = min(wait, idle_left)
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def deliver_due(self):
+        """
+        Send every queued message whose next attempt is due.
+
+        Returns:
+            float: Time of the earliest later attempt, or None
+        """
+        next_due = None
+        states = [
+            self._read_state(os.path.basename(path)[: -len(".json")])
+            for path in glob.glob(os.path.join(self.spool_dir, "*.json"))
+        ]
+        queued = []
+        for state in states:
+            if state is None:
+                continue
+            if state["state"] == "queued":
+                queued.append(state)
+            else:
+                # Finished before the done directory existed
+                self._finish(state)
+        queued.sort(key=lambda state: state["next_attempt_at"])
+        for state in queued:
+            if state["next_attempt_at"] > time.time():
+                if next_due is None:
+                    next_due = state["next_attempt_at"]
+                continue
+            self._deliver_locked(state["id"])
+        return next_due
+
+    def _deliver_locked(self, message_id):
+        lock_path = self._path(message_id, "lock")
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is sending it
+                return
+            try:
+                # Re-read under the lock, it may have been sent meanwhile
+                state = self._read_state(message_id)
+                if state is not None and state["state"] == "queued":
+                    self._deliver(state)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        state = self._read_state(message_id)
+        if state is None or state["state"] != "queued":
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+
+    def _deliver(self, state):
+        eml_path = self._path(state["id"], "eml")
+        with open(eml_path, "rb") as f:
+            data = f.read()
+        message = BytesParser(policy=policy.default).parsebytes(data)
+
+        state["attempts"] += 1
+        started_at = time.perf_counter()
+        try:
+            self._send(message)
+        except Exception as e:
+            permanent = (
+                isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500
+            ) or isinstance(e, smtplib.SMTPRecipientsRefused)
+            state["error"] = "{}: {}".format(type(e).__name__, e)
+            if permanent or state["attempts"] >= self.max_attempts:
+                state["state"] = "failed"
+                metrics.inc("mail_messages_total", {"state": "failed"})
+                os.replace(eml_path, self._path(state["id"], "eml", self.done_dir))
+            else:
+                delay = min(
+                    self.backoff_factor * 2 ** (state["attempts"] - 1),
+                    self.max_backoff,
+                )
+                state["next_attempt_at"] = time.time() + delay
+                metrics.inc("mail_messages_total", {"state": "retried"})
+            print(
+                "E-posta gönderilemedi ({}, deneme {}): {}".format(
+                    state["to"], state["attempts"], state["error"]
+                )
+            )
+            if state["state"] == "failed":
+                self._finish(state)
+            else:
+                self._write_state(state)
+            return
+
+        metrics.record_http(self.endpoint, time.perf_counter() - started_at, len(data))
+        metrics.inc("mail_messages_total", {"state": "sent"})
+        os.replace(eml_path, os.path.join(self.sent_dir, f"{state['name']}.eml"))
+        state.update(state="sent", sent_at=self._now(), error=None)
+        self._finish(state)
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def _send(self, message):
+        """
+        Send over the kept connection; a connection the server closed while
+        idle is replaced once.
+        """
+        for reconnect in (False, True):
+            if self._smtp is None:
+                self._smtp = self._connect()
+            try:
+                self._smtp.send_message(message)
+                self._smtp_used_at = time.time()
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if reconnect:
+                    raise
+
+    def _close(self):
+        smtp, self._smtp = self._smtp, None
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
@@ -0,0 +1,391 @@
+import os
+import json
+import glob
+import time
+import resource
+import threading
+from urllib.parse import urlsplit
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+HTTP_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HELP = {
+    "forecast_runs_total": ("counter", "Finished forecast runs"),
+    "forecast_stage_duration_seconds": ("histogram", "Wall time of a stage"),
+    "forecast_stage_cpu_seconds_total": ("counter", "Process CPU time of a stage"),
+    "forecast_stage_peak_rss_bytes": ("gauge", "Highest RSS seen during a stage"),
+    "external_requests_total": ("counter", "HTTP calls to external services"),
+    "external_response_bytes_total": ("counter", "Response bytes from external calls"),
+    "external_request_duration_seconds": (
+        "histogram",
+        "Latency of external calls that were not served from the cache",
+    ),
+    "mail_messages_total": ("counter", "Outbound mail queue events by state"),
+    "result_cache_total": ("counter", "Forecast result cache lookups by result"),
+}
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Without /proc only the peak of the whole process is known (KiB)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _endpoint(url):
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters, max gauges and histograms of the forecast runs.
+
+    Values are kept in memory; with ``share`` every process also writes
+    them to ``<directory>/<pid>.json`` after each run, and ``render`` sums
+    the files of all processes, so any gunicorn worker can answer a
+    ``/metrics`` scrape for the whole host (the same way the job queue
+    shares job state).
+    """
+
+    def __init__(self):
+        self.directory = None
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._recorders = set()
+
+    def share(self, directory: str):
+        """
+        Share the metrics of this process through snapshot files.
+
+        Files of processes that are no longer running are removed.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            pid = int(os.path.basename(path)[: -len(".json")])
+            if pid != os.getpid() and not _pid_alive(pid):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def inc(self, name, labels, value=1.0):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set_max(self, name, labels, value):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._gauges[key] = max(self._gauges.get(key, value), value)
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = {
+                    "buckets": list(buckets),
+                    "counts": [0] * len(buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+                self._histograms[key] = histogram
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def record_stage(self, stage, wall_seconds, cpu_seconds, peak_rss_bytes):
+        labels = {"stage": stage}
+        self.observe(
+            "forecast_stage_duration_seconds", labels, wall_seconds, STAGE_BUCKETS
+        )
+        self.inc("forecast_stage_cpu_seconds_total", labels, cpu_seconds)
+        self.set_max("forecast_stage_peak_rss_bytes", labels, peak_rss_bytes)
+
+    def record_http(self, endpoint, seconds, nbytes, from_cache=False):
+        """
+        Record one call to an external service.
+
+        Args:
+            endpoint (str): Host and path (or another stable service name)
+            seconds (float): Latency; ignored for cache hits
+            nbytes (int): Response size
+            from_cache (bool): Served from the local HTTP cache
+        """
+        labels = {"endpoint": endpoint, "cache": "hit" if from_cache else "miss"}
+        self.inc("external_requests_total", labels)
+        self.inc("external_response_bytes_total", labels, nbytes)
+        if not from_cache:
+            self.observe(
+                "external_request_duration_seconds",
+                {"endpoint": endpoint},
+                seconds,
+                HTTP_BUCKETS,
+            )
+        with self._lock:
+            recorders = list(self._recorders)
+        for recorder in recorders:
+            recorder.add_http(endpoint, seconds, nbytes, from_cache)
+
+    def _response_hook(self, response, *args, **kwargs):
+        # requests_cache dispatches the hooks of a fresh response twice
+        if getattr(response, "_metrics_recorded", False):
+            return response
+        response._metrics_recorded = True
+        from_cache = bool(getattr(response, "from_cache", False))
+        self.record_http(
+            _endpoint(response.url),
+            response.elapsed.total_seconds(),
+            len(response.content or b""),
+            from_cache,
+        )
+        return response
+
+    def instrument(self, session):
+        """
+        Record every response of a ``requests`` session (also cached
+        sessions) and return the session.
+        """
+        session.hooks["response"].append(self._response_hook)
+        return session
+
+    def recorder(self, run_id, progress=None):
+        """
+        Return a ``RunRecorder`` for one pipeline run.
+        """
+        return RunRecorder(self, run_id, progress)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [
+                    [name, dict(labels), value]
+                    for (name, labels), value in self._counters.items()
+                ],
+                "gauges": [
+                    [name, dict(labels), value]
+                    for (name, labels), value in self._gauges.items()
+                ],
+                "histograms": [
+                    [
+                        name,
+                        dict(labels),
+                        {**histogram, "counts": list(histogram["counts"])},
+                    ]
+                    for (name, labels), histogram in self._histograms.items()
+                ],
+            }
+
+    def flush(self):
+        """
+        Write the snapshot of this process when sharing is enabled.
+        """
+        if self.directory is None:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _snapshots(self):
+        if self.directory is None:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (FileNotFoundError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        """
+        Return the metrics of all processes in the Prometheus text format.
+        """
+        counters, gauges, histograms = {}, {}, {}
+        for snapshot in self._snapshots():
+            for name, labels, value in snapshot["counters"]:
+                key = (name, _labels_key(labels))
+                counters[key] = counters.get(key, 0.0) + value
+            for name, labels, value in snapshot["gauges"]:
+                key = (name, _labels_key(labels))
+                gauges[key] = max(gauges.get(key, value), value)
+            for name, labels, histogram in snapshot["histograms"]:
+                key = (name, _labels_key(labels))
+                merged = histograms.setdefault(
+                    key,
+                    {
+                        "buckets": histogram["buckets"],
+                        "counts": [0] * len(histogram["buckets"]),
+                        "sum": 0.0,
+                        "count": 0,
+                    },
+                )
+                merged["counts"] = [
+                    a + b for a, b in zip(merged["counts"], histogram["counts"])
+                ]
+                merged["sum"] += histogram["sum"]
+                merged["count"] += histogram["count"]
+
+        series = {}
+        for (name, labels), value in sorted({**counters, **gauges}.items()):
+            series.setdefault(name, []).append(f"{name}{_format(labels)} {value}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            lines = series.setdefault(name, [])
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                le = _format(labels + (("le", str(float(bound))),))
+                lines.append(f"{name}_bucket{le} {count}")
+            le = _format(labels + (("le", "+Inf"),))
+            lines.append(f"{name}_bucket{le} {histogram['count']}")
+            lines.append(f"{name}_sum{_format(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format(labels)} {histogram['count']}")
+
+        output = []
+        for name in sorted(series):
+            kind, description = HELP.get(name, ("untyped", name))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(series[name])
+        return "\n".join(output) + "\n"
+
+
+def _format(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RunRecorder:
+    """
+    Times the stages of one pipeline run.
+
+    Used as the ``progress`` callback of the pipeline: every call closes the
+    running stage (wall time, process CPU time and the peak RSS sampled in
+    the background) and starts the next one, then forwards the stage name to
+    the wrapped ``progress``. HTTP calls made while the run is active are
+    attributed to it (with several runs at once in a process every active
+    run sees them). On exit one JSON log line is printed for the run and
+    the registry is flushed.
+    """
+
+    def __init__(self, registry, run_id, progress=None, sample_interval=0.05):
+        self.registry = registry
+        self.run_id = run_id
+        self.progress = progress
+        self.sample_interval = sample_interval
+        self.stages = {}
+        self.http = {}
+        self._stage = None
+        self._peak_rss = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._started_at = time.perf_counter()
+        self._sampler = threading.Thread(
+            target=self._sample, name="metrics-rss", daemon=True
+        )
+        self._sampler.start()
+        with self.registry._lock:
+            self.registry._recorders.add(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._close_stage()
+        self._stop.set()
+        self._sampler.join()
+        with self.registry._lock:
+            self.registry._recorders.discard(self)
+
+        status = "failed" if exc_type else "done"
+        self.registry.inc("forecast_runs_total", {"status": status})
+        print(
+            json.dumps(
+                {
+                    "event": "forecast_run",
+                    "run_id": self.run_id,
+                    "status": status,
+                    "seconds": round(time.perf_counter() - self._started_at, 3),
+                    "stages": self.stages,
+                    "http": self.http,
+                },
+                ensure_ascii=False,
+            ),
+            flush=True,
+        )
+        self.registry.flush()
+        return False
+
+    def __call__(self, stage):
+        self._close_stage()
+        with self._lock:
+            self._peak_rss = _rss_bytes()
+        self._stage = (stage, time.perf_counter(), time.process_time())
+        if self.progress is not None:
+            self.progress(stage)
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            rss = _rss_bytes()
+            with self._lock:
+                self._peak_rss = max(self._peak_rss, rss)
+
+    def _close_stage(self):
+        if self._stage is None:
+            return
+        stage, started_at, cpu_started_at = self._stage
+        self._stage = None
+        wall = time.perf_counter() - started_at
+        cpu = time.process_time() - cpu_started_at
+        with self._lock:
+            peak_rss = max(self._peak_rss, _rss_bytes())
+        self.stages[stage] = {
+            "wall_seconds": round(wall, 3),
+            "cpu_seconds": round(cpu, 3),
+            "peak_rss_bytes": peak_rss,
+        }
+        self.registry.record_stage(stage, wall, cpu, peak_rss)
+
+    def add_http(self, endpoint, seconds, nbytes, from_cache):
+        with self._lock:
+            calls = self.http.setdefault(
+                endpoint, {"requests": 0, "cache_hits": 0, "bytes": 0, "seconds": 0.0}
+            )
+            calls["requests"] += 1
+            calls["bytes"] += nbytes
+            if from_cache:
+                calls["cache_hits"] += 1
+            else:
+                calls["seconds"] = round(calls["seconds"] + seconds, 3)
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,134 @@
+import os
+import json
+import shutil
+from datetime import datetime
+import catboost as cb
+
+# A bundle is a directory of .cbm files and this manifest (format, version,
+# one entry per model with its file and weight, training metadata)
+MANIFEST = "bundle.json"
+BUNDLE_FORMAT = 1
+
+
+def manifest_path(path: str) -> str:
+    return os.path.join(path, MANIFEST)
+
+
+def is_bundle(path: str) -> bool:
+    return os.path.isfile(manifest_path(path))
+
+
+def read_manifest(path: str) -> dict:
+    with open(manifest_path(path), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != BUNDLE_FORMAT:
+        raise ValueError(
+            f"Unsupported model bundle format {manifest.get('format')}: {path}"
+        )
+    return manifest
+
+
+def bundle_weights(manifest: dict, weights=None) -> list:
+    """
+    Normalized weights of the bundle models: ``weights`` (one per model in
+    manifest order) when given, else the weights of the manifest.
+    """
+    if weights is None:
+        weights = [model.get("weight", 1.0) for model in manifest["models"]]
+    if len(weights) != len(manifest["models"]):
+        raise ValueError(
+            f"{len(weights)} weights given for {len(manifest['models'])} models"
+        )
+    if any(weight < 0 for weight in weights) or sum(weights) <= 0:
+        raise ValueError(f"Ensemble weights must be non-negative: {weights}")
+    total = float(sum(weights))
+    return [weight / total for weight in weights]
+
+
+def load_bundle(path: str, weights=None) -> cb.CatBoost:
+    """
+    Load a model bundle as one CatBoost model.
+
+    The trees of all bundle models are merged into a single model with
+    ``cb.sum_models``, each model's leaf values scaled by its weight. A
+    prediction is then the weighted average of the model predictions, but
+    the features are converted and quantized once (on the union of the
+    models' borders) and all trees are evaluated in one pass, so scoring
+    the ensemble costs about the same as scoring one model of its size.
+    The CTR tables of the models are kept apart, which keeps the merged
+    predictions exact.
+
+    Args:
+        path (str): Bundle directory
+        weights (list, optional): Weight per model, overriding the manifest
+
+    Returns:
+        cb.CatBoost: Combined model
+    """
+    manifest = read_manifest(path)
+    models = []
+    for entry in manifest["models"]:
+        model = cb.CatBoostRegressor()
+        model.load_model(os.path.join(path, entry["file"]))
+        models.append(model)
+
+    features = models[0].feature_names_
+    cat_features = models[0].get_cat_feature_indices()
+    for entry, model in zip(manifest["models"], models):
+        if (
+            model.feature_names_ != features
+            or model.get_cat_feature_indices() != cat_features
+        ):
+            raise ValueError(
+                f"{entry['file']} was trained on other features than "
+                f"{manifest['models'][0]['file']}: {path}"
+            )
+
+    weights = bundle_weights(manifest, weights)
+    if len(models) == 1:
+        return models[0]
+    return cb.sum_models(models, weights=weights, ctr_merge_policy="KeepAllTables")
+
+
+def write_bundle(path: str, models: list, metadata: dict = None) -> dict:
+    """
+    Write a model bundle.
+
+    Args:
+        path (str): Bundle directory, replaced if it exists
+        models (list): ``(name, model, weight, info)`` per model; ``info``
+            is a JSON serializable dict stored with the model (e.g. its
+            split and validation metrics)
+        metadata (dict, optional): Extra manifest fields (e.g. the feature
+            list and the training config)
+
+    Returns:
+        dict: The manifest
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    entries = []
+    for name, model, weight, info in models:
+        file_name = f"{name}.cbm"
+        model.save_model(os.path.join(tmp_path, file_name))
+        entries.append({"file": file_name, "weight": weight, **(info or {})})
+
+    created_at = datetime.now()
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": created_at.strftime("%Y%m%d%H%M%S"),
+        "created_at": created_at.isoformat(timespec="seconds"),
+        "models": entries,
+        **(metadata or {}),
+    }
+    with open(manifest_path(tmp_path), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # Swap the directories; the old bundle is removed afterwards
+    old_path = f"{path}.{os.getpid()}.old"
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+import traceback
+import catboost as cb
+from utils.model_bundle import is_bundle, load_bundle, manifest_path
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of CatBoost models keyed by file path.
+
+    Each ``.cbm`` file is deserialized once per process. On access the file's
+    modification time and size are compared with the loaded copy (at most
+    once per ``check_interval`` seconds); a changed file is loaded into a new
+    model object which then replaces the old one in a single assignment, so
+    callers always get either the old or the new model, never a partial one.
+
+    A path may also be a model bundle directory (see ``utils.model_bundle``);
+    its models are combined into one ensemble model with the given weights
+    and the bundle manifest is watched for changes.
+    """
+
+    def __init__(self, check_interval: float = 5.0):
+        self.check_interval = check_interval
+        self._models = {}
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    def _key(self, path, weights):
+        return (os.path.abspath(path), None if weights is None else tuple(weights))
+
+    def _signature(self, path):
+        if os.path.isdir(path):
+            path = manifest_path(path)
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self, path, weights=None):
+        if is_bundle(path):
+            return load_bundle(path, weights=weights)
+        if weights is not None:
+            raise ValueError(f"Ensemble weights given for a single model: {path}")
+        model = cb.CatBoostRegressor()
+        model.load_model(path)
+        return model
+
+    def get(self, path: str, weights=None) -> cb.CatBoost:
+        """
+        Return the cached model for ``path``, reloading it if the file changed.
+
+        Args:
+            path (str): Path to a ``.cbm`` model file or a model bundle
+            weights (list, optional): Weight per bundle model, overriding the
+                weights of the bundle manifest
+
+        Returns:
+            cb.CatBoost: Loaded model
+        """
+        key = self._key(path, weights)
+        path = key[0]
+        entry = self._models.get(key)
+        now = time.monotonic()
+        if (
+            entry is not None
+            and now - self._checked_at.get(key, 0.0) < self.check_interval
+        ):
+            return entry[1]
+
+        try:
+            signature = self._signature(path)
+        except OSError:
+            # A bundle is briefly missing while write_bundle swaps it in
+            if entry is None:
+                raise
+            return entry[1]
+        self._checked_at[key] = now
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+            try:
+                model = self._load(path, weights)
+            except Exception:
+                # A model file caught mid-copy must not take serving down
+                if entry is None:
+                    raise
+                traceback.print_exc()
+                return entry[1]
+            self._models[key] = (signature, model)
+            return model
+
+    def version(self, path: str, weights=None) -> str:
+        """
+        Return an identifier of the currently loaded version of ``path``.
+        """
+        self.get(path, weights)
+        mtime_ns, size = self._models[self._key(path, weights)][0]
+        if weights is None:
+            return f"{mtime_ns}-{size}"
+        return f"{mtime_ns}-{size}-{list(weights)}"
+
+    def preload(self, *paths, weights=None):
+        """
+        Load the given models up front, e.g. in the gunicorn master before fork.
+        """
+        for path in paths:
+            self.get(path, weights)
+
+
+model_registry = ModelRegistry()
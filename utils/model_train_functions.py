@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 from sklearn.model_selection import TimeSeriesSplit
 import matplotlib.pyplot as plt
@@ -8,8 +9,12 @@ class ModelTrainFunctions:
         pass
 
     def get_data(self, data_path: str) -> pd.DataFrame:
-        historical_data = pd.read_parquet(data_path + "Historical_Data.parquet")
-        forecast_data = pd.read_parquet(data_path + "Forecast_Data.parquet")
+        historical_data = pd.read_parquet(
+            os.path.join(data_path, "Historical_Data.parquet")
+        )
+        forecast_data = pd.read_parquet(
+            os.path.join(data_path, "Forecast_Data.parquet")
+        )
         historical_data.index = pd.to_datetime(historical_data.index)
         forecast_data.index = pd.to_datetime(forecast_data.index)
         return historical_data, forecast_data
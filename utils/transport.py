@@ -0,0 +1,300 @@
+import os
+import json
+import gzip
+import base64
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MODES = ("passthrough", "record", "replay")
+
+# Form fields left out of cassette keys and files (EPİAŞ TGT request)
+REDACTED_FIELDS = {"username", "password"}
+
+# Stored instead of the answer to a request with credentials (the TGT
+# ticket), so that no live ticket is written to the cassettes
+REDACTED_BODY = b"TGT-redacted"
+
+# Time of the recording, the run time of every replay of the directory
+MANIFEST = "manifest.json"
+
+# Describe the raw transfer, not the decoded body that is stored
+_DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+class CassetteMiss(RuntimeError):
+    """
+    Raised in replay mode for a request that was not recorded.
+    """
+
+
+def _form_fields(request):
+    body = request.body
+    if body is None or "application/x-www-form-urlencoded" not in request.headers.get(
+        "Content-Type", ""
+    ):
+        return None
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+    return parse_qsl(body, keep_blank_values=True)
+
+
+def _canonical_body(request):
+    fields = _form_fields(request)
+    if fields is not None:
+        return urlencode(
+            sorted((key, value) for key, value in fields if key not in REDACTED_FIELDS)
+        )
+    body = request.body
+    if body is None:
+        return ""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+    if "json" in request.headers.get("Content-Type", ""):
+        try:
+            return json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False)
+        except ValueError:
+            return body
+    return body
+
+
+def _canonical_url(url):
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))
+
+
+class Transport:
+    """
+    Record/replay layer of the outbound data calls (EPİAŞ, Open-Meteo).
+
+    Every data session gets a ``CassetteAdapter`` through ``mount``. The
+    process-wide mode decides what the adapter does:
+
+    - ``passthrough``: plain HTTP, nothing is stored (default)
+    - ``record``: plain HTTP, every response is also written to a cassette
+    - ``replay``: responses come from the cassettes, the network is never
+      used; a request without a cassette raises ``CassetteMiss``
+
+    A cassette is ``<directory>/<key[:2]>/<key>.json.gz``; the key is a hash
+    of the method, the URL with sorted parameters and the normalized body
+    (credentials left out); the answer to a request with credentials is
+    stored as ``REDACTED_BODY``. Requests carry the dates of the day the run
+    is made, so the run time of the recording is kept in ``MANIFEST`` and a
+    replay runs as of that time (see ``now``). While recording or
+    replaying, the HTTP caches of the sessions are bypassed so that every
+    call reaches the adapter.
+
+    Only requests that reach the network are recorded, and the local stores
+    (EPİAŞ store and feature store, weather archive, exogenous store, solar
+    cache) decide which ones do. A replay therefore needs the stores in the
+    state they had when the recording started, e.g. by recording and
+    replaying with fresh store directories; with other stores it asks for
+    other date ranges and raises ``CassetteMiss``.
+
+    The mode is read from ``TRANSPORT_MODE`` and the directory from
+    ``TRANSPORT_CASSETTES`` at import; ``configure`` changes them before
+    the sessions are created.
+    """
+
+    def __init__(self):
+        self.mode = "passthrough"
+        self.directory = "data/cassettes"
+        self._recorded_at = None
+        self._recorded_dir = None
+        self.configure(
+            os.getenv("TRANSPORT_MODE", self.mode),
+            os.getenv("TRANSPORT_CASSETTES", self.directory),
+        )
+
+    def configure(self, mode: str = None, directory: str = None):
+        """
+        Set the mode and/or the cassette directory.
+        """
+        if mode is not None:
+            if mode not in MODES:
+                raise ValueError(f"Transport mode must be one of {MODES}: {mode}")
+            self.mode = mode
+        if directory is not None:
+            self.directory = directory
+        self._recorded_at = None
+        self._recorded_dir = None
+        return self
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def now(self) -> datetime:
+        """
+        Current time of the run, from which the request dates are derived.
+
+        While recording or replaying it is the time in ``MANIFEST``, so
+        every run recorded into a directory, and every replay of it, sends
+        the requests of the same run time. The first recording into a new
+        directory writes the clock there; a replay without a manifest uses
+        the clock. In passthrough mode it is the clock.
+        """
+        if self.mode == "passthrough":
+            return datetime.now()
+        if self._recorded_dir != self.directory:
+            self._recorded_at = self._read_manifest()
+            if self._recorded_at is None and self.mode == "record":
+                self._recorded_at = self._write_manifest(datetime.now())
+            self._recorded_dir = self.directory
+        return self._recorded_at or datetime.now()
+
+    def _read_manifest(self):
+        try:
+            with open(
+                os.path.join(self.directory, MANIFEST), "r", encoding="utf-8"
+            ) as f:
+                return datetime.fromisoformat(json.load(f)["recorded_at"])
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, recorded_at):
+        recorded_at = recorded_at.replace(microsecond=0)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, MANIFEST)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"recorded_at": recorded_at.isoformat()}, f)
+        try:
+            # Created only if missing; the first recording process wins
+            os.link(tmp_path, path)
+        except FileExistsError:
+            recorded_at = self._read_manifest()
+        finally:
+            os.remove(tmp_path)
+        return recorded_at
+
+    def mount(self, session):
+        """
+        Route the ``http`` and ``https`` requests of ``session`` through a
+        ``CassetteAdapter`` (keeping the retry and pool settings of the
+        adapters already mounted) and return the session.
+        """
+        for prefix in ("https://", "http://"):
+            current = session.get_adapter(prefix)
+            session.mount(
+                prefix,
+                CassetteAdapter(
+                    self,
+                    pool_connections=getattr(current, "_pool_connections", 10),
+                    pool_maxsize=getattr(current, "_pool_maxsize", 10),
+                    max_retries=getattr(current, "max_retries", 0),
+                    pool_block=getattr(current, "_pool_block", False),
+                ),
+            )
+        settings = getattr(session, "settings", None)
+        if settings is not None and hasattr(settings, "disabled"):
+            # requests_cache would answer before the adapter is reached
+            settings.disabled = self.mode != "passthrough"
+        return session
+
+    def key(self, request) -> str:
+        request_id = json.dumps(
+            [request.method, _canonical_url(request.url), _canonical_body(request)],
+            ensure_ascii=False,
+        )
+        return hashlib.sha1(request_id.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json.gz")
+
+    def record(self, request, response):
+        """
+        Write ``response`` (read completely) as the cassette of ``request``.
+        """
+        key = self.key(request)
+        fields = _form_fields(request) or []
+        body = response.content
+        if any(field in REDACTED_FIELDS for field, _ in fields):
+            body = REDACTED_BODY
+        cassette = {
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "request": {
+                "method": request.method,
+                "url": _canonical_url(request.url),
+                "body": _canonical_body(request),
+            },
+            "response": {
+                "status": response.status_code,
+                "reason": response.reason,
+                "headers": {
+                    name: value
+                    for name, value in response.headers.items()
+                    if name.lower() not in _DROPPED_HEADERS
+                },
+                "body": base64.b64encode(body).decode("ascii"),
+            },
+        }
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(cassette, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def replay(self, request, adapter):
+        """
+        Build the recorded response of ``request``.
+
+        Raises:
+            CassetteMiss: No cassette was recorded for the request
+        """
+        key = self.key(request)
+        try:
+            with gzip.open(self._path(key), "rt", encoding="utf-8") as f:
+                recorded = json.load(f)["response"]
+        except FileNotFoundError:
+            raise CassetteMiss(
+                f"No cassette for {request.method} {_canonical_url(request.url)} "
+                f"({key}) in {self.directory}"
+            ) from None
+
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.reason = recorded["reason"]
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = base64.b64decode(recorded["body"])
+        response.url = request.url
+        response.request = request
+        response.connection = adapter
+        response.elapsed = timedelta(0)
+        # Served locally; reported like an HTTP cache hit
+        response.from_cache = True
+        return response
+
+
+class CassetteAdapter(HTTPAdapter):
+    """
+    ``HTTPAdapter`` that records or replays through a ``Transport``.
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ["transport"]
+
+    def __init__(self, transport, **kwargs):
+        self.transport = transport
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if self.transport.mode == "replay":
+            return self.transport.replay(request, self)
+        response = super().send(request, **kwargs)
+        if self.transport.mode == "record":
+            self.transport.record(request, response)
+        return response
+
+
+transport = Transport()
@@ -0,0 +1,160 @@
+import zipfile
+import posixpath
+from functools import lru_cache
+from xml.etree.ElementTree import iterparse, parse
+import numpy as np
+import pandas as pd
+
+_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_DOC_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_ROW = _MAIN + "row"
+_VALUE = _MAIN + "v"
+_TEXT = _MAIN + "t"
+_DIGITS = "0123456789"
+
+
+@lru_cache(maxsize=None)
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def _sheet_path(archive, sheet_name):
+    workbook = parse(archive.open("xl/workbook.xml")).getroot()
+    properties = workbook.find(_MAIN + "workbookPr")
+    date1904 = properties is not None and properties.get("date1904") in ("1", "true")
+
+    sheets = workbook.find(_MAIN + "sheets")
+    if isinstance(sheet_name, int):
+        sheet = sheets[sheet_name]
+    else:
+        sheet = next((s for s in sheets if s.get("name") == sheet_name), None)
+        if sheet is None:
+            raise ValueError(f"Sayfa bulunamadi: {sheet_name}")
+
+    relations = parse(archive.open("xl/_rels/workbook.xml.rels")).getroot()
+    target = next(
+        rel.get("Target")
+        for rel in relations.iter(_PKG_REL + "Relationship")
+        if rel.get("Id") == sheet.get(_DOC_REL + "id")
+    )
+    if target.startswith("/"):
+        return target.lstrip("/"), date1904
+    return posixpath.normpath(posixpath.join("xl", target)), date1904
+
+
+def _shared_strings(archive):
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    root = parse(archive.open("xl/sharedStrings.xml")).getroot()
+    return ["".join(t.text or "" for t in item.iter(_TEXT)) for item in root]
+
+
+def _cell_value(cell, strings):
+    kind = cell.get("t")
+    if kind == "inlineStr":
+        return "".join(t.text or "" for t in cell.iter(_TEXT))
+    value = cell.findtext(_VALUE)
+    if value is None:
+        return None
+    if kind == "s":
+        return strings[int(value)]
+    if kind in ("str", "e"):
+        return value
+    if kind == "b":
+        return value == "1"
+    return float(value)
+
+
+def _to_numeric(values):
+    try:
+        return np.array(
+            [np.nan if value is None else value for value in values], dtype="float64"
+        )
+    except ValueError:
+        return np.array(values, dtype=object)
+
+
+def _to_datetime(values, date1904):
+    """
+    Excel serial day numbers (numeric cells) or date strings to datetimes.
+    """
+    serials = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce")
+    if serials.notna().sum() == sum(value is not None for value in values):
+        origin = "1904-01-01" if date1904 else "1899-12-30"
+        dates = pd.to_datetime(serials.to_numpy(), unit="D", origin=origin)
+        # Serial numbers are fractions of a day, drop the float noise
+        return dates.round("ms")
+    return pd.to_datetime(pd.Series(values, dtype=object)).to_numpy()
+
+
+def read_xlsx_columns(path, columns, sheet_name=0, date_columns=()):
+    """
+    Stream selected columns of an xlsx sheet without building a workbook.
+
+    The sheet XML is parsed row by row (``iterparse``) and every row is
+    discarded once the cells of ``columns`` are taken, so memory and time
+    grow with the selected cells only. The first row is the header. Numeric
+    cells are floats; ``date_columns`` are converted from Excel serial days
+    (or date strings) to datetimes.
+
+    Args:
+        path (str): xlsx file
+        columns (list): Header names to read
+        sheet_name (int | str): Sheet index or name
+        date_columns (list): Columns of ``columns`` that hold dates
+
+    Returns:
+        pd.DataFrame: One column per name in ``columns``, fully empty rows
+        skipped
+    """
+    with zipfile.ZipFile(path) as archive:
+        sheet_path, date1904 = _sheet_path(archive, sheet_name)
+        strings = _shared_strings(archive)
+
+        positions = None
+        data = [[] for _ in columns]
+        with archive.open(sheet_path) as sheet:
+            for _, element in iterparse(sheet):
+                if element.tag != _ROW:
+                    continue
+
+                cells = {}
+                next_index = 0
+                for cell in element:
+                    reference = cell.get("r")
+                    index = (
+                        _column_index(reference.rstrip(_DIGITS))
+                        if reference
+                        else next_index
+                    )
+                    next_index = index + 1
+                    if positions is None or index in positions:
+                        cells[index] = _cell_value(cell, strings)
+                element.clear()
+
+                if positions is None:
+                    header = {value: index for index, value in cells.items()}
+                    missing = [column for column in columns if column not in header]
+                    if missing:
+                        raise ValueError(f"Eksik sütunlar: {missing}")
+                    positions = {header[column]: i for i, column in enumerate(columns)}
+                    continue
+                if not any(value is not None for value in cells.values()):
+                    continue
+                for index, i in positions.items():
+                    data[i].append(cells.get(index))
+
+    if positions is None:
+        raise ValueError("Sayfa bos")
+
+    frame = {}
+    for column, values in zip(columns, data):
+        if column in date_columns:
+            frame[column] = _to_datetime(values, date1904)
+        else:
+            frame[column] = _to_numeric(values)
+    return pd.DataFrame(frame)